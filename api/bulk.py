@@ -0,0 +1,135 @@
+from django.db import connections, router, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from floorplans.signals import post_bulk_save
+
+
+def assign_changes(instance, data):
+    """
+    Set the values in `data` on `instance`, returning the list of model
+    fields whose value actually changed.
+
+    Fields computed from other fields (those with a `depends_on` attribute,
+    like GridCellField) are recomputed when one of their sources changed.
+    """
+    changed = []
+    for name, value in data.items():
+        field = instance._meta.get_field(name)
+        if field.primary_key:
+            continue
+        if field.is_relation:
+            current = getattr(instance, field.attname)
+            new = value.pk if value is not None else None
+        else:
+            current = getattr(instance, name)
+            new = value
+        if current != new:
+            setattr(instance, name, value)
+            changed.append(field)
+
+    names = {field.name for field in changed}
+    for field in instance._meta.concrete_fields:
+        if names.intersection(getattr(field, 'depends_on', ())):
+            current = getattr(instance, field.attname)
+            if field.pre_save(instance, False) != current:
+                changed.append(field)
+    return changed
+
+
+def bulk_update(model, changes):
+    """
+    Write back a dict of instance -> changed fields with one
+    UPDATE ... SET col = CASE WHEN id = ... END statement per batch, all in a
+    single transaction. Only the changed columns of each row are touched;
+    `auto_now` fields are bumped on every row that changed.
+    """
+    changes = {instance: fields for instance, fields in changes.items() if fields}
+    if not changes:
+        return 0
+
+    now = timezone.now()
+    auto_now_fields = [f for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+    for instance in changes:
+        for field in auto_now_fields:
+            setattr(instance, field.attname, now)
+
+    db = router.db_for_write(model)
+    updated = 0
+    with transaction.atomic(using=db):
+        for batch in _batches(changes, connections[db]):
+            cases = {}
+            for instance, fields in batch:
+                for field in fields:
+                    value = Value(getattr(instance, field.attname), output_field=field)
+                    cases.setdefault(field, []).append(When(pk=instance.pk, then=value))
+            values = {
+                field.attname: Case(*whens, default=F(field.attname), output_field=field)
+                for field, whens in cases.items()
+            }
+            for field in auto_now_fields:
+                values[field.attname] = now
+            pks = [instance.pk for instance, _ in batch]
+            updated += model._base_manager.db_manager(db).filter(pk__in=pks).update(**values)
+        # Sent inside the transaction, so what receivers write (search
+        # tokens, counters) commits with the rows.
+        update_fields = {field.name for fields in changes.values() for field in fields}
+        post_bulk_save.send(sender=model, instances=list(changes), created=False, update_fields=update_fields)
+    return updated
+
+
+def bulk_create(model, instances, batch_size=None):
+    """
+    Insert `instances` with batched multi-row INSERTs in one transaction and
+    set their primary keys.
+
+    Backends that return ids from a bulk insert (PostgreSQL) get them for
+    free. On SQLite the transaction holds the database write lock from the
+    first INSERT until commit, so the new rows are the newest `len(instances)`
+    AUTOINCREMENT ids and are read back in one query. Anything else falls back
+    to one INSERT per instance, which returns its id, still inside a single
+    transaction. Either way post_bulk_save is sent once, not post_save.
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+
+    db = router.db_for_write(model)
+    connection = connections[db]
+    manager = model._base_manager.db_manager(db)
+    with transaction.atomic(using=db):
+        if connection.features.can_return_ids_from_bulk_insert:
+            manager.bulk_create(instances, batch_size=batch_size)
+        elif connection.vendor == 'sqlite':
+            manager.bulk_create(instances, batch_size=batch_size)
+            pks = manager.order_by('-pk').values_list('pk', flat=True)[:len(instances)]
+            for instance, pk in zip(instances, reversed(list(pks))):
+                instance.pk = pk
+                instance._state.adding = False
+                instance._state.db = db
+        else:
+            # What Model.save() runs for an insert, without its signals.
+            fields = [field for field in model._meta.local_concrete_fields if field is not model._meta.auto_field]
+            for instance in instances:
+                instance.pk = manager._insert([instance], fields=fields, return_id=True)
+                instance._state.adding = False
+                instance._state.db = db
+        post_bulk_save.send(sender=model, instances=instances, created=True)
+    return instances
+
+
+def _batches(changes, connection):
+    # Every changed value costs two query parameters (the WHEN pk and the
+    # THEN value) plus one for the row's pk in the WHERE clause, so keep each
+    # statement under the backend's parameter limit (999 on SQLite).
+    max_params = connection.features.max_query_params
+    batch, params = [], 1
+    for instance, fields in changes.items():
+        cost = 2 * len(fields) + 1
+        if max_params and batch and params + cost > max_params:
+            yield batch
+            batch, params = [], 1
+        batch.append((instance, fields))
+        params += cost
+    if batch:
+        yield batch
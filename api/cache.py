@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+from rest_framework.renderers import JSONRenderer
+
+from floorplans.models import FloorPlan
+from sat.routers import primary_reads
+from .conditional import floorplan_version
+from .serializers import FloorPlanSerializer
+
+
+def get_floorplan_json(pk, request=None, version=None):
+    """
+    Return FloorPlanSerializer's output for floor plan `pk` rendered to JSON
+    bytes, serializing only on a cache miss.
+
+    Entries are keyed by the floor plan's version, the ETag from
+    floorplan_version(), which is read from the database on every request
+    (pass it as `version` when it is already known). Every process, whatever
+    its cache backend, stops using an entry as soon as the floor plan or one
+    of its locations is written, without having to be told. Image URLs are
+    absolute when a request is given, so entries are kept per host as well.
+
+    Entries are filled from the primary database: the version may come from
+    a lagging replica, and the body stored under it must never be older.
+    """
+    if version is None:
+        _, version, _ = floorplan_version(pk)
+    variant = request.build_absolute_uri('/') if request is not None else 'relative'
+    key = 'floorplan:{}:{}:json:{}'.format(pk, version, variant)
+    content = cache.get(key)
+    if content is None:
+        with primary_reads():
+            floorplan = get_object_or_404(FloorPlan.objects.for_serializer(), pk=pk)
+            serializer = FloorPlanSerializer(floorplan, context={'request': request})
+            content = JSONRenderer().render(serializer.data)
+        cache.set(key, content, settings.FLOORPLAN_CACHE_TIMEOUT)
+    return content
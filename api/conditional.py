@@ -0,0 +1,104 @@
+import re
+from functools import wraps
+
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from floorplans.models import FloorPlan
+
+
+# The weak marker and format suffix of the ETags of one version (see
+# representation_etag).
+re_etag_variant = re.compile(r'W/|\+[\w.-]+(?=")')
+
+
+def floorplan_version(pk):
+    """
+    Return (floorplan, etag, last_modified) for the floor plan `pk` in one
+    query. The floor plan instance only has the fields needed for
+    permission checks loaded.
+
+    The validator combines the floor plan's own timestamp with the newest
+    timestamp and the number of its locations, so any write to the floor
+    plan or to one of its locations changes it.
+    """
+    floorplan = get_object_or_404(
+        FloorPlan.objects.with_version().only('id', 'owner', 'is_public', 'last_updated'),
+        pk=pk)
+    last_updated = floorplan.last_updated
+    if floorplan.locations_updated is not None:
+        last_updated = max(last_updated, floorplan.locations_updated)
+    etag = quote_etag('{}-{}-{}'.format(floorplan.id,
+                                        int(last_updated.timestamp() * 1000000),
+                                        floorplan.locations_count))
+    return floorplan, etag, int(last_updated.timestamp())
+
+
+def representation_etag(etag, request):
+    """
+    The ETag of the version `etag` in the format negotiated for `request`.
+    Every format has its own bytes, so all but JSON append their name.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if renderer is None or renderer.format == 'json':
+        return etag
+    return '{}+{}"'.format(etag[:-1], renderer.format)
+
+
+def conditional(method):
+    """
+    Decorate an APIView handler for a floor plan (`pk` in the URL) with
+    conditional request support, checked before the handler runs:
+
+    * GET/HEAD with a matching If-None-Match (or If-Modified-Since) gets a
+      304 without touching the serializer, and every full response carries
+      ETag and Last-Modified. The ETag names the negotiated format, and
+      responses vary on Accept.
+    * PUT/POST with an If-Match that no longer matches gets a 412, so
+      concurrent editors do not overwrite each other. Successful writes
+      return the new ETag to use next time.
+
+    Writes with an If-Match run in one transaction holding the floor plan
+    row lock, taken before the version is checked: of two editors sending
+    the same ETag, the second waits for the first to commit and then gets
+    its 412.
+    """
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') or 'HTTP_IF_MATCH' not in request.META:
+            return respond(view, request, *args, **kwargs)
+        with transaction.atomic():
+            FloorPlan.objects.select_for_update().filter(pk=kwargs['pk']).exists()
+            return respond(view, request, *args, **kwargs)
+
+    def respond(view, request, *args, **kwargs):
+        floorplan, version, last_modified = floorplan_version(kwargs['pk'])
+        view.check_object_permissions(request, floorplan)
+
+        # Compressed responses carry the ETag weakened (W/"..."), which a
+        # strong If-Match comparison would always reject, and other formats
+        # a suffix. All of them hold the same version, which is what writes
+        # are checked against.
+        if 'HTTP_IF_MATCH' in request.META:
+            request.META['HTTP_IF_MATCH'] = re_etag_variant.sub('', request.META['HTTP_IF_MATCH'])
+            etag = version
+        else:
+            etag = representation_etag(version, request)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            # The version checked, for handlers serving cached content by
+            # version.
+            view.floorplan_etag = version
+            response = method(view, request, *args, **kwargs)
+            if request.method not in ('GET', 'HEAD'):
+                if not 200 <= response.status_code < 300:
+                    return response
+                _, version, last_modified = floorplan_version(kwargs['pk'])
+            response['ETag'] = representation_etag(version, request)
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept',))
+        return response
+    return wrapper
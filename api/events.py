@@ -0,0 +1,255 @@
+import asyncio
+import collections
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .serializers import LocationDeltaSerializer
+
+
+class Subscription:
+    """
+    Messages published to one channel since subscribing, in order. A
+    subscriber that falls more than `maxsize` messages behind is marked
+    overflowed and stops receiving; it has to resynchronise.
+
+    Messages can be awaited from an event loop with aget() as well as
+    waited for in a thread with get().
+    """
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._messages = collections.deque()
+        self._ready = threading.Condition()
+        self._waiter = None
+
+    def put(self, message):
+        with self._ready:
+            if len(self._messages) < self.maxsize:
+                self._messages.append(message)
+            else:
+                self.overflowed = True
+            self._ready.notify()
+            waiter = self._waiter
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_wake, future)
+        if self.overflowed:
+            self.close()
+
+    def get(self, timeout):
+        """
+        Return the next message, or None when none arrived within `timeout`
+        seconds.
+        """
+        with self._ready:
+            if not self._messages and not self.overflowed:
+                self._ready.wait(timeout)
+            return self._messages.popleft() if self._messages else None
+
+    async def aget(self, timeout):
+        """
+        Like get(), without blocking the event loop while waiting.
+        """
+        loop = asyncio.get_event_loop()
+        with self._ready:
+            if self._messages or self.overflowed:
+                return self._messages.popleft() if self._messages else None
+            future = loop.create_future()
+            self._waiter = (loop, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._ready:
+            self._waiter = None
+            return self._messages.popleft() if self._messages else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LocalBroker:
+    """
+    Fans messages out to the subscribers of a channel within this process.
+
+    Only processes that share the broker see each other's messages, so this
+    suits a single server process with threads. A broker for several
+    processes provides the same has_subscribers(), publish(), subscribe()
+    and unsubscribe() and is configured with LOCATION_EVENTS_BROKER.
+    """
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def has_subscribers(self, channel):
+        return channel in self._channels
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.maxsize)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._channels.pop(subscription.channel, None)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.LOCATION_EVENTS_BROKER)()
+        return _broker
+
+
+def floorplan_channel(pk):
+    return 'floorplan:{}:locations'.format(pk)
+
+
+def publish_locations(locations):
+    """
+    Broadcast the written `locations` to the subscribers of their floor
+    plans once the current transaction commits, as a LocationDeltaSerializer
+    document. Nothing is sent if it rolls back.
+
+    Each document is rendered once, whatever the number of subscribers, and
+    not at all for floor plans nobody is watching.
+    """
+    by_floorplan = {}
+    for location in locations:
+        by_floorplan.setdefault(location.floorplan_id, []).append(location)
+
+    def publish():
+        broker = get_broker()
+        for floorplan_id, locations in by_floorplan.items():
+            channel = floorplan_channel(floorplan_id)
+            if not broker.has_subscribers(channel):
+                continue
+            cursor = max(location.last_updated for location in locations)
+            broker.publish(channel, delta_event(cursor, locations))
+    transaction.on_commit(publish)
+
+
+def delta_event(cursor, locations):
+    """
+    A server-sent event of locations changed up to `cursor`. The event id is
+    the cursor, which the browser sends back as Last-Event-ID when it
+    reconnects.
+    """
+    data = LocationDeltaSerializer({'cursor': cursor, 'locations': locations}).data
+    return sse_event(JSONRenderer().render(data), id=data['cursor'], event='locations')
+
+
+def sse_event(data, id=None, event=None):
+    lines = []
+    if id is not None:
+        lines.append(b'id: ' + id.encode('utf-8'))
+    if event is not None:
+        lines.append(b'event: ' + event.encode('utf-8'))
+    lines.append(b'data: ' + data)
+    return b'\n'.join(lines) + b'\n\n'
+
+
+class EventStream:
+    """
+    Server-sent events from `subscription`, with keep-alive comments while
+    idle, until LOCATION_EVENTS_MAX_AGE has passed. A subscriber that fell
+    behind gets a `resync` event, telling it to reload.
+
+    Iterating the stream blocks its thread while waiting for events; under
+    ASGI (see sat.asgi) it is iterated asynchronously instead and holds no
+    thread. The response closes the stream when the client goes away,
+    which unsubscribes it even if iteration never started.
+    """
+    def __init__(self, subscription, first_events=()):
+        self.subscription = subscription
+        self.first_events = first_events
+
+    def __iter__(self):
+        deadline = time.monotonic() + settings.LOCATION_EVENTS_MAX_AGE
+        yield b'retry: 3000\n\n'
+        yield from self.first_events
+        while time.monotonic() < deadline:
+            message = self.subscription.get(timeout=self._timeout(deadline))
+            if self.subscription.overflowed:
+                yield sse_event(b'{}', event='resync')
+                return
+            yield message if message is not None else b': keepalive\n\n'
+
+    async def __aiter__(self):
+        deadline = time.monotonic() + settings.LOCATION_EVENTS_MAX_AGE
+        yield b'retry: 3000\n\n'
+        for event in self.first_events:
+            yield event
+        while time.monotonic() < deadline:
+            message = await self.subscription.aget(timeout=self._timeout(deadline))
+            if self.subscription.overflowed:
+                yield sse_event(b'{}', event='resync')
+                return
+            yield message if message is not None else b': keepalive\n\n'
+
+    def _timeout(self, deadline):
+        return max(min(settings.LOCATION_EVENTS_KEEPALIVE, deadline - time.monotonic()), 0)
+
+    def close(self):
+        self.subscription.close()
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """
+    A text/event-stream response of an EventStream, which ASGI servers can
+    consume through `async_streaming_content`.
+    """
+    def __init__(self, stream, *args, **kwargs):
+        kwargs.setdefault('content_type', 'text/event-stream')
+        super(EventStreamResponse, self).__init__(stream, *args, **kwargs)
+        self.stream = stream
+        self['Cache-Control'] = 'no-cache'
+        # Keeps nginx from buffering the stream.
+        self['X-Accel-Buffering'] = 'no'
+
+    @property
+    def async_streaming_content(self):
+        return self.stream.__aiter__()
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views negotiate text/event-stream. Their event streams bypass
+    rendering; only error responses are rendered, as a JSON `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event(json.dumps(data).encode('utf-8'), event='error')
@@ -0,0 +1,117 @@
+import csv
+import json
+
+from rest_framework import serializers
+
+
+# Rows fetched from the database cursor, and rows per chunk of output.
+CHUNK_SIZE = 2000
+
+FIELDS = (
+    'id',
+    'floorplan',
+    'floorplan__name',
+    'name',
+    'loc_type',
+    'details',
+    'extension',
+    'position_x',
+    'position_y',
+    'last_updated',
+)
+
+# Column names in the output.
+COLUMNS = tuple(field.replace('__', '_') for field in FIELDS)
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'geojson': 'application/geo+json',
+}
+
+
+def export_locations(locations, format):
+    """
+    Yield the non-trashed Locations of the `locations` queryset as chunks of
+    NDJSON, CSV (with a header row) or GeoJSON text, ordered by floor plan.
+
+    Rows are read with a server-side cursor where the backend has one, a
+    CHUNK_SIZE batch at a time, so memory use does not grow with the
+    number of locations.
+
+    GeoJSON points are in floor plan image coordinates: pixels from the top
+    left corner of the image, with y growing downwards.
+    """
+    fields = FIELDS + ('floorplan__width', 'floorplan__height') if format == 'geojson' else FIELDS
+    rows = (locations.filter(is_trashed=False, floorplan__is_trashed=False)
+                     .order_by('floorplan', 'id')
+                     .values_list(*fields)
+                     .iterator(chunk_size=CHUNK_SIZE))
+    rows = (_row(values) for values in rows)
+    if format == 'ndjson':
+        chunks = _ndjson(rows)
+    elif format == 'csv':
+        chunks = _csv(rows)
+    else:
+        chunks = _geojson(rows)
+    return _buffered(chunks)
+
+
+def _row(values):
+    row = dict(zip(COLUMNS, values))
+    row['last_updated'] = _datetime.to_representation(row['last_updated'])
+    if len(values) > len(COLUMNS):
+        row['width'], row['height'] = values[len(COLUMNS):]
+    return row
+
+
+_datetime = serializers.DateTimeField()
+
+
+def _ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+class _Echo:
+    # A file-like object for csv.writer that hands back what is written.
+    def write(self, value):
+        return value
+
+
+def _csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([row[column] for column in COLUMNS])
+
+
+def _geojson(rows):
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    for row in rows:
+        width, height = row.pop('width'), row.pop('height')
+        feature = {
+            'type': 'Feature',
+            'id': row['id'],
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [row['position_x'] * width, row['position_y'] * height],
+            },
+            'properties': row,
+        }
+        yield separator + json.dumps(feature)
+        separator = ',\n'
+    yield ']}\n'
+
+
+def _buffered(chunks):
+    # One write per CHUNK_SIZE rows rather than per row.
+    buffer = []
+    for chunk in chunks:
+        buffer.append(chunk)
+        if len(buffer) >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,84 @@
+import csv
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from rest_framework import serializers
+
+from floorplans.models import Location
+from .bulk import bulk_create
+from .serializers import LocationImportSerializer
+
+
+# Only the first errors are reported in full; the rest are just counted.
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'ndjson')
+
+ImportResult = namedtuple('ImportResult', ['created', 'failed', 'errors'])
+
+
+def read_rows(stream, format):
+    """
+    Yield (line number, row) for each record of a binary CSV (with a header
+    row) or NDJSON stream, reading it a line at a time. Rows that cannot be
+    parsed are yielded as a ValidationError instead of a dict.
+    """
+    lines = _text_lines(stream)
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty cells count as missing, so optional columns get their
+            # defaults instead of failing to parse as numbers.
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}
+    else:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, serializers.ValidationError('Invalid JSON: {}'.format(e))
+                continue
+            if not isinstance(row, dict):
+                row = serializers.ValidationError('Expected a JSON object.')
+            yield number, row
+
+
+def import_locations(floorplan, rows, chunk_size=None):
+    """
+    Validate rows from read_rows() and insert them as Locations of
+    `floorplan`, a chunk of valid rows per batched INSERT.
+
+    Invalid rows are skipped and reported; they never abort the import.
+    Nothing but the current chunk is held in memory, so the stream can be
+    arbitrarily long. Returns an ImportResult with the number of created
+    and failed rows and the first MAX_REPORTED_ERRORS errors.
+    """
+    chunk_size = chunk_size or settings.BULK_CREATE_BATCH_SIZE
+    # One serializer validates every row, as a ListSerializer would.
+    serializer = LocationImportSerializer()
+    created, failed, errors = 0, 0, []
+    chunk = []
+    for number, row in rows:
+        try:
+            if isinstance(row, serializers.ValidationError):
+                raise row
+            chunk.append(Location(floorplan=floorplan, **serializer.run_validation(row)))
+        except serializers.ValidationError as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': number, 'errors': e.detail})
+        if len(chunk) >= chunk_size:
+            created += len(bulk_create(Location, chunk, batch_size=chunk_size))
+            chunk = []
+    created += len(bulk_create(Location, chunk, batch_size=chunk_size))
+    return ImportResult(created, failed, errors)
+
+
+def _text_lines(stream):
+    for number, line in enumerate(stream):
+        line = line.decode('utf-8')
+        if number == 0:
+            line = line.lstrip('\ufeff')
+        yield line
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from floorplans.models import FloorPlan, Location
+from api.exports import CONTENT_TYPES, export_locations
+
+
+class Command(BaseCommand):
+    help = 'Export the Locations of a floor plan, or of all floor plans of a user, as NDJSON, CSV or GeoJSON.'
+
+    def add_arguments(self, parser):
+        scope = parser.add_mutually_exclusive_group()
+        scope.add_argument('--floorplan', type=int, help='Id of the floor plan to export.')
+        scope.add_argument('--user', help='Username whose floor plans to export.')
+        parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--output', help='File to write to (default: standard output).')
+
+    def handle(self, *args, **options):
+        if options['floorplan'] is not None:
+            if not FloorPlan.objects.filter(pk=options['floorplan']).exists():
+                raise CommandError('Floor plan {} does not exist'.format(options['floorplan']))
+            locations = Location.objects.filter(floorplan_id=options['floorplan'])
+        elif options['user'] is not None:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('User {} does not exist'.format(options['user']))
+            locations = Location.objects.filter(floorplan__owner=user)
+        else:
+            raise CommandError('Give --floorplan or --user')
+
+        chunks = export_locations(locations, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,40 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from floorplans.models import FloorPlan
+from api.imports import FORMATS, import_locations, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import Locations into a floor plan from a CSV (with a header row) or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('floorplan_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='File format; guessed from the file extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows per batched INSERT (default: BULK_CREATE_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        try:
+            floorplan = FloorPlan.objects.get(pk=options['floorplan_id'])
+        except FloorPlan.DoesNotExist:
+            raise CommandError('Floor plan {} does not exist'.format(options['floorplan_id']))
+
+        format = options['format']
+        if format is None:
+            extension = os.path.splitext(options['path'])[1].lower()
+            format = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension)
+            if format is None:
+                raise CommandError('Cannot tell the format of {}; use --format'.format(options['path']))
+
+        with open(options['path'], 'rb') as f:
+            result = import_locations(floorplan, read_rows(f, format), options['chunk_size'])
+
+        for error in result.errors:
+            self.stderr.write('Line {}: {}'.format(error['line'], error['errors']))
+        if result.failed > len(result.errors):
+            self.stderr.write('... and {} more invalid rows'.format(result.failed - len(result.errors)))
+        self.stdout.write('Created {} locations, skipped {} invalid rows'.format(result.created, result.failed))
@@ -0,0 +1,69 @@
+import json
+import math
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, p):
+    # Nearest rank of a sorted list.
+    return values[max(0, int(math.ceil(p / 100 * len(values))) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Summarize the request log written by sat.middleware.PerformanceMiddleware: '
+            'latency percentiles and queries per route, and the flagged slow and repeated queries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='*',
+                            help='Log files to read, - for standard input (default: PERF_LOG_FILE).')
+        parser.add_argument('--min-requests', type=int, default=1,
+                            help='Leave out routes with fewer requests.')
+
+    def handle(self, *args, **options):
+        paths = options['logs'] or [settings.PERF_LOG_FILE]
+        if not all(paths):
+            raise CommandError('Give a log file, or set SAT_PERF_LOG')
+
+        routes = defaultdict(list)
+        flagged = defaultdict(int)
+        for path in paths:
+            try:
+                f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+            except OSError as e:
+                raise CommandError('Cannot read {}: {}'.format(path, e))
+            with f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('event') == 'request':
+                        routes[(entry['method'], entry['route'] or entry['path'])].append(entry)
+                    elif entry.get('event') in ('slow_query', 'repeated_query'):
+                        flagged[(entry['event'], entry['route'] or entry['path'], entry['sql'])] += 1
+
+        rows = []
+        for (method, route), entries in routes.items():
+            if len(entries) < options['min_requests']:
+                continue
+            latencies = sorted(entry['total_ms'] for entry in entries)
+            rows.append((
+                '{} {}'.format(method, route), len(entries),
+                percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+                sum(entry['queries'] for entry in entries) / len(entries),
+                sum(entry['db_ms'] for entry in entries) / len(entries),
+            ))
+        rows.sort(key=lambda row: row[4], reverse=True)
+
+        self.stdout.write('{:<44} {:>7} {:>9} {:>9} {:>9} {:>8} {:>8}'.format(
+            'route', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'db ms'))
+        for row in rows:
+            self.stdout.write('{:<44} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f} {:>8.1f}'.format(*row))
+
+        if flagged:
+            self.stdout.write('\nFlagged queries:')
+            for (event, route, sql), count in sorted(flagged.items(), key=lambda item: -item[1]):
+                self.stdout.write('{:>5}x {} {}: {}'.format(count, event, route, sql[:200]))
@@ -0,0 +1,100 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest first pagination on (timestamp_field, id).
+
+    The cursor is the position of the last item of a page, so each page is
+    an index range scan from that point however deep the client pages,
+    and rows written meanwhile are neither skipped nor repeated.
+
+    Views listing an OR of conditions, which no single index returns in
+    order, can define get_keyset_parts() returning one queryset per
+    condition. The page's positions are then read from each part's own
+    index and merged, and its rows loaded from the view's queryset by id.
+    """
+    timestamp_field = 'last_updated'
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if hasattr(view, 'get_keyset_parts'):
+            positions = set()
+            for part in view.get_keyset_parts():
+                positions.update(self.page_of(part, position).values_list(self.timestamp_field, 'id'))
+            positions = sorted(positions, reverse=True)[:self.limit + 1]
+            self.has_next = len(positions) > self.limit
+            rows = queryset.in_bulk([pk for _, pk in positions[:self.limit]])
+            self.page = [rows[pk] for _, pk in positions[:self.limit] if pk in rows]
+            return self.page
+        results = list(self.page_of(queryset, position))
+        self.has_next = len(results) > self.limit
+        self.page = results[:self.limit]
+        return self.page
+
+    def page_of(self, queryset, position):
+        """
+        The rows of `queryset` after `position`, newest first, one more than
+        the page size to tell whether there is a next page.
+        """
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(
+                Q(**{self.timestamp_field + '__lt': timestamp}) |
+                Q(**{self.timestamp_field: timestamp, 'id__lt': pk}))
+        return queryset.order_by('-' + self.timestamp_field, '-id')[:self.limit + 1]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(getattr(last, self.timestamp_field), last.id))
+
+    def encode_cursor(self, timestamp, pk):
+        position = '{}|{}'.format(timestamp.isoformat(), pk)
+        return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
@@ -3,4 +3,9 @@ from rest_framework import permissions
 
 class IsOwnerOrFloorPlanIsPublic(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.is_public or obj.owner == request.user
+        return obj.is_public or obj.owner_id == request.user.id
+
+
+class IsFloorPlanOwner(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.id
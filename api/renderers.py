@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+
+from floorplans.models import LOCATION_TYPES
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+LOC_TYPES = [code for code, _ in LOCATION_TYPES]
+
+
+def columnar(data):
+    """
+    Rewrite location lists in serializer output as parallel arrays.
+
+    A top level list, or the value of any `locations` key, becomes
+
+        {"count": 2,
+         "loc_types": ["DESK", ...],
+         "floorplan": 3,
+         "columns": {"id": [1, 2], "loc_type": [0, 0], "position_x": [...], ...}}
+
+    where `loc_type` holds indexes into `loc_types`, and `floorplan` is
+    lifted out of the columns when every location has the same one. Other
+    values are left as they are.
+    """
+    if isinstance(data, list):
+        return _columns(data)
+    return _columnar_value(data)
+
+
+def _columnar_value(value):
+    if isinstance(value, dict):
+        return OrderedDict(
+            (key, _columns(item) if key == 'locations' and isinstance(item, list) else _columnar_value(item))
+            for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return [_columnar_value(item) for item in value]
+    return value
+
+
+def _columns(rows):
+    columns = OrderedDict((name, []) for name in (rows[0] if rows else ()))
+    for row in rows:
+        for name, values in columns.items():
+            values.append(row[name])
+    result = OrderedDict([('count', len(rows)), ('loc_types', LOC_TYPES)])
+    if 'loc_type' in columns:
+        index = {code: i for i, code in enumerate(LOC_TYPES)}
+        columns['loc_type'] = [index[code] for code in columns['loc_type']]
+    floorplans = set(columns.get('floorplan', ()))
+    if len(floorplans) == 1:
+        result['floorplan'] = floorplans.pop()
+        del columns['floorplan']
+    result['columns'] = columns
+    return result
+
+
+def _is_error(renderer_context):
+    response = (renderer_context or {}).get('response', None)
+    return response is not None and response.status_code >= 400
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    JSON with locations as parallel arrays (see columnar()), for clients
+    that send `Accept: application/vnd.sat.columnar+json`. Error responses
+    are plain JSON.
+    """
+    media_type = 'application/vnd.sat.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not _is_error(renderer_context):
+            data = columnar(data)
+        return super(ColumnarJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    The columnar layout encoded as MessagePack, for `Accept:
+    application/msgpack`. Only offered when msgpack is installed.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not _is_error(renderer_context):
+            data = columnar(data)
+        # Dates and other non-MessagePack types as JSON would write them.
+        return msgpack.packb(data, default=JSONRenderer.encoder_class().default, use_bin_type=True)
+
+
+# Renderers of the views returning many locations.
+LOCATION_RENDERERS = (JSONRenderer, BrowsableAPIRenderer, ColumnarJSONRenderer)
+if msgpack is not None:
+    LOCATION_RENDERERS += (MessagePackRenderer,)
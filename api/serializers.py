@@ -1,24 +1,64 @@
+import math
+import operator
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
 from rest_framework import serializers
-from floorplans.models import User, FloorPlan, Location
+from floorplans.images import TILE_SIZE, max_level, preview_path, tile_url_template
+from floorplans.models import BOOKABLE_TYPES, Booking, FloorPlan, Location, LOCATION_TYPES, max_booking_duration
+from floorplans.thumbnails import thumbnail_url
+from sat.perf import timed
+from .bulk import assign_changes, bulk_create, bulk_update
+
+
+class TimedSerializerMixin:
+    """
+    Counts the time spent in to_representation() as the request's
+    `serialize` timing (see sat.perf).
+    """
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super(TimedSerializerMixin, self).to_representation(instance)
+
+
+class FloorPlanPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks each floor plan up once per serializer instead of once per
+    location when validating a list of locations.
+    """
+    def to_internal_value(self, data):
+        if not isinstance(data, (int, str)):
+            return super(FloorPlanPrimaryKeyField, self).to_internal_value(data)
+        floorplans = self.__dict__.setdefault('_floorplans', {})
+        if data not in floorplans:
+            floorplans[data] = super(FloorPlanPrimaryKeyField, self).to_internal_value(data)
+        return floorplans[data]
 
 
-class LocationUpdateListSerializer(serializers.ListSerializer):
+class LocationUpdateListSerializer(TimedSerializerMixin, serializers.ListSerializer):
     def update(self, instances, validated_data):
         # Maps for id->location instance and id->data item.
         location_mapping = {location.id: location for location in instances}
         data_mapping = {item['id']: item for item in validated_data}
 
+        # Apply each item to its instance, then write every changed row in
+        # one batched UPDATE instead of one save() per location.
         ret = []
+        changes = {}
         for location_id, data in data_mapping.items():
             location = location_mapping.get(location_id, None)
             if location is not None:
-                ret.append(self.child.update(location, data))
+                changes[location] = assign_changes(location, data)
+                ret.append(location)
 
+        bulk_update(Location, changes)
         return ret
 
 
 class LocationUpdateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField()
+    floorplan = FloorPlanPrimaryKeyField(queryset=FloorPlan.objects.all())
 
     class Meta:
         model = Location
@@ -36,16 +76,57 @@ class LocationUpdateSerializer(serializers.ModelSerializer):
             'last_updated'
         )
 
-class LocationCreateListSerializer(serializers.ListSerializer):
-    def create(self, validated_data):
-        ret = []
-        for location in validated_data:
-            ret.append(self.child.create(location))
+class LocationReadListSerializer(serializers.ListSerializer):
+    """
+    Read-only list output of LocationReadSerializer, built without DRF's
+    per-field to_representation() calls.
+
+    Unevaluated querysets are read with values_list(), so no Location is
+    instantiated; locations that are already loaded (prefetched, or a list)
+    are read with one attrgetter per row. The values come straight from the
+    database, which already has the types the fields would produce; only
+    `last_updated` needs formatting.
+    """
+    def to_representation(self, data):
+        with timed('serialize'):
+            return self._rows(data)
+
+    def _rows(self, data):
+        fields = self.child.Meta.fields
+        if isinstance(data, models.Manager):
+            data = data.all()
+        if isinstance(data, models.QuerySet) and data._result_cache is None:
+            rows = data.values_list(*fields)
+        else:
+            opts = self.child.Meta.model._meta
+            rows = map(operator.attrgetter(*(opts.get_field(name).attname for name in fields)), data)
+        last_updated = fields.index('last_updated')
+        to_datetime = serializers.DateTimeField().to_representation
+        output = []
+        for values in rows:
+            row = dict(zip(fields, values))
+            row['last_updated'] = to_datetime(values[last_updated])
+            output.append(row)
+        return output
 
-        return ret
+
+class LocationReadSerializer(LocationUpdateSerializer):
+    """
+    LocationUpdateSerializer for output only, with a fast path for lists.
+    """
+    class Meta(LocationUpdateSerializer.Meta):
+        list_serializer_class = LocationReadListSerializer
+
+
+class LocationCreateListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    def create(self, validated_data):
+        locations = [Location(**location) for location in validated_data]
+        return bulk_create(Location, locations, batch_size=settings.BULK_CREATE_BATCH_SIZE)
 
 
 class LocationCreateSerializer(serializers.ModelSerializer):
+    floorplan = FloorPlanPrimaryKeyField(queryset=FloorPlan.objects.all())
+
     class Meta:
         model = Location
         list_serializer_class = LocationCreateListSerializer
@@ -63,18 +144,90 @@ class LocationCreateSerializer(serializers.ModelSerializer):
         )
 
 
-class FloorPlanSerializer(serializers.ModelSerializer):
-    locations = LocationCreateSerializer(many=True, read_only=True)
+class LocationImportSerializer(serializers.ModelSerializer):
+    """
+    A row of a location import; the floor plan comes from the URL.
+    """
+    class Meta:
+        model = Location
+        fields = (
+            'name',
+            'loc_type',
+            'details',
+            'extension',
+            'position_x',
+            'position_y',
+            'is_trashed',
+        )
+
+
+class ImportReportSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    failed = serializers.IntegerField()
+    errors = serializers.ListField(child=serializers.DictField())
+
+
+class ThumbnailField(serializers.Field):
+    """
+    Absolute URL of a floor plan's thumbnail, fitting a `size` pixel square.
+    """
+    def __init__(self, size=None, **kwargs):
+        self.size = size
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super(ThumbnailField, self).__init__(**kwargs)
+
+    def to_representation(self, obj):
+        url = thumbnail_url(obj, self.size)
+        request = self.context.get('request', None)
+        if url is not None and request is not None:
+            url = request.build_absolute_uri(url)
+        return url
+
+
+class FloorPlanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    locations = LocationReadSerializer(many=True, read_only=True)
     image = serializers.ImageField(read_only=True, required=False)
     aspect_ratio = serializers.SerializerMethodField()
     owner_name = serializers.SerializerMethodField()
+    tiles = serializers.SerializerMethodField()
+    preview = serializers.SerializerMethodField()
+    thumbnail = ThumbnailField()
 
     def get_aspect_ratio(self, obj):
-        fp = FloorPlan.objects.get(pk=obj.id)
-        return fp.aspect_ratio()
+        return obj.aspect_ratio()
+
+    def get_tiles(self, obj):
+        # Deep zoom tile pyramid of the image, once it has been generated.
+        if not obj.tile_format:
+            return None
+        url = tile_url_template(obj)
+        request = self.context.get('request', None)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return {
+            'url': url,
+            'tile_size': TILE_SIZE,
+            'max_level': max_level(obj.width, obj.height),
+            'width': obj.width,
+            'height': obj.height,
+        }
+
+    def get_preview(self, obj):
+        # Downscaled JPEG of the image, once the job worker has made it.
+        if not obj.image_hash or obj.processing_state != 'ready':
+            return None
+        url = default_storage.url(preview_path(obj.image_hash))
+        request = self.context.get('request', None)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return url
 
     def get_owner_name(self, obj):
-        return User.objects.get(pk=obj.owner.id).username
+        # Annotated by FloorPlan.objects.for_serializer()
+        if hasattr(obj, 'owner_username'):
+            return obj.owner_username
+        return obj.owner.username
 
     class Meta:
         model = FloorPlan
@@ -85,9 +238,162 @@ class FloorPlanSerializer(serializers.ModelSerializer):
             'name', 
             'image', 
             'aspect_ratio', 
+            'tiles',
+            'preview',
+            'thumbnail',
+            'processing_state',
             'locations', 
             'is_trashed',
             'is_public',
             'last_updated'
         )
 
+
+
+class FloorPlanSummarySerializer(FloorPlanSerializer):
+    """
+    FloorPlanSerializer without the nested locations, for listings, with
+    the number of locations of each type instead.
+    """
+    location_counts = serializers.SerializerMethodField()
+
+    def get_location_counts(self, obj):
+        # Prefetched by FloorPlan.objects.with_location_counts()
+        return {counter.loc_type: counter.count for counter in obj.location_counts.all() if counter.count}
+
+    class Meta(FloorPlanSerializer.Meta):
+        fields = tuple(field for field in FloorPlanSerializer.Meta.fields if field != 'locations') + (
+            'location_counts',
+        )
+
+
+class FloorPlanListQuerySerializer(serializers.Serializer):
+    is_trashed = serializers.BooleanField(default=False)
+    is_public = serializers.BooleanField(required=False)
+    include = serializers.ChoiceField(choices=['locations'], required=False)
+
+
+class ChangesetSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Compact response for a floor plan sync: only the locations that were
+    written, plus the floor plan's new timestamp.
+    """
+    floorplan = serializers.IntegerField(source='floorplan.id')
+    last_updated = serializers.DateTimeField(source='floorplan.last_updated')
+    created = LocationUpdateSerializer(many=True)
+    updated = LocationUpdateSerializer(many=True)
+    trashed = serializers.ListField(child=serializers.IntegerField())
+
+
+class LocationDeltaQuerySerializer(serializers.Serializer):
+    since = serializers.DateTimeField()
+
+
+class LocationRestoreSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000)
+
+
+class LocationDeltaSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    Locations created, changed or trashed since a cursor, and the cursor to
+    pass as `since` on the next request.
+    """
+    cursor = serializers.DateTimeField()
+    locations = LocationReadSerializer(many=True)
+
+
+class CoordinatesField(serializers.CharField):
+    """
+    A fixed number of comma separated numbers, e.g. `0.1,0.2`.
+    """
+    default_error_messages = {
+        'invalid': 'Expected {length} comma separated numbers.'
+    }
+
+    def __init__(self, length, **kwargs):
+        self.length = length
+        super(CoordinatesField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        data = super(CoordinatesField, self).to_internal_value(data)
+        try:
+            values = [float(value) for value in data.split(',')]
+        except ValueError:
+            self.fail('invalid', length=self.length)
+        if len(values) != self.length or not all(math.isfinite(value) for value in values):
+            self.fail('invalid', length=self.length)
+        return values
+
+
+class LocationSpatialQuerySerializer(serializers.Serializer):
+    bbox = CoordinatesField(length=4, required=False)
+    near = CoordinatesField(length=2, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+    loc_type = serializers.ChoiceField(choices=LOCATION_TYPES, required=False)
+
+
+class LocationSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class LocationSearchResultSerializer(LocationUpdateSerializer):
+    floorplan_name = serializers.CharField(source='floorplan.name', read_only=True)
+
+    class Meta(LocationUpdateSerializer.Meta):
+        fields = LocationUpdateSerializer.Meta.fields + ('floorplan_name',)
+
+
+class PeriodQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['end'] <= data['start']:
+            raise serializers.ValidationError('end must be after start.')
+        return data
+
+
+class AvailabilityQuerySerializer(PeriodQuerySerializer):
+    loc_type = serializers.ChoiceField(choices=BOOKABLE_TYPES, required=False)
+
+
+class WhereaboutsQuerySerializer(serializers.Serializer):
+    at = serializers.DateTimeField(required=False)
+
+
+class BookingSerializer(serializers.ModelSerializer):
+    """
+    A booking of a location on the floor plan given as `floorplan` in the
+    context. Conflicts with other bookings are checked by the view, which
+    holds the lock.
+    """
+    user = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Booking
+        fields = ('id', 'location', 'user', 'starts_at', 'ends_at')
+
+    def validate_location(self, location):
+        if location.floorplan_id != self.context['floorplan'].id or location.is_trashed:
+            raise serializers.ValidationError('Not a location of this floor plan.')
+        if location.loc_type not in BOOKABLE_TYPES:
+            raise serializers.ValidationError('{} locations cannot be booked.'.format(location.get_loc_type_display()))
+        return location
+
+    def validate(self, data):
+        if data['ends_at'] <= data['starts_at']:
+            raise serializers.ValidationError('ends_at must be after starts_at.')
+        if data['ends_at'] - data['starts_at'] > max_booking_duration():
+            raise serializers.ValidationError('Bookings cannot be longer than {}.'.format(max_booking_duration()))
+        return data
+
+
+class WhereaboutsSerializer(serializers.Serializer):
+    """
+    Where a user is: a booking or an assignment (`kind`) and its location.
+    """
+    kind = serializers.CharField()
+    starts_at = serializers.DateTimeField()
+    ends_at = serializers.DateTimeField()
+    location = LocationSearchResultSerializer()
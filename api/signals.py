@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from floorplans.models import Location
+from floorplans.signals import post_bulk_save
+from .events import publish_locations
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, **kwargs):
+    publish_locations([instance])
+
+
+@receiver(post_bulk_save, sender=Location)
+def locations_changed(sender, instances, **kwargs):
+    publish_locations(instances)
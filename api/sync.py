@@ -0,0 +1,52 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from floorplans.models import Location
+from .bulk import assign_changes, bulk_create, bulk_update
+
+
+Changeset = namedtuple('Changeset', ['floorplan', 'created', 'updated', 'trashed'])
+
+
+def sync_floorplan(floorplan, floorplan_data, update_data, create_data):
+    """
+    Bring `floorplan` and its locations in line with validated serializer
+    data, writing only the rows that differ from what is stored.
+
+    Everything happens in one transaction: the floor plan is saved only if one
+    of its fields changed, changed locations go out in one batched UPDATE and
+    new locations in batched INSERTs. Locations that are not part of the
+    payload, or that belong to another floor plan, are left alone.
+
+    Returns a Changeset of the floor plan, the created and updated locations,
+    and the ids of locations that were trashed by this sync.
+    """
+    with transaction.atomic():
+        floorplan_fields = assign_changes(floorplan, floorplan_data)
+        if floorplan_fields:
+            floorplan.save(update_fields=[field.name for field in floorplan_fields] + ['last_updated'])
+
+        stored = {location.id: location for location in Location.objects.filter(floorplan=floorplan)}
+        changes = {}
+        trashed = []
+        for data in update_data:
+            location = stored.get(data['id'], None)
+            if location is None:
+                continue
+            was_trashed = location.is_trashed
+            fields = assign_changes(location, data)
+            if fields:
+                changes[location] = fields
+                if location.is_trashed and not was_trashed:
+                    trashed.append(location.id)
+        bulk_update(Location, changes)
+
+        created = bulk_create(Location,
+                              [Location(**data) for data in create_data],
+                              batch_size=settings.BULK_CREATE_BATCH_SIZE)
+
+    trashed_ids = set(trashed)
+    updated = [location for location in changes if location.id not in trashed_ids]
+    return Changeset(floorplan, created, updated, trashed)
@@ -1,3 +1,1107 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from floorplans.models import Assignment, Booking, FloorPlan, Location
+from floorplans.signals import post_bulk_save
+from sat.middleware import brotli
+from sat.routers import replica_reads
+from .bulk import bulk_create
+from .cache import get_floorplan_json
+from .events import LocalBroker, floorplan_channel, get_broker
+from .renderers import msgpack
+from .serializers import LocationDeltaSerializer, LocationReadSerializer, LocationUpdateSerializer
+
+
+def make_floorplan(owner, name='Floor', **kwargs):
+    return FloorPlan.objects.create(name=name, owner=owner, image='floorplans/floor-plan.jpg', **kwargs)
+
+
+def make_locations(floorplan, count, **kwargs):
+    return [
+        Location.objects.create(
+            name='Desk {}'.format(i),
+            loc_type='DESK',
+            floorplan=floorplan,
+            position_x=i / (count + 1),
+            position_y=0.5,
+            **kwargs
+        )
+        for i in range(count)
+    ]
+
+
+def location_payload(location, **changes):
+    data = {
+        'id': location.id,
+        'name': location.name,
+        'floorplan': location.floorplan_id,
+        'loc_type': location.loc_type,
+        'details': location.details,
+        'extension': location.extension,
+        'position_x': location.position_x,
+        'position_y': location.position_y,
+        'is_trashed': location.is_trashed,
+    }
+    data.update(changes)
+    return data
+
+
+class LocationBulkUpdateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+
+    def put_locations(self, locations):
+        url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        payload = [location_payload(loc, position_x=0.9) for loc in locations]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_put_uses_constant_number_of_queries(self):
+        _, few = self.put_locations(make_locations(self.floorplan, 2))
+        _, many = self.put_locations(make_locations(self.floorplan, 50))
+        self.assertEqual(len(few), len(many))
+
+    def test_put_writes_changes_and_returns_updated_locations(self):
+        locations = make_locations(self.floorplan, 3)
+        response, _ = self.put_locations(locations)
+        self.assertEqual([item['position_x'] for item in response.json()], [0.9] * 3)
+        for location in locations:
+            stored = Location.objects.get(pk=location.id)
+            self.assertEqual(stored.position_x, 0.9)
+            self.assertEqual(stored.name, location.name)
+            self.assertGreater(stored.last_updated, location.last_updated)
+
+    def test_put_skips_unchanged_rows(self):
+        changed, unchanged = make_locations(self.floorplan, 2)
+        url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        payload = [location_payload(changed, name='Moved'), location_payload(unchanged)]
+        response = self.client.put(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Location.objects.get(pk=changed.id).name, 'Moved')
+        self.assertEqual(Location.objects.get(pk=unchanged.id).last_updated, unchanged.last_updated)
+
+
+class LocationBulkCreateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+
+    def post_locations(self, count):
+        url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        payload = [
+            {'name': 'Desk {}'.format(i), 'loc_type': 'DESK', 'position_x': 0.1, 'position_y': 0.2}
+            for i in range(count)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_post_returns_ids_of_created_locations(self):
+        response, _ = self.post_locations(3)
+        created = response.json()
+        stored = Location.objects.filter(floorplan=self.floorplan).order_by('id')
+        self.assertEqual([item['id'] for item in created], [loc.id for loc in stored])
+        self.assertEqual([item['name'] for item in created], [loc.name for loc in stored])
+
+    def test_post_uses_constant_number_of_queries(self):
+        # The first desk also creates the floor plan's desk counter.
+        self.post_locations(1)
+        _, few = self.post_locations(2)
+        with self.settings(BULK_CREATE_BATCH_SIZE=1000):
+            _, many = self.post_locations(200)
+        self.assertEqual(len(few), len(many))
+
+    def test_post_batches_inserts(self):
+        with self.settings(BULK_CREATE_BATCH_SIZE=10):
+            _, queries = self.post_locations(25)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "floorplans_location"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Location.objects.filter(floorplan=self.floorplan).count(), 25)
+
+    def test_fallback_for_backends_without_returned_ids(self):
+        sent = []
+
+        def receiver(sender, instances, **kwargs):
+            sent.append([instance.pk for instance in instances])
+        post_bulk_save.connect(receiver, sender=Location)
+        self.addCleanup(post_bulk_save.disconnect, receiver, sender=Location)
+
+        locations = [Location(name='Desk {}'.format(i), loc_type='DESK', floorplan=self.floorplan,
+                              position_x=0.1, position_y=0.2) for i in range(3)]
+        with mock.patch.object(connection.features, 'can_return_ids_from_bulk_insert', False), \
+                mock.patch.object(connection, 'vendor', 'other'):
+            bulk_create(Location, locations)
+        stored = list(Location.objects.filter(floorplan=self.floorplan).order_by('id').values_list('id', flat=True))
+        self.assertEqual([location.pk for location in locations], stored)
+        self.assertEqual(sent, [stored])
+        self.assertEqual(self.floorplan.location_counts.get().count, 3)
+        self.assertEqual(Location.objects.search('desk').count(), 3)
+
+
+class FloorPlanReadQueriesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = make_floorplan(self.user, is_public=True)
+
+    def test_get_floorplan_uses_fixed_number_of_queries(self):
+        make_locations(self.floorplan, 20)
+        url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+        # version check, floor plan with owner name, then its locations
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['owner_name'], 'owner')
+        self.assertEqual(len(response.json()['locations']), 20)
+
+    def test_serializing_floorplan_list_uses_fixed_number_of_queries(self):
+        from .serializers import FloorPlanSerializer
+
+        for i in range(5):
+            make_locations(make_floorplan(self.user, name='Floor {}'.format(i)), 3)
+        with self.assertNumQueries(2):
+            data = FloorPlanSerializer(FloorPlan.objects.for_serializer(), many=True).data
+        self.assertEqual(len(data), 6)
+
+
+class FloorPlanSyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.locations = make_locations(self.floorplan, 3)
+        self.url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+
+    def payload(self, locations, **changes):
+        data = {
+            'id': self.floorplan.id,
+            'owner': self.user.id,
+            'name': self.floorplan.name,
+            'is_trashed': False,
+            'is_public': False,
+            'locations': locations,
+        }
+        data.update(changes)
+        return data
+
+    def post(self, data, url=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url or self.url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_unchanged_payload_writes_nothing(self):
+        payload = self.payload([location_payload(loc) for loc in self.locations])
+        _, queries = self.post(payload)
+        writes = [q for q in queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(writes, [])
+
+    def test_returns_full_floorplan_by_default(self):
+        first, second, third = self.locations
+        payload = self.payload([
+            location_payload(first, name='Renamed'),
+            location_payload(second),
+            location_payload(third),
+            {'name': 'New', 'floorplan': self.floorplan.id, 'loc_type': 'DESK', 'position_x': 0, 'position_y': 0},
+        ])
+        response, _ = self.post(payload)
+        names = sorted(loc['name'] for loc in response.json()['locations'])
+        self.assertEqual(names, ['Desk 1', 'Desk 2', 'New', 'Renamed'])
+
+    def test_changeset_response_contains_only_written_rows(self):
+        first, second, third = self.locations
+        payload = self.payload([
+            location_payload(first, position_y=0.1),
+            location_payload(second, is_trashed=True),
+            location_payload(third),
+            {'name': 'New', 'floorplan': self.floorplan.id, 'loc_type': 'DESK', 'position_x': 0, 'position_y': 0},
+        ], name='Renamed floor')
+        response, queries = self.post(payload, url=self.url + '?response=changeset')
+        changeset = response.json()
+
+        self.assertEqual(changeset['floorplan'], self.floorplan.id)
+        self.assertEqual([loc['id'] for loc in changeset['updated']], [first.id])
+        self.assertEqual(changeset['trashed'], [second.id])
+        self.assertEqual([loc['name'] for loc in changeset['created']], ['New'])
+        self.assertIsNotNone(changeset['created'][0]['id'])
+        self.assertEqual(FloorPlan.objects.get(pk=self.floorplan.id).name, 'Renamed floor')
+        self.assertTrue(Location.objects.get(pk=second.id).is_trashed)
+        location_updates = [q for q in queries if q['sql'].startswith('UPDATE "floorplans_location"')]
+        self.assertEqual(len(location_updates), 1)
+
+    def test_invalid_payload_writes_nothing(self):
+        payload = self.payload([
+            location_payload(self.locations[0], name='Renamed'),
+            {'name': 'New', 'floorplan': self.floorplan.id, 'loc_type': 'NOPE', 'position_x': 0, 'position_y': 0},
+        ])
+        response = self.client.post(self.url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Location.objects.get(pk=self.locations[0].id).name, 'Desk 0')
+
+
+@override_settings(LOCATION_DELTA_OVERLAP_SECONDS=0)
+class LocationDeltaTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.locations = make_locations(self.floorplan, 3)
+        self.url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+
+    def get_delta(self, since):
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_since_returns_only_changed_and_trashed_locations(self):
+        cursor = self.get_delta('2000-01-01T00:00:00Z')['cursor']
+        self.assertEqual(self.get_delta(cursor)['locations'], [])
+
+        moved, trashed, _ = self.locations
+        moved.position_x = 0.75
+        moved.save()
+        trashed.is_trashed = True
+        trashed.save()
+
+        delta = self.get_delta(cursor)
+        self.assertEqual([loc['id'] for loc in delta['locations']], [moved.id, trashed.id])
+        self.assertTrue(delta['locations'][1]['is_trashed'])
+        self.assertEqual(self.get_delta(delta['cursor'])['locations'], [])
+
+    def test_cursor_is_unchanged_when_nothing_changed(self):
+        cursor = self.get_delta('2000-01-01T00:00:00Z')['cursor']
+        self.assertEqual(self.get_delta(cursor)['cursor'], cursor)
+
+    def test_changes_committed_after_the_cursor_with_earlier_times_are_sent(self):
+        cursor = self.get_delta('2000-01-01T00:00:00Z')['cursor']
+        # Written by a transaction that started before the cursor was read.
+        late = self.locations[0]
+        Location.objects.filter(pk=late.id).update(name='Late', last_updated=late.last_updated - timedelta(seconds=5))
+
+        with self.settings(LOCATION_DELTA_OVERLAP_SECONDS=60):
+            delta = self.get_delta(cursor)
+        self.assertIn(late.id, [location['id'] for location in delta['locations']])
+        self.assertEqual(delta['cursor'], cursor)
+
+    def test_invalid_since_is_rejected(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.locations = make_locations(self.floorplan, 3)
+        self.floorplan_url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+        self.locations_url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+
+    def test_get_with_matching_etag_is_not_modified(self):
+        for url in (self.floorplan_url, self.locations_url):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(3):  # session, user, version
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_each_format_has_its_own_etag(self):
+        columnar = 'application/vnd.sat.columnar+json'
+        etag = self.client.get(self.locations_url)['ETag']
+        response = self.client.get(self.locations_url, HTTP_ACCEPT=columnar)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Accept', response['Vary'])
+        response = self.client.get(self.locations_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+
+        # Any format's ETag guards writes.
+        etag = self.client.get(self.locations_url, HTTP_ACCEPT=columnar)['ETag']
+        payload = json.dumps([location_payload(self.locations[0], name='First')])
+        response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                   HTTP_ACCEPT=columnar, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                   HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+
+    def test_location_change_changes_etag(self):
+        etag = self.client.get(self.floorplan_url)['ETag']
+        self.locations[0].name = 'Renamed'
+        self.locations[0].save()
+        response = self.client.get(self.floorplan_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_put_with_stale_etag_is_rejected(self):
+        etag = self.client.get(self.locations_url)['ETag']
+        payload = json.dumps([location_payload(self.locations[0], name='First')])
+        response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                   HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        payload = json.dumps([location_payload(self.locations[0], name='Second')])
+        response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                   HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Location.objects.get(pk=self.locations[0].id).name, 'First')
+
+    def test_if_match_is_checked_under_the_floorplan_lock(self):
+        etag = self.client.get(self.locations_url)['ETag']
+        lock = FloorPlan.objects.select_for_update
+
+        def lock_after_concurrent_write():
+            # Another editor commits while this request waits for the lock.
+            Location.objects.filter(pk=self.locations[1].id).update(name='Other', last_updated=timezone.now())
+            return lock()
+
+        payload = json.dumps([location_payload(self.locations[0], name='Mine')])
+        with mock.patch.object(FloorPlan.objects, 'select_for_update', lock_after_concurrent_write):
+            response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                       HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Location.objects.get(pk=self.locations[0].id).name, 'Desk 0')
+
+    def test_private_floorplan_is_forbidden_before_conditional_check(self):
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        response = self.client.get(self.floorplan_url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 403)
+
+
+class FloorPlanCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = make_floorplan(self.user, is_public=True)
+        self.locations = make_locations(self.floorplan, 3)
+        self.url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+
+    def test_repeated_get_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):  # version check only
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+
+    def test_writes_made_elsewhere_are_seen(self):
+        # Another process's write, which no signal here reports.
+        self.client.get(self.url)
+        Location.objects.filter(pk=self.locations[0].id).update(name='Renamed', last_updated=timezone.now())
+        response = self.client.get(self.url)
+        self.assertIn('Renamed', [loc['name'] for loc in response.json()['locations']])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).content, response.content)
+
+    def test_cache_is_filled_from_the_primary(self):
+        # Any read sent to the replica fails: it is an empty database. The
+        # test's transaction would keep reads on the primary, so it is hidden.
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        with replica_reads(), mock.patch.dict(settings.DATABASES, {'replica': replica}), \
+                mock.patch.object(connections['default'], 'in_atomic_block', False):
+            content = get_floorplan_json(self.floorplan.id, version='"test"')
+        self.assertEqual(len(json.loads(content.decode('utf-8'))['locations']), 3)
+
+    def test_location_save_invalidates(self):
+        self.client.get(self.url)
+        self.locations[0].name = 'Renamed'
+        self.locations[0].save()
+        self.assertIn('Renamed', [loc['name'] for loc in self.client.get(self.url).json()['locations']])
+
+    def test_bulk_update_invalidates(self):
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        payload = json.dumps([location_payload(self.locations[0], name='Renamed')])
+        locations_url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        self.client.put(locations_url, payload, content_type='application/json')
+        self.assertIn('Renamed', [loc['name'] for loc in self.client.get(self.url).json()['locations']])
+
+    def test_bulk_create_invalidates(self):
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        payload = json.dumps([{'name': 'New', 'loc_type': 'DESK', 'position_x': 0, 'position_y': 0}])
+        locations_url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        self.client.post(locations_url, payload, content_type='application/json')
+        self.assertIn('New', [loc['name'] for loc in self.client.get(self.url).json()['locations']])
+
+
+class LocationSpatialQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+        positions = {'a': (0.1, 0.1), 'b': (0.2, 0.15), 'c': (0.8, 0.8), 'd': (0.5, 0.5)}
+        for name, (x, y) in positions.items():
+            Location.objects.create(name=name, loc_type='DESK', floorplan=self.floorplan,
+                                    position_x=x, position_y=y)
+
+    def names(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [loc['name'] for loc in response.json()]
+
+    def test_bbox_returns_locations_inside(self):
+        self.assertEqual(sorted(self.names({'bbox': '0,0,0.3,0.3'})), ['a', 'b'])
+        self.assertEqual(sorted(self.names({'bbox': '0.45,0.45,1,1'})), ['c', 'd'])
+
+    def test_near_returns_closest_first(self):
+        self.assertEqual(self.names({'near': '0.12,0.12', 'limit': 3}), ['a', 'b', 'd'])
+        self.assertEqual(self.names({'near': '1,1', 'limit': 1}), ['c'])
+
+    def test_near_can_filter_by_type(self):
+        Location.objects.create(name='room', loc_type='CONFR', floorplan=self.floorplan,
+                                position_x=0.79, position_y=0.79)
+        self.assertEqual(self.names({'near': '0.78,0.78', 'limit': 1, 'loc_type': 'DESK'}), ['c'])
+
+    def test_bulk_update_moves_grid_cell(self):
+        location = Location.objects.get(name='a')
+        payload = json.dumps([location_payload(location, position_x=0.9, position_y=0.9)])
+        self.client.put(self.url, payload, content_type='application/json')
+        self.assertEqual(sorted(self.names({'bbox': '0.7,0.7,1,1'})), ['a', 'c'])
+
+    def test_invalid_bbox_is_rejected(self):
+        response = self.client.get(self.url, {'bbox': '0,0,1'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LocationSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.url = reverse('api-location-search')
+        mine = make_floorplan(self.user, name='Mine')
+        public = make_floorplan(self.other, name='Public', is_public=True)
+        private = make_floorplan(self.other, name='Private')
+        Location.objects.create(name='Ada Lovelace', details='Analytical engines', extension=4242,
+                                loc_type='DESK', floorplan=mine, position_x=0, position_y=0)
+        Location.objects.create(name='Boardroom', loc_type='CONFR', floorplan=public,
+                                position_x=0, position_y=0)
+        Location.objects.create(name='Ada Byron', loc_type='OFFICE', floorplan=private,
+                                position_x=0, position_y=0)
+
+    def search(self, q):
+        response = self.client.get(self.url, {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [loc['name'] for loc in response.json()]
+
+    def test_search_matches_word_prefixes_of_every_indexed_field(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.search('ada'), ['Ada Lovelace'])
+        self.assertEqual(self.search('analyt'), ['Ada Lovelace'])
+        self.assertEqual(self.search('424'), ['Ada Lovelace'])
+        self.assertEqual(self.search('conference'), ['Boardroom'])
+        self.assertEqual(self.search('ada love'), ['Ada Lovelace'])
+        self.assertEqual(self.search('ada board'), [])
+        # No words, no matches.
+        self.assertEqual(self.search('!?'), [])
+
+    def test_results_are_the_first_by_name(self):
+        floorplan = make_floorplan(self.user)
+        for name in ('Pod c', 'pod B', 'Pod a', 'Pod \U0001d400'):
+            Location.objects.create(name=name, loc_type='DESK', floorplan=floorplan, position_x=0, position_y=0)
+        self.client.force_login(self.user)
+        self.assertEqual(self.search('pod'), ['Pod a', 'pod B', 'Pod c', 'Pod \U0001d400'])
+        response = self.client.get(self.url, {'q': 'pod', 'limit': 2})
+        self.assertEqual([location['name'] for location in response.json()], ['Pod a', 'pod B'])
+
+    def test_words_beyond_the_basic_multilingual_plane_match_prefixes(self):
+        floorplan = make_floorplan(self.user)
+        Location.objects.create(name='Room \U0001d400\U0001d401', loc_type='DESK', floorplan=floorplan,
+                                position_x=0, position_y=0)
+        self.client.force_login(self.user)
+        self.assertEqual(self.search('\U0001d400'), ['Room \U0001d400\U0001d401'])
+
+    def test_search_respects_floorplan_visibility(self):
+        self.assertEqual(self.search('ada'), [])
+        self.assertEqual(self.search('board'), ['Boardroom'])
+
+    def test_bulk_updates_are_reindexed(self):
+        self.client.force_login(self.user)
+        location = Location.objects.get(name='Ada Lovelace')
+        payload = json.dumps([location_payload(location, name='Grace Hopper')])
+        url = reverse('api-locations', kwargs={'pk': location.floorplan_id})
+        self.client.put(url, payload, content_type='application/json')
+        self.assertEqual(self.search('ada'), [])
+        self.assertEqual(self.search('grace'), ['Grace Hopper'])
+
+    def test_trashed_locations_are_not_found(self):
+        self.client.force_login(self.user)
+        Location.objects.filter(name='Ada Lovelace').update(is_trashed=True)
+        self.assertEqual(self.search('ada'), [])
+
+
+class FloorPlanListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.client.force_login(self.user)
+        self.url = reverse('api-floorplans')
+        self.mine = [make_floorplan(self.user, name='Mine {}'.format(i)) for i in range(5)]
+        self.public = make_floorplan(self.other, name='Public', is_public=True)
+        self.private = make_floorplan(self.other, name='Private')
+        self.trashed = make_floorplan(self.user, name='Trashed', is_trashed=True)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [floorplan['name'] for floorplan in response.json()['results']]
+
+    def test_lists_owned_and_public_floorplans_newest_first(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.names(response), ['Public', 'Mine 4', 'Mine 3', 'Mine 2', 'Mine 1', 'Mine 0'])
+        self.assertNotIn('locations', response.json()['results'][0])
+        self.assertIsNone(response.json()['next'])
+
+    def test_pages_follow_the_cursor(self):
+        # Equal timestamps must not lose or repeat rows between pages.
+        FloorPlan.objects.update(last_updated=self.public.last_updated)
+        names = []
+        url = self.url + '?limit=2'
+        while url:
+            # session, user, owned and public positions, page, location counts
+            with self.assertNumQueries(6):
+                response = self.client.get(url)
+            names += self.names(response)
+            url = response.json()['next']
+        self.assertEqual(sorted(names), sorted(['Public'] + [fp.name for fp in self.mine]))
+
+    def test_owned_public_floorplans_are_listed_once(self):
+        self.mine[0].is_public = True
+        self.mine[0].save()
+        self.assertEqual(self.names(self.client.get(self.url)),
+                         ['Mine 0', 'Public', 'Mine 4', 'Mine 3', 'Mine 2', 'Mine 1'])
+
+    def test_filters(self):
+        self.assertEqual(self.names(self.client.get(self.url, {'is_public': 'true'})), ['Public'])
+        self.assertEqual(self.names(self.client.get(self.url, {'is_trashed': 'true'})), ['Trashed'])
+        self.client.logout()
+        self.assertEqual(self.names(self.client.get(self.url)), ['Public'])
+
+    def test_include_locations(self):
+        make_locations(self.public, 2)
+        response = self.client.get(self.url, {'include': 'locations', 'is_public': 'true'})
+        self.assertEqual(len(response.json()['results'][0]['locations']), 2)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'nope'}).status_code, 404)
+
+
+class LocationImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.url = reverse('api-locations-import', kwargs={'pk': self.floorplan.id})
+
+    def test_csv_import_skips_and_reports_invalid_rows(self):
+        body = '\n'.join([
+            'name,loc_type,details,extension,position_x,position_y',
+            'Desk 1,DESK,,,0.1,0.2',
+            'Bad type,SOFA,,,0.1,0.2',
+            '"Desk, quoted",DESK,By the window,1234,0.3,0.4',
+            'No position,DESK,,,,0.5',
+        ])
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['created'], report['failed']), (2, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 5])
+        self.assertIn('loc_type', report['errors'][0]['errors'])
+        stored = Location.objects.filter(floorplan=self.floorplan).order_by('id')
+        self.assertEqual([(loc.name, loc.extension) for loc in stored], [('Desk 1', None), ('Desk, quoted', 1234)])
+        # Imported locations are indexed for search like any other.
+        self.assertEqual(Location.objects.search('quoted').get().name, 'Desk, quoted')
+
+    def test_ndjson_import_inserts_in_batches(self):
+        rows = [json.dumps({'name': 'Desk {}'.format(i), 'loc_type': 'DESK', 'position_x': 0.1, 'position_y': 0.2})
+                for i in range(25)]
+        rows[7] = '{not json'
+        with self.settings(BULK_CREATE_BATCH_SIZE=10), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, '\n'.join(rows) + '\n', content_type='application/x-ndjson')
+        self.assertEqual(response.json()['created'], 24)
+        self.assertEqual(response.json()['errors'][0]['line'], 8)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "floorplans_location"')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_other_content_types_are_rejected(self):
+        response = self.client.post(self.url, '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+
+    def test_other_users_floorplans_are_forbidden(self):
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        body = 'name,loc_type,position_x,position_y\nDesk,DESK,0.1,0.2\n'
+        for is_public in (False, True):
+            FloorPlan.objects.filter(pk=self.floorplan.id).update(is_public=is_public)
+            response = self.client.post(self.url, body, content_type='text/csv')
+            self.assertEqual(response.status_code, 403)
+        self.assertFalse(Location.objects.exists())
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as f:
+            f.write(b'{"name": "Desk", "loc_type": "DESK", "position_x": 0.5, "position_y": 0.5}\n[]\n')
+            f.flush()
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command('import_locations', self.floorplan.id, f.name, stdout=stdout, stderr=stderr)
+        self.assertIn('Created 1 locations, skipped 1 invalid rows', stdout.getvalue())
+        self.assertIn('Line 2', stderr.getvalue())
+
+
+class LocationExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.client.force_login(self.user)
+        self.first = make_floorplan(self.user, name='First', width=200.0, height=100.0)
+        self.second = make_floorplan(self.user, name='Second')
+        make_locations(self.first, 2)
+        make_locations(self.second, 1)
+        make_locations(self.first, 1, is_trashed=True)
+        make_locations(make_floorplan(self.other), 1)
+
+    def export(self, fmt, pk=None):
+        if pk is None:
+            url = reverse('api-floorplans-export', kwargs={'export_format': fmt})
+        else:
+            url = reverse('api-floorplan-export', kwargs={'pk': pk, 'export_format': fmt})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_exports_all_owned_floorplans(self):
+        response, content = self.export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['floorplan_name'], row['name']) for row in rows],
+                         [('First', 'Desk 0'), ('First', 'Desk 1'), ('Second', 'Desk 0')])
+
+    def test_csv(self):
+        _, content = self.export('csv', self.first.id)
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'id,floorplan,floorplan_name,name,loc_type,details,extension,'
+                                   'position_x,position_y,last_updated')
+        self.assertEqual(len(lines), 3)
+
+    def test_geojson_points_are_in_floorplan_coordinates(self):
+        response, content = self.export('geojson', self.first.id)
+        self.assertIn('attachment', response['Content-Disposition'])
+        features = json.loads(content)['features']
+        self.assertEqual([f['geometry']['coordinates'] for f in features],
+                         [[0.0, 50.0], [1 / 3 * 200, 50.0]])
+
+    def test_private_floorplans_of_others_are_forbidden(self):
+        self.client.force_login(self.other)
+        url = reverse('api-floorplan-export', kwargs={'pk': self.first.id, 'export_format': 'csv'})
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_management_command(self):
+        stdout = io.StringIO()
+        call_command('export_locations', user='owner', format='ndjson', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+
+
+class LocationEventsTest(TransactionTestCase):
+    # Events are published when a transaction commits, which never happens
+    # inside TestCase.
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.url = reverse('api-location-events', kwargs={'pk': self.floorplan.id})
+
+    def events(self, response, count):
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        for chunk in response.streaming_content:
+            if chunk.startswith(b'id: '):
+                fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+                events.append((fields['event'], fields['id'], json.loads(fields['data'])))
+                if len(events) == count:
+                    break
+        response.close()
+        return events
+
+    def test_writes_are_pushed_once_per_commit(self):
+        locations = make_locations(self.floorplan, 3)
+        with self.settings(LOCATION_EVENTS_MAX_AGE=2):
+            response = self.client.get(self.url, HTTP_ACCEPT='text/event-stream')
+            url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+            payload = [location_payload(location, position_x=0.9) for location in locations]
+            self.client.put(url, json.dumps(payload), content_type='application/json')
+            events = self.events(response, 1)
+
+        event, cursor, data = events[0]
+        self.assertEqual(event, 'locations')
+        self.assertEqual(cursor, data['cursor'])
+        self.assertEqual(sorted(location['id'] for location in data['locations']),
+                         [location.id for location in locations])
+        self.assertFalse(get_broker().has_subscribers(floorplan_channel(self.floorplan.id)))
+
+    def test_reconnect_replays_changes_after_last_event_id(self):
+        first = make_locations(self.floorplan, 1)[0]
+        cursor = LocationDeltaSerializer({'cursor': first.last_updated, 'locations': []}).data['cursor']
+        second = Location.objects.create(name='Later', loc_type='DESK', floorplan=self.floorplan,
+                                         position_x=0.5, position_y=0.5)
+        with self.settings(LOCATION_EVENTS_MAX_AGE=0):
+            response = self.client.get(self.url, HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=cursor)
+            events = self.events(response, 1)
+        # The first location was written at the cursor, inside the overlap.
+        self.assertEqual([location['id'] for location in events[0][2]['locations']], [first.id, second.id])
+
+    def test_private_floorplans_of_others_are_forbidden(self):
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='text/event-stream').status_code, 403)
+
+
+class LocalBrokerTest(SimpleTestCase):
+    def test_slow_subscribers_are_dropped(self):
+        broker = LocalBroker(maxsize=2)
+        slow = broker.subscribe('channel')
+        for message in (b'1', b'2', b'3'):
+            broker.publish('channel', message)
+        self.assertTrue(slow.overflowed)
+        self.assertFalse(broker.has_subscribers('channel'))
+        self.assertEqual(slow.get(timeout=0), b'1')
+
+
+class CompactFormatTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        make_locations(self.floorplan, 200)
+        self.locations_url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+
+    def test_columnar_locations_hold_the_same_data(self):
+        rows = self.client.get(self.locations_url).json()
+        response = self.client.get(self.locations_url, HTTP_ACCEPT='application/vnd.sat.columnar+json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.sat.columnar+json')
+        data = response.json()
+        self.assertEqual(data['count'], 200)
+        self.assertEqual(data['floorplan'], self.floorplan.id)
+        decoded = [
+            dict({name: values[i] for name, values in data['columns'].items()},
+                 floorplan=data['floorplan'], loc_type=data['loc_types'][data['columns']['loc_type'][i]])
+            for i in range(data['count'])
+        ]
+        self.assertEqual(decoded, rows)
+        self.assertLess(len(response.content), len(json.dumps(rows)) * 0.7)
+
+    def test_floorplan_locations_are_columnar(self):
+        url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+        data = self.client.get(url, HTTP_ACCEPT='application/vnd.sat.columnar+json').json()
+        self.assertEqual(data['name'], 'Floor')
+        self.assertEqual(len(data['locations']['columns']['id']), 200)
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.client.get(self.locations_url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['count'], 200)
+
+    def test_compression(self):
+        plain = self.client.get(self.locations_url)
+        for encoding in ('gzip', 'br') if brotli else ('gzip',):
+            response = self.client.get(self.locations_url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertLess(len(response.content), len(plain.content) / 4)
+            self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        # The weakened ETag still guards writes.
+        payload = json.dumps([])
+        response = self.client.put(self.locations_url, payload, content_type='application/json',
+                                   HTTP_IF_MATCH='W/' + plain['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_html_is_not_compressed(self):
+        response = self.client.get(reverse('floorplans_dashboard'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.content), 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class LocationReadSerializerTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner', password='password')
+        self.floorplan = make_floorplan(user)
+        make_locations(self.floorplan, 3)
+        make_locations(self.floorplan, 2, details='Près de la fenêtre "nord"', extension=4321, is_trashed=True)
+        Location.objects.create(name='Exact', loc_type='ROOM', floorplan=self.floorplan,
+                                position_x=1, position_y=0.1 + 0.2)
+
+    def assertSameBytes(self, data):
+        render = JSONRenderer().render
+        self.assertEqual(render(LocationReadSerializer(data, many=True).data),
+                         render(LocationUpdateSerializer(data, many=True).data))
+
+    def test_output_matches_location_update_serializer(self):
+        queryset = Location.objects.filter(floorplan=self.floorplan).order_by('id')
+        self.assertSameBytes(queryset)
+        self.assertSameBytes(list(queryset))
+        self.assertSameBytes(self.floorplan.locations)
+        self.assertSameBytes(Location.objects.none())
+
+    def test_querysets_are_read_without_instances(self):
+        queryset = Location.objects.filter(floorplan=self.floorplan)
+        with self.assertNumQueries(1):
+            data = LocationReadSerializer(queryset, many=True).data
+        self.assertEqual(len(data), 6)
+        self.assertIsNone(queryset._result_cache)
+
+
+class BookingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user, is_public=True)
+        self.desks = make_locations(self.floorplan, 3)
+        self.room = Location.objects.create(name='Boardroom', loc_type='CONFR', floorplan=self.floorplan,
+                                            position_x=0.5, position_y=0.9)
+        Location.objects.create(name='Kitchen', loc_type='COMMON', floorplan=self.floorplan,
+                                position_x=0.9, position_y=0.9)
+        self.nine = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    def hours(self, start, end):
+        return self.nine + timedelta(hours=start), self.nine + timedelta(hours=end)
+
+    def book(self, location, user, start, end):
+        starts_at, ends_at = self.hours(start, end)
+        return Booking.objects.create(location=location, user=user, starts_at=starts_at, ends_at=ends_at)
+
+    def available(self, start, end, **params):
+        starts_at, ends_at = self.hours(start, end)
+        params.update(start=starts_at.isoformat(), end=ends_at.isoformat())
+        response = self.client.get(reverse('api-availability', kwargs={'pk': self.floorplan.id}), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(location['name'] for location in response.json())
+
+    def test_availability_leaves_out_overlapping_bookings_and_assignments(self):
+        self.book(self.desks[0], self.other, 0, 4)
+        self.book(self.desks[1], self.other, 4, 8)
+        Assignment.objects.create(location=self.desks[2], user=self.other)
+        self.assertEqual(self.available(0, 2), ['Boardroom', 'Desk 1'])
+        self.assertEqual(self.available(4, 8), ['Boardroom', 'Desk 0'])
+        self.assertEqual(self.available(3, 5), ['Boardroom'])
+        self.assertEqual(self.available(8, 9, loc_type='DESK'), ['Desk 0', 'Desk 1'])
+
+    def test_availability_sees_bookings_that_started_before_the_period(self):
+        self.book(self.room, self.other, -20, 3)
+        self.assertNotIn('Boardroom', self.available(2, 4))
+
+    def test_availability_uses_fixed_number_of_queries(self):
+        for hour in range(0, 20, 2):
+            for desk in self.desks:
+                self.book(desk, self.other, hour, hour + 1)
+        starts_at, ends_at = self.hours(1, 2)
+        # session, user, floor plan, locations
+        with self.assertNumQueries(4):
+            self.client.get(reverse('api-availability', kwargs={'pk': self.floorplan.id}),
+                            {'start': starts_at.isoformat(), 'end': ends_at.isoformat()})
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plan')
+    def test_overlapping_bookings_are_a_range_scan(self):
+        starts_at, ends_at = self.hours(1, 2)
+        bookings = Booking.objects.filter(floorplan=self.floorplan).overlapping(starts_at, ends_at)
+        sql, params = bookings.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('booking_floorplan_starts (floorplan_id=? AND starts_at>? AND starts_at<?)', plan)
+
+    def test_booking_conflicts_are_refused(self):
+        url = reverse('api-bookings', kwargs={'pk': self.floorplan.id})
+        starts_at, ends_at = self.hours(1, 3)
+        payload = {'location': self.room.id, 'starts_at': starts_at.isoformat(), 'ends_at': ends_at.isoformat()}
+        response = self.client.post(url, payload)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user'], 'owner')
+
+        starts_at, ends_at = self.hours(2, 4)
+        payload.update(starts_at=starts_at.isoformat(), ends_at=ends_at.isoformat())
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.post(url, payload).status_code, 409)
+
+        starts_at, ends_at = self.hours(3, 4)
+        payload.update(starts_at=starts_at.isoformat(), ends_at=ends_at.isoformat())
+        self.assertEqual(self.client.post(url, payload).status_code, 201)
+
+        starts_at, ends_at = self.hours(0, 5)
+        response = self.client.get(url, {'start': starts_at.isoformat(), 'end': ends_at.isoformat()})
+        self.assertEqual([booking['user'] for booking in response.json()], ['owner', 'other'])
+
+    def test_invalid_bookings_are_rejected(self):
+        url = reverse('api-bookings', kwargs={'pk': self.floorplan.id})
+        kitchen = Location.objects.get(name='Kitchen')
+        for location, start, end in [(self.room, 3, 1), (self.room, 0, 25), (kitchen, 0, 1)]:
+            starts_at, ends_at = self.hours(start, end)
+            payload = {'location': location.id, 'starts_at': starts_at.isoformat(), 'ends_at': ends_at.isoformat()}
+            self.assertEqual(self.client.post(url, payload).status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_bookings_longer_than_the_maximum_are_not_saved(self):
+        # Availability would miss them, see BookingQuerySet.
+        with self.assertRaises(ValidationError):
+            self.book(self.room, self.other, 0, 25)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_overlapping_assignments_are_not_saved(self):
+        starts_at, first_end = self.hours(0, 48)
+        Assignment.objects.create(location=self.desks[0], user=self.other, starts_at=starts_at, ends_at=first_end)
+        # A later one ending after it, and an open-ended one starting before.
+        for starts_at, ends_at in [self.hours(24, 72), (self.hours(-24, 0)[0], None)]:
+            with self.assertRaises(ValidationError):
+                Assignment.objects.create(location=self.desks[0], user=self.user,
+                                          starts_at=starts_at, ends_at=ends_at)
+        Assignment.objects.create(location=self.desks[0], user=self.user, starts_at=first_end)
+        self.assertEqual(Assignment.objects.filter(location=self.desks[0]).count(), 2)
+
+    def test_bookings_can_be_cancelled_by_their_user(self):
+        booking = self.book(self.room, self.other, 0, 1)
+        url = reverse('api-booking', kwargs={'pk': booking.id})
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_whereabouts(self):
+        self.book(self.room, self.other, 0, 2)
+        Assignment.objects.create(location=self.desks[0], user=self.other)
+        url = reverse('api-whereabouts', kwargs={'username': 'other'})
+
+        response = self.client.get(url, {'at': self.hours(1, 1)[0].isoformat()})
+        self.assertEqual([(item['kind'], item['location']['name'], item['location']['floorplan_name'])
+                          for item in response.json()],
+                         [('booking', 'Boardroom', 'Floor'), ('assignment', 'Desk 0', 'Floor')])
+        response = self.client.get(url, {'at': self.hours(2, 2)[0].isoformat()})
+        self.assertEqual([item['kind'] for item in response.json()], ['assignment'])
+
+        FloorPlan.objects.filter(pk=self.floorplan.id).update(is_public=False)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).json(), [])
+
+
+class LocationCountsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user)
+        self.url = reverse('api-locations', kwargs={'pk': self.floorplan.id})
+
+    def listed_counts(self):
+        response = self.client.get(reverse('api-floorplans'))
+        return response.json()['results'][0]['location_counts']
+
+    def test_bulk_writes_keep_counts(self):
+        payload = [{'name': 'Desk', 'loc_type': 'DESK', 'position_x': 0, 'position_y': 0}] * 3
+        payload.append({'name': 'Room', 'loc_type': 'CONFR', 'position_x': 0, 'position_y': 0})
+        self.client.post(self.url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(self.listed_counts(), {'DESK': 3, 'CONFR': 1})
+
+        desks = Location.objects.filter(loc_type='DESK').order_by('id')
+        payload = [location_payload(desks[0], is_trashed=True), location_payload(desks[1], loc_type='OFFICE')]
+        self.client.put(self.url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(self.listed_counts(), {'DESK': 1, 'CONFR': 1, 'OFFICE': 1})
+
+    def test_failed_writes_leave_counts_alone(self):
+        make_locations(self.floorplan, 2)
+        with self.assertRaises(ValueError), transaction.atomic():
+            Location.objects.create(name='Desk', loc_type='DESK', floorplan=self.floorplan,
+                                    position_x=0, position_y=0)
+            raise ValueError
+        self.assertEqual(self.listed_counts(), {'DESK': 2})
+
+
+class TrashRestoreTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.other = User.objects.create_user('other', password='password')
+        self.client.force_login(self.user)
+        self.floorplan = make_floorplan(self.user, is_public=True)
+        self.desks = make_locations(self.floorplan, 3)
+        self.url = reverse('api-locations-restore', kwargs={'pk': self.floorplan.id})
+
+    def post(self, url, data=None):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def trash(self, *locations):
+        payload = [location_payload(location, is_trashed=True) for location in locations]
+        response = self.client.put(reverse('api-locations', kwargs={'pk': self.floorplan.id}),
+                                   json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_floorplan_leaves_out_trashed_locations(self):
+        self.trash(self.desks[0])
+        response = self.client.get(reverse('api-floorplan', kwargs={'pk': self.floorplan.id}))
+        self.assertEqual([location['name'] for location in response.json()['locations']], ['Desk 1', 'Desk 2'])
+        self.assertIsNotNone(Location.objects.get(pk=self.desks[0].id).trashed_at)
+
+    def test_trashing_a_floorplan_succeeds(self):
+        url = reverse('api-floorplan', kwargs={'pk': self.floorplan.id})
+        response = self.client.put(url, json.dumps({'name': 'Floor', 'owner': self.user.id, 'is_trashed': True}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertTrue(FloorPlan.objects.get(pk=self.floorplan.id).is_trashed)
+
+        FloorPlan.objects.filter(pk=self.floorplan.id).update(is_trashed=False)
+        payload = {'id': self.floorplan.id, 'owner': self.user.id, 'name': 'Floor', 'is_trashed': True,
+                   'is_public': True, 'locations': [location_payload(desk) for desk in self.desks]}
+        response = self.post(url, payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertEqual(len(response.json()['locations']), 3)
+        self.assertTrue(FloorPlan.objects.get(pk=self.floorplan.id).is_trashed)
+        self.assertFalse(FloorPlan.active.filter(pk=self.floorplan.id).exists())
+
+    def test_restore_locations(self):
+        self.trash(self.desks[0], self.desks[1])
+        response = self.post(self.url, {'ids': [self.desks[0].id, self.desks[2].id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([location['id'] for location in response.json()], [self.desks[0].id])
+        self.assertIn('ETag', response)
+        self.assertEqual(set(Location.active.values_list('id', flat=True)), {self.desks[0].id, self.desks[2].id})
+        self.assertIsNone(Location.objects.get(pk=self.desks[0].id).trashed_at)
+        self.assertEqual(self.floorplan.location_counts.get().count, 2)
+        self.assertEqual(self.post(self.url, {'ids': []}).status_code, 400)
+
+        # Not by others, even on a public floor plan.
+        self.client.force_login(self.other)
+        self.assertEqual(self.post(self.url, {'ids': [self.desks[1].id]}).status_code, 403)
+        FloorPlan.objects.filter(pk=self.floorplan.id).update(is_public=False)
+        self.assertEqual(self.post(self.url, {'ids': [self.desks[1].id]}).status_code, 403)
+        self.assertFalse(Location.active.filter(pk=self.desks[1].id).exists())
+
+    def test_restore_floorplan(self):
+        self.floorplan.is_trashed = True
+        self.floorplan.save()
+        url = reverse('api-floorplan-restore', kwargs={'pk': self.floorplan.id})
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.post(url).status_code, 404)
+        self.client.force_login(self.user)
+        response = self.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['locations']), 3)
+        floorplan = FloorPlan.objects.get(pk=self.floorplan.id)
+        self.assertFalse(floorplan.is_trashed)
+        self.assertIsNone(floorplan.trashed_at)
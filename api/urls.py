@@ -3,6 +3,13 @@ from . import views
 
 urlpatterns = [
     ####
+    # floorplans/ ->
+    #   paginated list of owned and public FloorPlan instances
+    ####
+    re_path('^floorplans/$',
+            views.FloorPlanList.as_view(),
+            name='api-floorplans'),
+    ####
     # floorplans/<pk>/ ->
     #   get FloorPlan instance and list of its Locations
     ####
@@ -10,10 +17,83 @@ urlpatterns = [
             views.FloorPlanDetail.as_view(),
             name='api-floorplan'),
     ####
+    # floorplans/<pk>/restore/ ->
+    #   take a trashed FloorPlan out of the trash
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/restore/$',
+            views.FloorPlanRestore.as_view(),
+            name='api-floorplan-restore'),
+    ####
     # floorplans/<pk>/locations/ ->
     #   get, create, update list of Locations for FloorPlan instance
     ####
     re_path('floorplans/(?P<pk>[0-9]+)/locations/$',
             views.LocationsByFloorPlan.as_view(),
             name='api-locations'),
+    ####
+    # floorplans/<pk>/locations/restore/ ->
+    #   take trashed Locations of a FloorPlan out of the trash
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/locations/restore/$',
+            views.LocationRestore.as_view(),
+            name='api-locations-restore'),
+    ####
+    # floorplans/<pk>/locations/events/ ->
+    #   server-sent events of changes to the Locations of a FloorPlan
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/locations/events/$',
+            views.LocationEvents.as_view(),
+            name='api-location-events'),
+    ####
+    # floorplans/<pk>/locations/import/ ->
+    #   create Locations from a streamed CSV or JSON Lines body
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/locations/import/$',
+            views.LocationImport.as_view(),
+            name='api-locations-import'),
+    ####
+    # floorplans/<pk>/availability/?start=<t1>&end=<t2> ->
+    #   Locations of a FloorPlan free between two times
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/availability/$',
+            views.FloorPlanAvailability.as_view(),
+            name='api-availability'),
+    ####
+    # floorplans/<pk>/bookings/ ->
+    #   list Bookings of a FloorPlan between two times, book a Location
+    # bookings/<pk>/ ->
+    #   cancel a Booking
+    ####
+    re_path('floorplans/(?P<pk>[0-9]+)/bookings/$',
+            views.FloorPlanBookings.as_view(),
+            name='api-bookings'),
+    re_path('^bookings/(?P<pk>[0-9]+)/$',
+            views.BookingDetail.as_view(),
+            name='api-booking'),
+    ####
+    # users/<username>/whereabouts/ ->
+    #   Locations a user has booked or is assigned to now
+    ####
+    re_path(r'^users/(?P<username>[\w.@+-]+)/whereabouts/$',
+            views.UserWhereabouts.as_view(),
+            name='api-whereabouts'),
+    ####
+    # floorplans/export.<ndjson|csv|geojson> ->
+    #   stream the Locations of all the user's FloorPlans
+    # floorplans/<pk>/export.<ndjson|csv|geojson> ->
+    #   stream the Locations of one FloorPlan
+    ####
+    re_path(r'^floorplans/export\.(?P<export_format>ndjson|csv|geojson)$',
+            views.FloorPlanListExport.as_view(),
+            name='api-floorplans-export'),
+    re_path(r'floorplans/(?P<pk>[0-9]+)/export\.(?P<export_format>ndjson|csv|geojson)$',
+            views.FloorPlanExport.as_view(),
+            name='api-floorplan-export'),
+    ####
+    # locations/search/?q=<text> ->
+    #   find Locations by name, details, extension or type
+    ####
+    re_path('locations/search/$',
+            views.LocationSearch.as_view(),
+            name='api-location-search'),
 ]
@@ -1,24 +1,129 @@
-from floorplans.models import FloorPlan, Location
-from .serializers import FloorPlanSerializer, LocationCreateSerializer, LocationUpdateSerializer
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from floorplans.models import BOOKABLE_TYPES, Assignment, Booking, FloorPlan, Location
+from .serializers import (
+    AvailabilityQuerySerializer,
+    BookingSerializer,
+    ChangesetSerializer,
+    FloorPlanListQuerySerializer,
+    FloorPlanSerializer,
+    FloorPlanSummarySerializer,
+    ImportReportSerializer,
+    LocationCreateSerializer,
+    LocationDeltaQuerySerializer,
+    LocationDeltaSerializer,
+    LocationReadSerializer,
+    LocationRestoreSerializer,
+    LocationSearchQuerySerializer,
+    LocationSearchResultSerializer,
+    LocationSpatialQuerySerializer,
+    LocationUpdateSerializer,
+    PeriodQuerySerializer,
+    WhereaboutsQuerySerializer,
+    WhereaboutsSerializer,
+)
 from rest_framework import generics, status
+from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.permissions import IsAuthenticated
-from .permissions import IsOwnerOrFloorPlanIsPublic
+from rest_framework.renderers import JSONRenderer
+from .permissions import IsFloorPlanOwner, IsOwnerOrFloorPlanIsPublic
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from sat.utils import partition
+from .bulk import assign_changes, bulk_update
+from .cache import get_floorplan_json
+from .conditional import conditional
+from .events import EventStream, EventStreamRenderer, EventStreamResponse, delta_event, floorplan_channel, get_broker
+from .exports import CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_locations
+from .imports import import_locations, read_rows
+from .pagination import KeysetPagination
+from .renderers import LOCATION_RENDERERS
+from .sync import sync_floorplan
 
 
 
+class FloorPlanList(generics.ListAPIView):
+    """
+        name : 'api-floorplans'
+        GET : FloorPlans the user owns or that are public, newest first,
+              paged with ?cursor= and ?limit= (see api.pagination)
+              ?is_trashed=true : the user's trashed FloorPlans instead
+              ?is_public=true|false : only public or private FloorPlans
+              ?include=locations : nest each FloorPlan's Locations
+    """
+    pagination_class = KeysetPagination
+    renderer_classes = LOCATION_RENDERERS
+
+    def list(self, request, *args, **kwargs):
+        query = FloorPlanListQuerySerializer(data=request.query_params.dict())
+        query.is_valid(raise_exception=True)
+        self.params = query.validated_data
+        return super(FloorPlanList, self).list(request, *args, **kwargs)
+
+    def get_keyset_parts(self):
+        """
+        The listed FloorPlans, as one queryset per index that returns them
+        newest first: owned and public ones are paged separately and merged
+        by the pagination.
+        """
+        user = self.request.user
+        floorplans = FloorPlan.objects.filter(is_trashed=self.params['is_trashed'])
+        if 'is_public' in self.params:
+            floorplans = floorplans.filter(is_public=self.params['is_public'])
+        if self.params['is_trashed']:
+            return [floorplans.filter(owner=user.id)]
+        if user.is_authenticated:
+            return [floorplans.filter(owner=user), floorplans.filter(is_public=True)]
+        return [floorplans.filter(is_public=True)]
+
+    def get_queryset(self):
+        # Only the rows of the page, picked by get_keyset_parts(), are read.
+        if self.params.get('include') == 'locations':
+            return FloorPlan.objects.for_serializer()
+        return FloorPlan.objects.with_owner_name().with_location_counts()
+
+    def get_serializer_class(self):
+        if self.params.get('include') == 'locations':
+            return FloorPlanSerializer
+        return FloorPlanSummarySerializer
+
+
 class FloorPlanDetail(generics.RetrieveUpdateAPIView):
     """
         name : 'api-floorplan'
         GET : FloorPlan instance, includes list of Locations related to the FloorPlan
         PUT : Update FloorPlan instance, cannot update Locations from this route
         POST : Update FloorPlan and associated locations
+        All methods honour ETag preconditions (see api.conditional).
+        Accept: application/vnd.sat.columnar+json (or application/msgpack)
+        returns Locations as parallel arrays (see api.renderers).
     """
-    queryset = FloorPlan.objects.all()
+    queryset = FloorPlan.objects.for_serializer()
     serializer_class = FloorPlanSerializer
     permission_classes = (IsOwnerOrFloorPlanIsPublic,)
+    renderer_classes = LOCATION_RENDERERS
+
+    @conditional
+    def get(self, request, *args, **kwargs):
+        # JSON is served from the rendered floor plan cache (see api.cache);
+        # other renderers, like the browsable API, serialize as usual.
+        if request.accepted_renderer.format == 'json':
+            content = get_floorplan_json(kwargs['pk'], request, self.floorplan_etag)
+            return HttpResponse(content, content_type='application/json')
+        return self.retrieve(request, *args, **kwargs)
+
+    @conditional
+    def put(self, request, *args, **kwargs):
+        return self.update(request, *args, **kwargs)
+
+    @conditional
+    def patch(self, request, *args, **kwargs):
+        return self.partial_update(request, *args, **kwargs)
 
     ####
     #                             --------------
@@ -28,18 +133,20 @@ class FloorPlanDetail(generics.RetrieveUpdateAPIView):
     #         It takes a full dict of floorplan data with locations
     #         and updates floorplan and all locations-- creating locations not
     #         already in the database.
+    #     Only rows that actually changed are written, in one transaction
+    #     (see api.sync). The response is the full floorplan, or just the
+    #     changeset when called with ?response=changeset.
     ####
+    @conditional
     def post(self, request, pk, format=None):
-        # get floorplan and location instances for serializers
         floorplan = FloorPlan.objects.get(pk=pk)
-        locations = Location.objects.filter(floorplan=floorplan)
 
         # partition new and old locations
         (to_be_updated, to_be_created) = partition(request.data['locations'], lambda loc: loc.get('id', False))
 
         # instantiate serializers
         floorplan_serializer = FloorPlanSerializer(data=request.data)
-        update_location_serializer = LocationUpdateSerializer(locations, data=to_be_updated, many=True)
+        update_location_serializer = LocationUpdateSerializer(data=to_be_updated, many=True)
         create_location_serializer = LocationCreateSerializer(data=to_be_created, many=True)
 
         # check if given data is valid
@@ -47,17 +154,17 @@ class FloorPlanDetail(generics.RetrieveUpdateAPIView):
         update_location_is_valid = update_location_serializer.is_valid()
         create_location_is_valid = create_location_serializer.is_valid()
 
-        # if valid, perform updates and creates
+        # if valid, write the differences
         if floorplan_is_valid and update_location_is_valid and create_location_is_valid:
-            # update floorplan
-            floorplan_serializer.update(floorplan, floorplan_serializer.validated_data)
-            # update locations
-            update_location_serializer.update(locations, update_location_serializer.validated_data)
-            # create locations
-            create_location_serializer.create(create_location_serializer.validated_data)
+            changeset = sync_floorplan(floorplan,
+                                       floorplan_serializer.validated_data,
+                                       update_location_serializer.validated_data,
+                                       create_location_serializer.validated_data)
+            if request.query_params.get('response') == 'changeset':
+                return Response(ChangesetSerializer(changeset).data)
             # get updated data
-            fp = FloorPlan.objects.get(pk=pk)
-            fp_serializer = FloorPlanSerializer(floorplan)
+            fp = FloorPlan.objects.for_serializer().get(pk=pk)
+            fp_serializer = FloorPlanSerializer(fp)
             return Response(fp_serializer.data)
 
         errors = {
@@ -68,18 +175,45 @@ class FloorPlanDetail(generics.RetrieveUpdateAPIView):
         return Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class FloorPlanRestore(APIView):
+    """
+        name : 'api-floorplan-restore'
+        POST : Take one of the user's FloorPlans out of the trash; returns
+               the FloorPlan like api-floorplan
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, pk, format=None):
+        floorplan = get_object_or_404(FloorPlan.objects, pk=pk, owner=request.user)
+        if floorplan.is_trashed:
+            floorplan.is_trashed = False
+            floorplan.save(update_fields=['is_trashed', 'trashed_at', 'last_updated'])
+        fp = FloorPlan.objects.for_serializer().get(pk=pk)
+        fp_serializer = FloorPlanSerializer(fp, context={'request': request})
+        return Response(fp_serializer.data)
+
+
 class LocationsByFloorPlan(APIView):
     """
         name : 'api-locations'
         GET : List of Location instances related to FloorPlan
+              ?since=<cursor> : only Locations created, changed or trashed
+              after the cursor (or shortly before it), with a new cursor
+              ?bbox=x0,y0,x1,y1 : only Locations inside the box
+              ?near=x,y[&limit=N] : the N Locations closest to the point
+              (bbox, near and ?loc_type= can be combined)
         POST : Create a list of Locations (must be in list)
         PUT : Update a list of Location instances
+        All methods honour ETag preconditions (see api.conditional).
+        Accept: application/vnd.sat.columnar+json (or application/msgpack)
+        returns Locations as parallel arrays (see api.renderers).
     """
     permission_classes = (IsAuthenticated,)
+    renderer_classes = LOCATION_RENDERERS
 
     def get_queryset(self, pk):
         floorplan = self.get_floorplan(pk)
-        return Location.objects.filter(floorplan=floorplan, is_trashed=False)
+        return Location.active.filter(floorplan=floorplan)
 
     def get_floorplan(self, pk):
         try:
@@ -91,20 +225,64 @@ class LocationsByFloorPlan(APIView):
         item['floorplan'] = pk
         return item
 
+    @conditional
     def get(self, request, pk, format=None):
+        if 'since' in request.query_params:
+            return self.get_delta(request, pk)
+        if 'bbox' in request.query_params or 'near' in request.query_params:
+            return self.get_spatial(request, pk)
         locations = self.get_queryset(pk)
-        serializer = LocationUpdateSerializer(locations, many=True)
+        serializer = LocationReadSerializer(locations, many=True)
+        return Response(serializer.data)
+
+    ####
+    #     Delta mode: trashed locations are included so clients can drop
+    #     them. The cursor is the newest last_updated returned (or `since`
+    #     unchanged when nothing newer changed); changes just before `since`
+    #     are sent again, see LocationQuerySet.changed_since.
+    ####
+    def get_delta(self, request, pk):
+        query = LocationDeltaQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since = query.validated_data['since']
+
+        floorplan = self.get_floorplan(pk)
+        locations = list(Location.objects.filter(floorplan=floorplan).changed_since(since))
+        cursor = max([since] + [location.last_updated for location in locations[-1:]])
+        serializer = LocationDeltaSerializer({'cursor': cursor, 'locations': locations})
         return Response(serializer.data)
 
+    ####
+    #     Spatial mode: positions are fractions of the floor plan's width and
+    #     height; nearest distances account for its aspect ratio.
+    ####
+    def get_spatial(self, request, pk):
+        query = LocationSpatialQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        floorplan = self.get_floorplan(pk)
+        locations = Location.active.filter(floorplan=floorplan)
+        if 'loc_type' in params:
+            locations = locations.filter(loc_type=params['loc_type'])
+        if 'bbox' in params:
+            locations = locations.in_bbox(*params['bbox'])
+        if 'near' in params:
+            x, y = params['near']
+            locations = locations.nearest(x, y, params['limit'], floorplan.aspect_ratio())
+        serializer = LocationReadSerializer(locations, many=True)
+        return Response(serializer.data)
+
+    @conditional
     def post(self, request, pk, format=None):
-        print(request.data)
         data = [self.specify_floorplan_key(item, pk) for item in request.data]
         serializer = LocationCreateSerializer(data=data, many=True)
         if serializer.is_valid():
-            serializer.create(serializer.validated_data)
+            serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @conditional
     def put(self, request, pk, format=None):
         data = request.data
         locations = self.get_queryset(pk)
@@ -114,3 +292,274 @@ class LocationsByFloorPlan(APIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class LocationRestore(APIView):
+    """
+        name : 'api-locations-restore'
+        POST : Take Locations of the FloorPlan out of the trash, given as
+               {"ids": [...]}; returns the restored Locations. Ids of
+               Locations that are not trashed are ignored. Only the
+               FloorPlan's owner can restore, as for FloorPlans.
+        Honours ETag preconditions (see api.conditional).
+    """
+    permission_classes = (IsAuthenticated, IsFloorPlanOwner)
+
+    @conditional
+    def post(self, request, pk, format=None):
+        query = LocationRestoreSerializer(data=request.data)
+        query.is_valid(raise_exception=True)
+        with transaction.atomic():
+            locations = list(Location.objects.select_for_update()
+                                             .filter(floorplan_id=pk, is_trashed=True,
+                                                     id__in=query.validated_data['ids'])
+                                             .order_by('id'))
+            # Written like a sync, so counters, search tokens, caches and
+            # location events follow.
+            bulk_update(Location, {location: assign_changes(location, {'is_trashed': False})
+                                   for location in locations})
+        serializer = LocationReadSerializer(locations, many=True)
+        return Response(serializer.data)
+
+
+class LocationImport(APIView):
+    """
+        name : 'api-locations-import'
+        POST : Create Locations from a CSV (text/csv, with a header row) or
+               JSON Lines (application/x-ndjson) body, streamed in chunks.
+               Invalid rows are skipped and reported by line number. Only the
+               FloorPlan's owner can import.
+        Honours ETag preconditions (see api.conditional).
+    """
+    permission_classes = (IsAuthenticated, IsFloorPlanOwner)
+
+    CONTENT_TYPES = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+    }
+
+    @conditional
+    def post(self, request, pk, format=None):
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in self.CONTENT_TYPES:
+            raise UnsupportedMediaType(content_type)
+        # request.stream is the unparsed body; request.data would read it
+        # all into memory.
+        stream = request.stream or []
+        floorplan = FloorPlan.objects.get(pk=pk)
+        result = import_locations(floorplan, read_rows(stream, self.CONTENT_TYPES[content_type]))
+        return Response(ImportReportSerializer(result).data)
+
+
+class LocationEvents(APIView):
+    """
+        name : 'api-location-events'
+        GET : Server-sent event stream of the FloorPlan's Location changes.
+              Each `locations` event holds the Locations written by one
+              commit, shaped like a ?since= delta, with the cursor as the
+              event id. A Last-Event-ID header (or ?since=<cursor>) first
+              replays the changes made after that cursor.
+    """
+    permission_classes = (IsOwnerOrFloorPlanIsPublic,)
+    renderer_classes = (EventStreamRenderer, JSONRenderer)
+
+    def get(self, request, pk, format=None):
+        floorplan = get_object_or_404(FloorPlan.objects.only('id', 'owner', 'is_public'), pk=pk)
+        self.check_object_permissions(request, floorplan)
+
+        since = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('since')
+        if since is not None:
+            query = LocationDeltaQuerySerializer(data={'since': since})
+            query.is_valid(raise_exception=True)
+            since = query.validated_data['since']
+
+        # Subscribe before reading the replay so no commit falls in between.
+        subscription = get_broker().subscribe(floorplan_channel(floorplan.id))
+        first_events = []
+        if since is not None:
+            locations = list(Location.objects.filter(floorplan=floorplan).changed_since(since))
+            if locations:
+                first_events.append(delta_event(max(since, locations[-1].last_updated), locations))
+
+        return EventStreamResponse(EventStream(subscription, first_events))
+
+
+####
+#     Exports stream their rows, so the formats are picked by the URL
+#     (export.<format>) rather than DRF content negotiation.
+####
+def export_response(locations, export_format, filename):
+    response = StreamingHttpResponse(export_locations(locations, export_format),
+                                     content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, export_format)
+    return response
+
+
+class FloorPlanExport(APIView):
+    """
+        name : 'api-floorplan-export'
+        GET : the FloorPlan's Locations as NDJSON, CSV or GeoJSON, streamed
+        Honours ETag preconditions (see api.conditional).
+    """
+    permission_classes = (IsOwnerOrFloorPlanIsPublic,)
+
+    @conditional
+    def get(self, request, pk, export_format):
+        locations = Location.objects.filter(floorplan_id=pk)
+        return export_response(locations, export_format, 'floorplan-{}'.format(pk))
+
+
+class FloorPlanListExport(APIView):
+    """
+        name : 'api-floorplans-export'
+        GET : Locations of every FloorPlan the user owns as NDJSON, CSV or
+              GeoJSON, streamed
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, export_format):
+        locations = Location.objects.filter(floorplan__owner=request.user)
+        return export_response(locations, export_format, 'floorplans')
+
+
+class LocationSearch(APIView):
+    """
+        name : 'api-location-search'
+        GET : Locations matching ?q= across every FloorPlan the user owns or
+              that is public, matching each word as a prefix (typeahead).
+              Trashed Locations and FloorPlans are left out.
+    """
+    def get(self, request, format=None):
+        query = LocationSearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        visible = Q(floorplan__is_public=True)
+        if request.user.is_authenticated:
+            visible |= Q(floorplan__owner=request.user)
+        # Not Location.active, see LocationQuerySet.search().
+        untrashed = Location.objects.exclude(is_trashed=True)
+        locations = (untrashed.search(params['q'])
+                              .filter(visible, floorplan__is_trashed=False)
+                              .select_related('floorplan')
+                              .order_by(Lower('name'), 'id'))
+        serializer = LocationSearchResultSerializer(locations[:params['limit']], many=True)
+        return Response(serializer.data)
+
+
+class FloorPlanAvailability(APIView):
+    """
+        name : 'api-availability'
+        GET : Locations of the FloorPlan that are neither booked nor
+              assigned at any time between ?start= and ?end= (ISO 8601).
+              ?loc_type= limits them to one type; by default all the types
+              that can be booked (desks, offices, conference rooms).
+    """
+    permission_classes = (IsOwnerOrFloorPlanIsPublic,)
+    renderer_classes = LOCATION_RENDERERS
+
+    def get(self, request, pk, format=None):
+        query = AvailabilityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        floorplan = get_object_or_404(FloorPlan.objects.only('id', 'owner', 'is_public'), pk=pk)
+        self.check_object_permissions(request, floorplan)
+
+        start, end = params['start'], params['end']
+        types = [params['loc_type']] if 'loc_type' in params else BOOKABLE_TYPES
+        booked = Booking.objects.filter(floorplan=floorplan).overlapping(start, end).values('location_id')
+        assigned = (Assignment.objects.filter(location__floorplan=floorplan)
+                                      .overlapping(start, end).values('location_id'))
+        locations = (Location.active.filter(floorplan=floorplan, loc_type__in=types)
+                                    .exclude(id__in=booked)
+                                    .exclude(id__in=assigned))
+        serializer = LocationReadSerializer(locations, many=True)
+        return Response(serializer.data)
+
+
+class FloorPlanBookings(APIView):
+    """
+        name : 'api-bookings'
+        GET : Bookings of the FloorPlan's Locations overlapping ?start= to
+              ?end=
+        POST : Book a Location for the current user, e.g.
+               {"location": 1, "starts_at": ..., "ends_at": ...}; 409 if it
+               is already booked or assigned during that time
+    """
+    permission_classes = (IsOwnerOrFloorPlanIsPublic,)
+
+    def get_floorplan(self, request, pk):
+        floorplan = get_object_or_404(FloorPlan.objects.only('id', 'owner', 'is_public'), pk=pk)
+        self.check_object_permissions(request, floorplan)
+        return floorplan
+
+    def get(self, request, pk, format=None):
+        query = PeriodQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        floorplan = self.get_floorplan(request, pk)
+        bookings = (Booking.objects.filter(floorplan=floorplan)
+                                   .overlapping(params['start'], params['end'])
+                                   .select_related('user')
+                                   .order_by('starts_at', 'id'))
+        serializer = BookingSerializer(bookings, many=True)
+        return Response(serializer.data)
+
+    def post(self, request, pk, format=None):
+        if not request.user.is_authenticated:
+            self.permission_denied(request)
+        floorplan = self.get_floorplan(request, pk)
+        serializer = BookingSerializer(data=request.data, context={'floorplan': floorplan})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        with transaction.atomic():
+            # Bookings of one location are made one at a time.
+            location = Location.objects.select_for_update().get(pk=data['location'].pk)
+            start, end = data['starts_at'], data['ends_at']
+            if (Booking.objects.filter(location=location).overlapping(start, end).exists() or
+                    Assignment.objects.filter(location=location).overlapping(start, end).exists()):
+                return Response({'detail': 'The location is not available at that time.'},
+                                status=status.HTTP_409_CONFLICT)
+            serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class BookingDetail(generics.DestroyAPIView):
+    """
+        name : 'api-booking'
+        DELETE : Cancel one of the current user's Bookings
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Booking.objects.filter(user=self.request.user)
+
+
+class UserWhereabouts(APIView):
+    """
+        name : 'api-whereabouts'
+        GET : Where the user is now (or at ?at=): the Locations they have
+              booked or are assigned to, on FloorPlans the current user may
+              see
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, username, format=None):
+        query = WhereaboutsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        moment = query.validated_data.get('at') or timezone.now()
+        user = get_object_or_404(User, username=username)
+
+        visible = Q(location__floorplan__is_public=True) | Q(location__floorplan__owner=request.user)
+        whereabouts = []
+        for kind, model in (('booking', Booking), ('assignment', Assignment)):
+            entries = (model.objects.filter(visible, user=user, location__is_trashed=False,
+                                            location__floorplan__is_trashed=False)
+                                    .at(moment)
+                                    .select_related('location__floorplan').order_by('starts_at'))
+            whereabouts.extend({'kind': kind, 'starts_at': entry.starts_at, 'ends_at': entry.ends_at,
+                                'location': entry.location} for entry in entries)
+        serializer = WhereaboutsSerializer(whereabouts, many=True)
+        return Response(serializer.data)
@@ -0,0 +1,252 @@
+"""
+Latency, query count and peak memory of the floor plan API and pages, on
+synthetic floor plans of several sizes, against a throwaway SQLite
+database.
+
+Each case is run --repeat times, keeping the median and fastest times.
+Peak memory is the largest Python allocation during one more run (traced
+separately, as tracing slows the code down). Results are written as JSON,
+and compared with a previous run with --compare: a case regresses when it
+takes more queries, or when its fastest time or peak memory grow by more
+than the allowed fraction. The fastest time is compared because it is the
+least disturbed by whatever else the machine is doing. Any regression makes
+the exit status 1.
+
+Run from the repository root:
+
+    python benchmarks/api_suite.py --sizes 100 1000 10000 --output before.json
+    (change something)
+    python benchmarks/api_suite.py --sizes 100 1000 10000 --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from common import TestDatabase, create_floorplan
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from floorplans.models import Location
+
+
+# Floor plans on the dashboard besides the one being measured.
+DASHBOARD_FLOORPLANS = 20
+
+# Locations created by one POST to api-locations.
+NEW_LOCATIONS = 100
+
+
+class Cases:
+    """
+    The measured requests on one floor plan. Each case is a method making
+    one request, with any setup it needs done in a `prepare_<case>` method
+    run outside the measurement.
+    """
+    def __init__(self, client, floorplan):
+        self.client = client
+        self.floorplan = floorplan
+        self.floorplan_url = reverse('api-floorplan', kwargs={'pk': floorplan.id})
+        self.locations_url = reverse('api-locations', kwargs={'pk': floorplan.id})
+        self.moves = 0
+
+    def names(self):
+        return ['floorplan_get', 'floorplan_put', 'floorplan_post',
+                'locations_get', 'locations_put', 'locations_post',
+                'view_floorplan', 'dashboard']
+
+    def send(self, method, url, data=None):
+        if data is not None:
+            response = getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+        else:
+            response = getattr(self.client, method)(url)
+        if response.status_code >= 400:
+            raise RuntimeError('{} {} returned {}'.format(method.upper(), url, response.status_code))
+        return response
+
+    def moved_locations(self):
+        # A new position every run, so every location is actually written.
+        self.moves += 1
+        locations = self.send('get', self.locations_url).json()
+        for location in locations:
+            location['position_x'] = (location['position_x'] + 0.001 * self.moves) % 1
+        return locations
+
+    def prepare_floorplan_get(self):
+        cache.clear()
+
+    def floorplan_get(self):
+        self.send('get', self.floorplan_url)
+
+    def prepare_floorplan_put(self):
+        self.put_payload = {'name': 'Floor {}'.format(self.moves), 'owner': self.floorplan.owner_id}
+        self.moves += 1
+
+    def floorplan_put(self):
+        self.send('put', self.floorplan_url, self.put_payload)
+
+    def prepare_floorplan_post(self):
+        cache.clear()
+        data = self.send('get', self.floorplan_url).json()
+        locations = data['locations']
+        # An editor saving after moving one location and adding another.
+        locations[0]['position_x'] = (locations[0]['position_x'] + 0.5) % 1
+        locations.append({'name': 'New', 'floorplan': self.floorplan.id, 'loc_type': 'DESK',
+                          'position_x': 0.5, 'position_y': 0.5})
+        self.post_payload = data
+
+    def floorplan_post(self):
+        self.send('post', self.floorplan_url, self.post_payload)
+
+    def locations_get(self):
+        self.send('get', self.locations_url)
+
+    def prepare_locations_put(self):
+        self.put_locations = self.moved_locations()
+
+    def locations_put(self):
+        self.send('put', self.locations_url, self.put_locations)
+
+    def prepare_locations_post(self):
+        Location.objects.filter(floorplan=self.floorplan, name='Posted').delete()
+
+    def locations_post(self):
+        self.send('post', self.locations_url, [
+            {'name': 'Posted', 'loc_type': 'DESK', 'position_x': i / NEW_LOCATIONS, 'position_y': 0.99}
+            for i in range(NEW_LOCATIONS)
+        ])
+
+    def prepare_view_floorplan(self):
+        cache.clear()
+
+    def view_floorplan(self):
+        self.send('get', reverse('floorplans_view', kwargs={'floorplan_id': self.floorplan.id}))
+
+    def dashboard(self):
+        self.send('get', reverse('floorplans_dashboard'))
+
+
+def measure(cases, name, repeat):
+    prepare = getattr(cases, 'prepare_' + name, lambda: None)
+    run = getattr(cases, name)
+    timings = []
+    for _ in range(repeat):
+        prepare()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        # Counted now: the next request resets the connection's query log.
+        query_count = len(queries)
+
+    prepare()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2),
+        'queries': query_count,
+        'peak_kb': round(peak / 1024),
+    }
+
+
+def run_suite(sizes, repeat):
+    results = {}
+    with TestDatabase():
+        owner = User.objects.create_user('owner', password='password')
+        for i in range(DASHBOARD_FLOORPLANS):
+            create_floorplan(10, name='Other {}'.format(i), owner=owner)
+        client = Client()
+        client.force_login(owner)
+        for size in sizes:
+            floorplan = create_floorplan(size, owner=owner)
+            cases = Cases(client, floorplan)
+            for name in cases.names():
+                key = '{}@{}'.format(name, size)
+                results[key] = measure(cases, name, repeat)
+                print('{:<24} {median_ms:>10.1f}ms {queries:>6} queries {peak_kb:>9} KB'.format(
+                    key, **results[key]), flush=True)
+    return results
+
+
+def compare(results, baseline, max_slowdown, max_memory_growth, min_ms):
+    """
+    Print the cases that regressed against `baseline` and return how many.
+    """
+    regressions = 0
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        problems = []
+        if result['queries'] > before['queries']:
+            problems.append('queries {} -> {}'.format(before['queries'], result['queries']))
+        if result['min_ms'] > max(before['min_ms'] * (1 + max_slowdown), before['min_ms'] + min_ms):
+            problems.append('time {}ms -> {}ms'.format(before['min_ms'], result['min_ms']))
+        if result['peak_kb'] > before['peak_kb'] * (1 + max_memory_growth):
+            problems.append('peak {}KB -> {}KB'.format(before['peak_kb'], result['peak_kb']))
+        if problems:
+            regressions += 1
+            print('REGRESSION {}: {}'.format(key, ', '.join(problems)))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Locations on the measured floor plans (up to 100000).')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Results of a previous run to check for regressions.')
+    parser.add_argument('--max-slowdown', type=float, default=0.25,
+                        help='Allowed growth of the fastest time, as a fraction.')
+    parser.add_argument('--max-memory-growth', type=float, default=0.25,
+                        help='Allowed growth of peak memory, as a fraction.')
+    parser.add_argument('--min-ms', type=float, default=2,
+                        help='Slowdowns smaller than this many milliseconds are noise.')
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.repeat)
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('Compared with {}'.format(baseline.get('commit') or args.compare))
+        regressions = compare(results, baseline['results'], args.max_slowdown, args.max_memory_growth, args.min_ms)
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+How many concurrent readers one process serves under WSGI and ASGI.
+
+Opens --streams location event streams (long-lived clients, like editors
+waiting for changes) on a public floor plan, then times --readers GETs of
+the floor plan made at the same moment. Both servers get the same number of
+threads (--workers):
+
+* WSGI, as a threaded server runs it: each connection holds a thread until
+  its response is done, so once the streams take every thread the readers
+  wait for a stream to expire (LOCATION_EVENTS_MAX_AGE, --max-age).
+* ASGI (sat.asgi): the streams wait on the event loop and the threads only
+  run views, so readers are served at once.
+
+Run from the repository root:
+
+    python benchmarks/asgi_concurrency.py --workers 8 --streams 64 --readers 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from common import TestDatabase, create_floorplan
+from django.conf import settings
+
+
+def summary(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print('{:<5} {:>6} readers in {:6.2f}s  median {:7.1f}ms  p95 {:7.1f}ms'.format(
+        name, len(latencies), elapsed, statistics.median(latencies) * 1000, p95 * 1000))
+
+
+def run_wsgi(floorplan, args):
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+    def request(path, accept, submitted):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+            'HTTP_ACCEPT': accept, 'wsgi.input': BytesIO(), 'wsgi.errors': BytesIO(),
+            'wsgi.url_scheme': 'http', 'wsgi.multithread': True,
+        }
+        result = application(environ, lambda status, headers, exc_info=None: None)
+        for _ in result:
+            pass
+        result.close()
+        # Includes the time spent waiting for a free thread.
+        return time.monotonic() - submitted
+
+    events = '/api/floorplans/{}/locations/events/'.format(floorplan.id)
+    detail = '/api/floorplans/{}/'.format(floorplan.id)
+    with ThreadPoolExecutor(args.workers) as pool:
+        for _ in range(args.streams):
+            pool.submit(request, events, 'text/event-stream', time.monotonic())
+        time.sleep(0.2)
+        started = time.monotonic()
+        readers = [pool.submit(request, detail, 'application/json', started) for _ in range(args.readers)]
+        latencies = [reader.result() for reader in readers]
+        elapsed = time.monotonic() - started
+    summary('WSGI', latencies, elapsed)
+
+
+def run_asgi(floorplan, args):
+    from sat.asgi import application
+
+    async def request(path, accept, connected):
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                 'headers': [(b'host', b'testserver'), (b'accept', accept.encode('ascii'))]}
+        messages = [{'type': 'http.request', 'body': b''}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await connected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            pass
+
+        started = time.monotonic()
+        await application(scope, receive, send)
+        return time.monotonic() - started
+
+    async def main():
+        connected = asyncio.Event()
+        events = '/api/floorplans/{}/locations/events/'.format(floorplan.id)
+        detail = '/api/floorplans/{}/'.format(floorplan.id)
+        streams = [asyncio.ensure_future(request(events, 'text/event-stream', connected))
+                   for _ in range(args.streams)]
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        latencies = await asyncio.gather(*[request(detail, 'application/json', connected)
+                                           for _ in range(args.readers)])
+        elapsed = time.monotonic() - started
+        connected.set()
+        await asyncio.gather(*streams)
+        return latencies, elapsed
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_default_executor(ThreadPoolExecutor(args.workers))
+    latencies, elapsed = loop.run_until_complete(main())
+    loop.close()
+    summary('ASGI', latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=8, help='Threads per server.')
+    parser.add_argument('--streams', type=int, default=64, help='Open event streams.')
+    parser.add_argument('--readers', type=int, default=200, help='Concurrent floor plan GETs.')
+    parser.add_argument('--locations', type=int, default=500, help='Locations on the floor plan.')
+    parser.add_argument('--max-age', type=float, default=3, help='Seconds an event stream stays open.')
+    args = parser.parse_args()
+
+    settings.LOCATION_EVENTS_MAX_AGE = args.max_age
+    settings.LOCATION_EVENTS_KEEPALIVE = args.max_age
+    with TestDatabase():
+        floorplan = create_floorplan(args.locations, is_public=True)
+        print('{} threads, {} open event streams, {} locations'.format(args.workers, args.streams, args.locations))
+        run_wsgi(floorplan, args)
+        run_asgi(floorplan, args)
+
+
+if __name__ == '__main__':
+    main()
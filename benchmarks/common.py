@@ -0,0 +1,60 @@
+"""
+Setup shared by the benchmarks: Django configured from sat.settings with a
+throwaway database, so benchmarks never touch db.sqlite3.
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sat.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from api.bulk import bulk_create  # noqa: E402
+from floorplans.models import FloorPlan, Location  # noqa: E402
+
+
+class TestDatabase:
+    """
+    A migrated database in a temporary file (so every thread sees the same
+    data), dropped on exit.
+    """
+    def __enter__(self):
+        self.old_name = connection.settings_dict['NAME']
+        settings.DATABASES['default']['TEST'] = {'NAME': os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')}
+        # DEBUG off, as in production: it logs every query.
+        setup_test_environment(debug=False)
+        connection.creation.create_test_db(verbosity=0)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection.creation.destroy_test_db(self.old_name, verbosity=0)
+
+
+# Synthetic floors are mostly desks, with a room every so often.
+LOCATION_MIX = ['DESK'] * 12 + ['OFFICE', 'OFFICE', 'CONFR', 'COMMON', 'RESTROOM', 'MISC']
+
+
+def create_floorplan(locations, name='Floor', owner=None, **kwargs):
+    """
+    A floor plan with `locations` synthetic locations laid out on a grid,
+    indexed and counted the way the API's bulk create leaves them.
+    """
+    if owner is None:
+        owner, _ = User.objects.get_or_create(username='owner')
+    floorplan = FloorPlan.objects.create(name=name, owner=owner, image='floorplans/floor-plan.jpg', **kwargs)
+    bulk_create(Location, [
+        Location(name='Desk {}'.format(i), loc_type=LOCATION_MIX[i % len(LOCATION_MIX)],
+                 details='Row {} seat {}'.format(i // 100, i % 100), extension=1000 + i % 9000,
+                 floorplan=floorplan, position_x=(i % 100) / 100, position_y=(i // 100 % 100) / 100)
+        for i in range(locations)
+    ], batch_size=500)
+    return floorplan
@@ -0,0 +1,50 @@
+"""
+LocationUpdateSerializer against the values_list() fast path of
+LocationReadSerializer, serializing and rendering a floor plan's locations
+to JSON.
+
+Run from the repository root:
+
+    python benchmarks/location_serializers.py --rows 1000 10000 100000
+"""
+
+import argparse
+import time
+
+from common import TestDatabase, create_floorplan
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import LocationReadSerializer, LocationUpdateSerializer
+from floorplans.models import Location
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    render = JSONRenderer().render
+    print('{:>8}  {:>12}  {:>12}  {:>8}'.format('rows', 'DRF', 'fast path', 'speedup'))
+    with TestDatabase():
+        for rows in args.rows:
+            floorplan = create_floorplan(rows)
+            locations = Location.objects.filter(floorplan=floorplan)
+            assert (render(LocationReadSerializer(locations, many=True).data) ==
+                    render(LocationUpdateSerializer(locations, many=True).data))
+            slow = best_of(args.repeat, lambda: render(LocationUpdateSerializer(locations.all(), many=True).data))
+            fast = best_of(args.repeat, lambda: render(LocationReadSerializer(locations.all(), many=True).data))
+            print('{:>8}  {:>10.1f}ms  {:>10.1f}ms  {:>7.1f}x'.format(rows, slow * 1000, fast * 1000, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
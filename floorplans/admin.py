@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from .models import FloorPlan, Location
+from .models import Assignment, Booking, FloorPlan, Location
 
 
 admin.site.register(FloorPlan)
 admin.site.register(Location)
+admin.site.register(Assignment)
+admin.site.register(Booking)
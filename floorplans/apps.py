@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FloorplansConfig(AppConfig):
     name = 'floorplans'
+
+    def ready(self):
+        from . import signals  # noqa: F401
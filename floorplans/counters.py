@@ -0,0 +1,82 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+
+# The counter a location is part of when it was loaded is unknown (some of
+# the fields were deferred, or it was built by hand), so its floor plan is
+# recounted instead.
+UNKNOWN = object()
+
+
+def counted_as(location):
+    """
+    The (floorplan id, loc_type) counter the location counts towards, or
+    None for trashed locations.
+    """
+    if location.is_trashed:
+        return None
+    return (location.floorplan_id, location.loc_type)
+
+
+def update_location_counts(locations, location_model, count_model, created=False, deleted=False):
+    """
+    Bring the per-type counters in line with `locations` after they were
+    saved (or deleted), using the counter each one was part of when it was
+    loaded (see Location.from_db). Runs in the caller's transaction, so the
+    counters commit or roll back with the rows. Model classes are passed in
+    as for recount_location_types().
+    """
+    deltas = Counter()
+    recount = set()
+    for location in locations:
+        before = None if created else getattr(location, '_counted_as', UNKNOWN)
+        after = None if deleted else counted_as(location)
+        location._counted_as = after
+        if before is UNKNOWN:
+            recount.add(location.floorplan_id)
+        elif before != after:
+            if before is not None:
+                deltas[before] -= 1
+            if after is not None:
+                deltas[after] += 1
+
+    for (floorplan_id, loc_type), delta in sorted(deltas.items()):
+        if delta and floorplan_id not in recount:
+            _add(count_model, floorplan_id, loc_type, delta)
+    if recount:
+        recount_location_types(recount, location_model, count_model)
+
+
+def _add(count_model, floorplan_id, loc_type, delta):
+    counters = count_model.objects.filter(floorplan_id=floorplan_id, loc_type=loc_type)
+    if counters.update(count=F('count') + delta) or delta < 0:
+        # A missing counter is not created by a decrement, which also keeps
+        # the locations deleted with their floor plan from recreating one.
+        return
+    try:
+        with transaction.atomic():
+            count_model.objects.create(floorplan_id=floorplan_id, loc_type=loc_type, count=delta)
+    except IntegrityError:
+        # Created by a concurrent write in the meantime.
+        counters.update(count=F('count') + delta)
+
+
+def recount_location_types(floorplan_ids, location_model, count_model):
+    """
+    Rebuild the counters of the given floor plans from their locations, e.g.
+    after a QuerySet.update(), which bypasses the signals. Model classes are
+    passed in because models.py imports this module.
+    """
+    floorplan_ids = list(floorplan_ids)
+    with transaction.atomic():
+        count_model.objects.filter(floorplan_id__in=floorplan_ids).delete()
+        counts = (location_model.objects.filter(floorplan_id__in=floorplan_ids, is_trashed=False)
+                                        .values_list('floorplan_id', 'loc_type')
+                                        .annotate(count=Count('id'))
+                                        .order_by())
+        count_model.objects.bulk_create([
+            count_model(floorplan_id=floorplan_id, loc_type=loc_type, count=count)
+            for floorplan_id, loc_type, count in counts
+        ])
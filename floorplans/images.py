@@ -0,0 +1,138 @@
+import hashlib
+import io
+import json
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, features
+
+
+TILE_SIZE = 256
+
+FORMATS = {
+    # format: (Pillow format, file extension, save options)
+    'webp': ('WEBP', 'webp', {'quality': 80}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True}),
+}
+
+
+def file_sha256(field_file):
+    digest = hashlib.sha256()
+    field_file.seek(0)
+    for chunk in field_file.chunks():
+        digest.update(chunk)
+    field_file.seek(0)
+    return digest.hexdigest()
+
+
+def tile_format():
+    """
+    The configured tile format, falling back to JPEG when Pillow was built
+    without WebP support.
+    """
+    name = settings.FLOORPLAN_TILE_FORMAT
+    if name == 'webp' and not features.check('webp'):
+        name = 'jpeg'
+    return name
+
+
+def tiles_dir(image_hash):
+    return 'tiles/{}'.format(image_hash)
+
+
+def tile_url_template(floorplan):
+    """
+    URL of the floor plan's tiles with {z}, {x} and {y} placeholders for the
+    level, column and row.
+    """
+    extension = FORMATS[floorplan.tile_format][1]
+    url = reverse('floorplans_tile', kwargs={
+        'image_hash': floorplan.image_hash, 'level': 0, 'col': 0, 'row': 0, 'extension': extension,
+    })
+    return url.replace('/0/0_0.', '/{z}/{x}_{y}.')
+
+
+def preview_path(image_hash):
+    return 'previews/{}.jpg'.format(image_hash)
+
+
+def generate_preview(image_file, image_hash):
+    """
+    Store a JPEG of the image scaled to fit FLOORPLAN_PREVIEW_SIZE, for a
+    fast first paint before tiles are loaded.
+    """
+    path = preview_path(image_hash)
+    if default_storage.exists(path):
+        return path
+    image = Image.open(image_file)
+    image.draft('RGB', (settings.FLOORPLAN_PREVIEW_SIZE, settings.FLOORPLAN_PREVIEW_SIZE))
+    image = image.convert('RGB')
+    image.thumbnail((settings.FLOORPLAN_PREVIEW_SIZE, settings.FLOORPLAN_PREVIEW_SIZE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+    _replace(path, buffer.getvalue())
+    return path
+
+
+def max_level(width, height):
+    """
+    Deep zoom levels run from 0 (a 1x1 pixel image) to the level holding the
+    image at full size.
+    """
+    return int(math.ceil(math.log(max(width, height, 1), 2)))
+
+
+def generate_tiles(image_file, image_hash, name=None):
+    """
+    Cut the image into a pyramid of TILE_SIZE tiles, halving it from full
+    size down to one pixel, and store them as
+    tiles/<image_hash>/<level>/<col>_<row>.<ext>.
+
+    Tiles are addressed by the image content, so identical uploads share
+    them: when a finished pyramid already exists nothing is decoded. A
+    tiles.json manifest is written last and marks the pyramid complete.
+    Returns the format name used.
+    """
+    name = name or tile_format()
+    pil_format, extension, options = FORMATS[name]
+    directory = tiles_dir(image_hash)
+    manifest = '{}/tiles.json'.format(directory)
+    if default_storage.exists(manifest):
+        with default_storage.open(manifest) as f:
+            return json.loads(f.read().decode('utf-8'))['format']
+
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image.load()
+    image = image.convert('RGB')
+    width, height = image.size
+    top = max_level(width, height)
+
+    for level in range(top, -1, -1):
+        level_width, level_height = image.size
+        for col in range(int(math.ceil(level_width / TILE_SIZE))):
+            for row in range(int(math.ceil(level_height / TILE_SIZE))):
+                box = (col * TILE_SIZE, row * TILE_SIZE,
+                       min((col + 1) * TILE_SIZE, level_width),
+                       min((row + 1) * TILE_SIZE, level_height))
+                buffer = io.BytesIO()
+                image.crop(box).save(buffer, pil_format, **options)
+                _replace('{}/{}/{}_{}.{}'.format(directory, level, col, row, extension), buffer.getvalue())
+        if level > 0:
+            image = image.resize((max(1, int(math.ceil(level_width / 2))),
+                                  max(1, int(math.ceil(level_height / 2)))), Image.LANCZOS)
+
+    info = {'format': name, 'width': width, 'height': height, 'tile_size': TILE_SIZE, 'max_level': top}
+    _replace(manifest, json.dumps(info).encode('utf-8'))
+    return name
+
+
+def _replace(path, content):
+    # Storage.save() renames instead of overwriting, which would orphan the
+    # tiles of an interrupted run.
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(content))
@@ -0,0 +1,147 @@
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .images import FORMATS, generate_preview, generate_tiles, tile_format
+from .models import FloorPlan, ImageJob
+from .thumbnails import get_thumbnail
+
+
+# Seconds before the first retry of a failed job; doubled on each attempt.
+RETRY_DELAY = 30
+
+
+def tiles_task(image_name, image_hash):
+    with default_storage.open(image_name, 'rb') as image_file:
+        return {'tile_format': generate_tiles(image_file, image_hash)}
+
+
+def preview_task(image_name, image_hash):
+    with default_storage.open(image_name, 'rb') as image_file:
+        generate_preview(image_file, image_hash)
+    return {}
+
+
+def thumbnail_task(image_name, image_hash):
+    # Warms the thumbnail cache for the dashboard.
+    get_thumbnail(image_name, image_hash, settings.FLOORPLAN_THUMBNAIL_SIZE, FORMATS[tile_format()][1])
+    return {}
+
+
+# Each task turns an image into derivatives and returns the FloorPlan fields
+# to update. Tasks only touch storage, never the database, so they can run
+# in worker processes.
+TASKS = {
+    'tiles': tiles_task,
+    'preview': preview_task,
+    'thumbnail': thumbnail_task,
+}
+
+
+def run_task(task, image_name, image_hash):
+    return TASKS[task](image_name, image_hash)
+
+
+def enqueue_image_jobs(floorplan):
+    ImageJob.objects.bulk_create([ImageJob(floorplan=floorplan, task=task) for task in sorted(TASKS)])
+
+
+def claim_jobs(limit):
+    """
+    Mark up to `limit` due jobs as running, leased to this worker for
+    IMAGE_JOB_LEASE_SECONDS, and return them. The status check in the UPDATE
+    keeps two workers from claiming the same job.
+    """
+    due = ImageJob.objects.filter(status='pending', run_after__lte=timezone.now()).order_by('id')
+    claimed = []
+    for job in due.select_related('floorplan')[:limit]:
+        now = timezone.now()
+        if ImageJob.objects.filter(pk=job.pk, status='pending').update(status='running', claimed_at=now,
+                                                                       attempts=job.attempts + 1):
+            job.status = 'running'
+            job.claimed_at = now
+            job.attempts += 1
+            claimed.append(job)
+    return claimed
+
+
+def _leased(job):
+    # The job as this worker claimed it, unless its lease was taken over.
+    return ImageJob.objects.filter(pk=job.pk, status='running', claimed_at=job.claimed_at)
+
+
+def renew_leases(jobs):
+    """
+    Extend the lease of claimed jobs that are still running. Returns the
+    jobs whose lease was lost.
+    """
+    lost = []
+    for job in jobs:
+        now = timezone.now()
+        if _leased(job).update(claimed_at=now):
+            job.claimed_at = now
+        else:
+            lost.append(job)
+    return lost
+
+
+def requeue_expired_jobs():
+    """
+    Put back running jobs whose lease ran out, left by a worker that died.
+    Jobs that live workers are running keep their lease.
+    """
+    expired = timezone.now() - timedelta(seconds=settings.IMAGE_JOB_LEASE_SECONDS)
+    running = ImageJob.objects.filter(status='running')
+    return running.filter(Q(claimed_at__lt=expired) | Q(claimed_at__isnull=True)).update(status='pending',
+                                                                                       claimed_at=None)
+
+
+def finish_job(job, updates=None, error=None):
+    """
+    Record the outcome of a claimed job: apply its FloorPlan updates, or
+    schedule a retry with exponential backoff until it runs out of attempts.
+    Once no job of the floor plan is left, the floor plan becomes ready, or
+    failed if any job failed for good. Nothing is recorded when the job's
+    lease ran out and it was requeued meanwhile; returns whether it was.
+    """
+    with transaction.atomic():
+        if not _leased(job).select_for_update().exists():
+            return False
+        job.claimed_at = None
+        if error is None:
+            job.status = 'done'
+        elif job.attempts < job.max_attempts:
+            job.status = 'pending'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = 'failed'
+        job.last_error = error or ''
+        job.save()
+
+        floorplan = FloorPlan.objects.select_for_update().get(pk=job.floorplan_id)
+        for name, value in (updates or {}).items():
+            setattr(floorplan, name, value)
+        jobs = ImageJob.objects.filter(floorplan=floorplan)
+        if not jobs.filter(status__in=('pending', 'running')).exists():
+            floorplan.processing_state = 'failed' if jobs.filter(status='failed').exists() else 'ready'
+        # last_updated is the floor plan's version (see api.conditional),
+        # which keys its cached JSON.
+        floorplan.save(update_fields=list(updates or {}) + ['processing_state', 'last_updated'])
+    return True
+
+
+def run_job(job):
+    """
+    Run a claimed job in this process.
+    """
+    try:
+        updates = run_task(job.task, job.floorplan.image.name, job.floorplan.image_hash)
+    except Exception:
+        finish_job(job, error=traceback.format_exc())
+    else:
+        finish_job(job, updates)
@@ -0,0 +1,93 @@
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from floorplans.jobs import claim_jobs, finish_job, renew_leases, requeue_expired_jobs, run_job, run_task
+
+
+class Command(BaseCommand):
+    help = 'Run queued floor plan image jobs (tiles, previews) on a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes; 0 runs jobs in this process.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due instead of polling for more.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        pool = self.start_pool(workers)
+        try:
+            while True:
+                # Other workers may be running; only jobs whose lease ran
+                # out were left by a dead one.
+                requeued = requeue_expired_jobs()
+                if requeued:
+                    self.stdout.write('Requeued {} interrupted job(s)'.format(requeued))
+                jobs = claim_jobs(max(workers, 1) * 2)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                if pool is None:
+                    for i, job in enumerate(jobs):
+                        renew_leases(jobs[i:])
+                        run_job(job)
+                elif not self.run_in_pool(pool, jobs):
+                    self.stderr.write('A worker process died; restarting the pool')
+                    pool.shutdown(wait=False)
+                    pool = self.start_pool(workers)
+                self.stdout.write('Processed {} job(s)'.format(len(jobs)))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def start_pool(self, workers):
+        if not workers:
+            return None
+        # Forked workers must not share the parent's database connection.
+        connections.close_all()
+        return ProcessPoolExecutor(max_workers=workers)
+
+    def run_in_pool(self, pool, jobs):
+        """
+        Run the jobs on the pool, renewing their leases until they finish.
+        Returns False when the pool broke (a worker process died) and must
+        be replaced.
+        """
+        futures = {}
+        for job in jobs:
+            try:
+                futures[pool.submit(run_task, job.task, job.floorplan.image.name, job.floorplan.image_hash)] = job
+            except BrokenProcessPool:
+                finish_job(job, error=traceback.format_exc())
+        healthy = len(futures) == len(jobs)
+
+        # Results are written back from this process, so the usual save()
+        # signals fire.
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=settings.IMAGE_JOB_LEASE_SECONDS / 3, return_when=FIRST_COMPLETED)
+            renew_leases([futures[future] for future in pending])
+            for future in done:
+                job = futures[future]
+                try:
+                    updates = future.result()
+                except BrokenProcessPool:
+                    healthy = False
+                    finish_job(job, error=traceback.format_exc())
+                except Exception:
+                    # Includes the worker's traceback, chained as the cause.
+                    finish_job(job, error=traceback.format_exc())
+                else:
+                    finish_job(job, updates)
+        return healthy
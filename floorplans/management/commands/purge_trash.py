@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from floorplans.trash import purge_trash, purgeable
+
+
+class Command(BaseCommand):
+    help = ('Archive and delete the floor plans and locations that have been in the trash '
+            'longer than the retention period.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TRASH_RETENTION_DAYS,
+                            help='Days rows stay in the trash before they are purged.')
+        parser.add_argument('--batch-size', type=int, default=settings.TRASH_PURGE_BATCH_SIZE,
+                            help='Rows archived and deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to wait between batches, to leave room for other writes.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many rows would be purged.')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            locations, floorplans = purgeable(before)
+            self.stdout.write('Would purge {} location(s) and {} floor plan(s) trashed before {}'.format(
+                locations.count(), floorplans.count(), before.isoformat()))
+            return
+
+        locations, floorplans = purge_trash(before, options['batch_size'], options['pause'])
+        self.stdout.write('Purged {} location(s) and {} floor plan(s) trashed before {}'.format(
+            locations, floorplans, before.isoformat()))
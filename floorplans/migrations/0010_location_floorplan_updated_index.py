@@ -0,0 +1,17 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0009_auto_20180225_1027'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['floorplan', 'last_updated'], name='location_floorplan_updated'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:06
+
+from django.db import migrations, models
+import floorplans.spatial
+
+
+def fill_grid_cells(apps, schema_editor):
+    Location = apps.get_model('floorplans', 'Location')
+    cells = {}
+    for pk, x, y in Location.objects.values_list('pk', 'position_x', 'position_y').iterator():
+        cells.setdefault(floorplans.spatial.grid_cell(x, y), []).append(pk)
+    for cell, pks in cells.items():
+        for i in range(0, len(pks), 500):
+            Location.objects.filter(pk__in=pks[i:i + 500]).update(grid_cell=cell)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0010_location_floorplan_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='grid_cell',
+            field=floorplans.spatial.GridCellField(default=0, x_field='position_x', y_field='position_y'),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['floorplan', 'grid_cell'], name='location_floorplan_cell'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:07
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# floorplans.models.LOCATION_TYPES and the tokenizer of floorplans.search as
+# they were when this migration was written.
+LOCATION_TYPES = {
+    'DESK': 'Desk',
+    'OFFICE': 'Office',
+    'CONFR': 'Conference Room',
+    'COMMON': 'Common Area',
+    'RESTROOM': 'Restroom',
+    'PUBLIC': 'Public Area',
+    'PRIVATE': 'Private Area',
+    'MISC': 'Miscellaneous',
+}
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def location_tokens(location):
+    text = ' '.join([
+        location.name,
+        location.details,
+        str(location.extension) if location.extension is not None else '',
+        location.loc_type,
+        LOCATION_TYPES.get(location.loc_type, ''),
+    ])
+    return {word.lower() for word in WORD.findall(text)}
+
+
+def index_existing_locations(apps, schema_editor):
+    Location = apps.get_model('floorplans', 'Location')
+    LocationSearchToken = apps.get_model('floorplans', 'LocationSearchToken')
+    LocationSearchToken.objects.bulk_create((
+        LocationSearchToken(location_id=location.pk, token=token[:100])
+        for location in Location.objects.all().iterator()
+        for token in location_tokens(location)
+    ), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0011_location_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='floorplans.Location')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='locationsearchtoken',
+            index=models.Index(fields=['token', 'location'], name='search_token_location'),
+        ),
+        migrations.RunPython(index_existing_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0012_location_search_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='floorplan',
+            index=models.Index(fields=['owner', 'is_trashed', '-last_updated', '-id'], name='floorplan_owner_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='floorplan',
+            index=models.Index(fields=['is_public', 'is_trashed', '-last_updated', '-id'], name='floorplan_public_updated'),
+        ),
+    ]
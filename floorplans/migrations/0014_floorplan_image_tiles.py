@@ -0,0 +1,23 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0013_floorplan_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='floorplan',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='floorplan',
+            name='tile_format',
+            field=models.CharField(blank=True, editable=False, max_length=4),
+        ),
+    ]
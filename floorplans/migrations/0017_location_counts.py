@@ -0,0 +1,81 @@
+# Generated by Django 2.0.1 on 2026-10-18 12:49
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+# Partial indexes of the rows every hot query is limited to. Only created on
+# PostgreSQL: SQLite only uses a partial index when the query spells out its
+# condition as a literal, and Django passes `is_trashed = false` as a
+# parameter; there the composite indexes above serve the same queries.
+POSTGRESQL_PARTIAL_INDEXES = [
+    ('location_active_cell', 'floorplans_location', '(floorplan_id, grid_cell)', 'NOT is_trashed'),
+    ('floorplan_active_owner', 'floorplans_floorplan', '(owner_id, last_updated DESC, id DESC)', 'NOT is_trashed'),
+    ('floorplan_active_public', 'floorplans_floorplan', '(last_updated DESC, id DESC)', 'is_public AND NOT is_trashed'),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, columns, condition in POSTGRESQL_PARTIAL_INDEXES:
+            schema_editor.execute('CREATE INDEX {} ON {} {} WHERE {}'.format(name, table, columns, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, _, _, _ in POSTGRESQL_PARTIAL_INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+def count_existing_locations(apps, schema_editor):
+    FloorPlan = apps.get_model('floorplans', 'FloorPlan')
+    Location = apps.get_model('floorplans', 'Location')
+    LocationTypeCount = apps.get_model('floorplans', 'LocationTypeCount')
+    floorplan_ids = list(FloorPlan.objects.values_list('id', flat=True))
+    for i in range(0, len(floorplan_ids), 500):
+        counts = (Location.objects.filter(floorplan_id__in=floorplan_ids[i:i + 500], is_trashed=False)
+                                  .values_list('floorplan_id', 'loc_type')
+                                  .annotate(count=Count('id'))
+                                  .order_by())
+        LocationTypeCount.objects.bulk_create([
+            LocationTypeCount(floorplan_id=floorplan_id, loc_type=loc_type, count=count)
+            for floorplan_id, loc_type, count in counts
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0016_bookings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationTypeCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loc_type', models.CharField(choices=[('DESK', 'Desk'), ('OFFICE', 'Office'), ('CONFR', 'Conference Room'), ('COMMON', 'Common Area'), ('RESTROOM', 'Restroom'), ('PUBLIC', 'Public Area'), ('PRIVATE', 'Private Area'), ('MISC', 'Miscellaneous')], max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='location',
+            name='location_floorplan_cell',
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['floorplan', 'is_trashed', 'grid_cell'], name='location_floorplan_cell'),
+        ),
+        migrations.AddField(
+            model_name='locationtypecount',
+            name='floorplan',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_counts', to='floorplans.FloorPlan'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='locationtypecount',
+            unique_together={('floorplan', 'loc_type')},
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+        migrations.RunPython(count_existing_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.0.1 on 2026-10-18 14:12
+
+from django.db import migrations, models
+from django.db.models import F
+import floorplans.models
+
+
+def date_trashed_rows(apps, schema_editor):
+    # The rows already in the trash count as trashed when last written.
+    for name in ('FloorPlan', 'Location'):
+        model = apps.get_model('floorplans', name)
+        model.objects.filter(is_trashed=True).update(trashed_at=F('last_updated'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0017_location_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('floorplan_id', models.PositiveIntegerField()),
+                ('data', models.TextField()),
+                ('trashed_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='floorplan',
+            name='trashed_at',
+            field=floorplans.models.TrashedAtField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='trashed_at',
+            field=floorplans.models.TrashedAtField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['is_trashed', 'trashed_at'], name='location_trashed_at'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedrow',
+            index=models.Index(fields=['floorplan_id', 'model'], name='archived_row_floorplan'),
+        ),
+        migrations.RunPython(date_trashed_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.1 on 2026-10-18 15:02
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_images(apps, schema_editor):
+    # Floor plans uploaded before image hashes were stored have no
+    # thumbnails until their image is hashed.
+    FloorPlan = apps.get_model('floorplans', 'FloorPlan')
+    for floorplan in FloorPlan.objects.filter(image_hash='').exclude(image='').only('id', 'image').iterator():
+        digest = hashlib.sha256()
+        try:
+            with floorplan.image.open('rb') as image_file:
+                for chunk in image_file.chunks():
+                    digest.update(chunk)
+        except OSError:
+            # The file is gone; there is nothing to make thumbnails from.
+            continue
+        FloorPlan.objects.filter(pk=floorplan.pk).update(image_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('floorplans', '0019_image_job_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='floorplan',
+            name='image_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_images, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,33 @@
-from django.db import models
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .counters import counted_as
+from .search import prefix_range, tokenize
+from .spatial import GRID_SIZE, GridCellField, box_cells, grid_cell
 
 # Create your models here.
 
 
+PROCESSING_STATES = (
+    ('ready', 'Ready'),
+    ('pending', 'Pending'),
+    ('processing', 'Processing'),
+    ('failed', 'Failed'),
+)
+
+JOB_STATUSES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
 LOCATION_TYPES = (
     ('DESK','Desk'),
     ('OFFICE','Office'),
@@ -15,6 +39,76 @@ LOCATION_TYPES = (
     ('MISC','Miscellaneous'),
 )
 
+# Location types that can be assigned to someone or booked.
+BOOKABLE_TYPES = ('DESK', 'OFFICE', 'CONFR')
+
+
+class UntrashedManager(models.Manager):
+    """
+    The `active` manager of models that can be trashed, which leaves trashed
+    rows out. `objects` stays the default manager with every row, so
+    dumpdata, the admin and related fields still see trashed rows.
+    """
+    def get_queryset(self):
+        return super(UntrashedManager, self).get_queryset().filter(is_trashed=False)
+
+
+class TrashedAtField(models.DateTimeField):
+    """
+    When the row was trashed, set whenever it is saved or bulk updated as
+    trashed and cleared when it is restored. `manage.py purge_trash` deletes
+    the rows trashed before the retention period.
+    """
+    def __init__(self, *args, **kwargs):
+        self.depends_on = ('is_trashed',)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('null', True)
+        kwargs['editable'] = False
+        super(TrashedAtField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(TrashedAtField, self).deconstruct()
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if not model_instance.is_trashed:
+            value = None
+        elif value is None:
+            value = timezone.now()
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class FloorPlanQuerySet(models.QuerySet):
+    def with_owner_name(self):
+        return self.annotate(owner_username=models.F('owner__username'))
+
+    def for_serializer(self):
+        """
+        Load everything FloorPlanSerializer reads up front, so serializing
+        one floor plan or a list of them takes a fixed number of queries.
+        Only untrashed locations are loaded.
+        """
+        return self.with_owner_name().prefetch_related(models.Prefetch('locations', queryset=Location.active.all()))
+
+    def with_version(self):
+        """
+        Annotate the newest timestamp and the number of each floor plan's
+        locations, which together with last_updated identify a version.
+        """
+        return self.annotate(locations_updated=models.Max('locations__last_updated'),
+                             locations_count=models.Count('locations'))
+
+    def with_location_counts(self):
+        """
+        Prefetch the number of untrashed locations of each type, read from
+        the counters rather than by counting locations.
+        """
+        counts = LocationTypeCount.objects.filter(count__gt=0).order_by('loc_type')
+        return self.prefetch_related(models.Prefetch('location_counts', queryset=counts))
+
 
 class FloorPlan(models.Model):
     name = models.CharField(max_length=100)
@@ -22,11 +116,28 @@ class FloorPlan(models.Model):
     width = models.FloatField(default=1.0)
     height = models.FloatField(default=1.0)
     image = models.ImageField(upload_to='floorplans', width_field='width', height_field='height')
+    # sha256 of the image, which addresses its derivatives (see images.py)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+    # format of the generated tile pyramid, empty until it exists
+    tile_format = models.CharField(max_length=4, blank=True, editable=False)
+    # derivatives of a new image are made by the job worker (see jobs.py)
+    processing_state = models.CharField(max_length=10, choices=PROCESSING_STATES, default='ready', editable=False)
     is_trashed = models.BooleanField(default=False)
+    trashed_at = TrashedAtField()
     is_public = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = FloorPlanQuerySet.as_manager()
+    active = UntrashedManager.from_queryset(FloorPlanQuerySet)()
+
+    class Meta:
+        indexes = [
+            # Floor plan listings, newest first (see api.pagination).
+            models.Index(fields=['owner', 'is_trashed', '-last_updated', '-id'], name='floorplan_owner_updated'),
+            models.Index(fields=['is_public', 'is_trashed', '-last_updated', '-id'], name='floorplan_public_updated'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -34,6 +145,74 @@ class FloorPlan(models.Model):
         return self.height / self.width
 
 
+class LocationQuerySet(models.QuerySet):
+    def changed_since(self, since):
+        """
+        Locations written after `since`, oldest first, and with them those
+        written in the LOCATION_DELTA_OVERLAP_SECONDS before it: last_updated
+        is set when a row is written, not when it commits, so a transaction
+        committing after a cursor was handed out can hold earlier times.
+        """
+        overlap = timedelta(seconds=settings.LOCATION_DELTA_OVERLAP_SECONDS)
+        return self.filter(last_updated__gt=since - overlap).order_by('last_updated', 'id')
+
+    def search(self, query):
+        """
+        Locations having, for every word of `query`, a word starting with it,
+        and none when it has no words. Each word is a range scan of the
+        (token, location) index, and the matching locations are then read by
+        id. Filter on is_trashed with exclude() rather than use `active`: on
+        SQLite, whose planner has no statistics, an indexed is_trashed = ?
+        makes it scan every untrashed location instead.
+        """
+        terms = tokenize(query)[:5]
+        if not terms:
+            return self.none()
+        locations = self
+        for term in terms:
+            tokens = LocationSearchToken.objects.filter(token__range=prefix_range(term))
+            locations = locations.filter(pk__in=tokens.values('location_id'))
+        return locations
+
+    def in_bbox(self, x0, y0, x1, y1):
+        """
+        Locations inside the box, found through the grid cell index and then
+        filtered on their exact position. The cells are listed with IN, which
+        the index is searched for one by one: an OR of one cell range per
+        grid row would not use the index past the floor plan.
+        """
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        cells = box_cells(x0, y0, x1, y1)
+        if cells is None:
+            locations = self.filter(grid_cell__range=(grid_cell(x0, y0), grid_cell(x1, y1)))
+        else:
+            locations = self.filter(grid_cell__in=cells)
+        return locations.filter(position_x__range=(x0, x1), position_y__range=(y0, y1))
+
+    def nearest(self, x, y, limit, aspect_ratio=1.0):
+        """
+        Return up to `limit` locations closest to (x, y), nearest first.
+
+        Distances are measured in units of the floor plan's width, so
+        `aspect_ratio` (height / width) scales the y axis. The search box
+        starts at one grid cell and doubles until it holds `limit` locations
+        within its inner radius, or covers the whole floor plan.
+        """
+        def distance(location):
+            return math.hypot(location.position_x - x, (location.position_y - y) * aspect_ratio)
+
+        radius = 1.0 / GRID_SIZE
+        max_radius = max(x, 1 - x, y * aspect_ratio, (1 - y) * aspect_ratio)
+        while True:
+            dy = radius / aspect_ratio
+            candidates = sorted(self.in_bbox(x - radius, y - dy, x + radius, y + dy), key=distance)
+            inside = [location for location in candidates if distance(location) <= radius]
+            if len(inside) >= limit or radius >= max_radius:
+                return candidates[:limit]
+            radius *= 2
+
+
 class Location(models.Model):
     name = models.CharField(max_length=100)
     loc_type = models.CharField(max_length=50, choices=LOCATION_TYPES)
@@ -42,9 +221,243 @@ class Location(models.Model):
     floorplan = models.ForeignKey(FloorPlan, related_name='locations', on_delete=models.CASCADE)
     position_x = models.FloatField()
     position_y = models.FloatField()
+    grid_cell = GridCellField('position_x', 'position_y')
     is_trashed = models.BooleanField(default=False)
+    trashed_at = TrashedAtField()
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = LocationQuerySet.as_manager()
+    active = UntrashedManager.from_queryset(LocationQuerySet)()
+
+    class Meta:
+        indexes = [
+            # Delta queries: locations of a floor plan changed since a time.
+            models.Index(fields=['floorplan', 'last_updated'], name='location_floorplan_updated'),
+            # The untrashed locations of a floor plan, all of them or those
+            # in a bounding box or near a point (see spatial.py).
+            models.Index(fields=['floorplan', 'is_trashed', 'grid_cell'], name='location_floorplan_cell'),
+            # The trashed locations due to be purged.
+            models.Index(fields=['is_trashed', 'trashed_at'], name='location_trashed_at'),
+        ]
+
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Location, cls).from_db(db, field_names, values)
+        # Remembered so the per-type counters can be updated on save, see
+        # counters.py.
+        if not instance.get_deferred_fields().intersection(('floorplan_id', 'loc_type', 'is_trashed')):
+            instance._counted_as = counted_as(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The counters are updated by post_save, in the same transaction.
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Location, instance=self)):
+            super(Location, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Location, instance=self)):
+            return super(Location, self).delete(*args, **kwargs)
+
+
+class LocationTypeCount(models.Model):
+    """
+    The number of untrashed locations of one type on a floor plan, kept up
+    to date as locations are created, changed, trashed and deleted (see
+    counters.py), so summaries never count Location rows.
+    """
+    floorplan = models.ForeignKey(FloorPlan, related_name='location_counts', on_delete=models.CASCADE)
+    loc_type = models.CharField(max_length=50, choices=LOCATION_TYPES)
+    # Not a PositiveIntegerField: a counter that drifted (see
+    # recount_location_types) must not make writes fail.
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('floorplan', 'loc_type')
+
+    def __str__(self):
+        return '{} {}'.format(self.count, self.loc_type)
+
+
+class LocationSearchToken(models.Model):
+    """
+    One word of a location's searchable text. Prefix searches are range
+    scans on the (token, location) index; tokens are kept up to date on save
+    (see floorplans/signals.py).
+    """
+    location = models.ForeignKey(Location, related_name='search_tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'location'], name='search_token_location'),
+        ]
+
+    def __str__(self):
+        return self.token
+
+
+def max_booking_duration():
+    return timedelta(hours=settings.BOOKING_MAX_HOURS)
+
+
+class BookingQuerySet(models.QuerySet):
+    """
+    A booking overlaps [start, end) when it starts before `end` and ends
+    after `start`. No booking is longer than BOOKING_MAX_HOURS, so it must
+    also start after `start` minus that: both bounds are on starts_at, which
+    makes the lookup one range scan of a (..., starts_at) index instead of
+    a scan of every booking that ends in the future.
+    """
+    def overlapping(self, start, end):
+        return self.filter(starts_at__gt=start - max_booking_duration(), starts_at__lt=end, ends_at__gt=start)
+
+    def at(self, moment):
+        return self.filter(starts_at__gt=moment - max_booking_duration(), starts_at__lte=moment, ends_at__gt=moment)
+
+
+class AssignmentQuerySet(models.QuerySet):
+    """
+    Assignments have no maximum length (ends_at is empty while they last),
+    but there is at most one at a time per location (see Assignment.save()),
+    so there are few of them and an index on the location or user is enough.
+    """
+    def overlapping(self, start, end):
+        # An empty `end` is an open-ended period.
+        assignments = self.filter(models.Q(ends_at__isnull=True) | models.Q(ends_at__gt=start))
+        return assignments if end is None else assignments.filter(starts_at__lt=end)
+
+    def at(self, moment):
+        return self.filter(models.Q(ends_at__isnull=True) | models.Q(ends_at__gt=moment), starts_at__lte=moment)
+
+
+class Assignment(models.Model):
+    """
+    A location given to one person for an open-ended or long period, such as
+    a permanent desk or office.
+    """
+    location = models.ForeignKey(Location, related_name='assignments', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='assignments', on_delete=models.CASCADE)
+    starts_at = models.DateTimeField(default=timezone.now)
+    ends_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = AssignmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', 'starts_at'], name='assignment_location_starts'),
+            models.Index(fields=['user', 'starts_at'], name='assignment_user_starts'),
+        ]
+
+    def __str__(self):
+        return '{} at {}'.format(self.user, self.location)
+
+    def clean(self):
+        if self.ends_at is not None and self.ends_at <= self.starts_at:
+            raise ValidationError('ends_at must be after starts_at.')
+        others = Assignment.objects.filter(location_id=self.location_id).exclude(pk=self.pk)
+        if others.overlapping(self.starts_at, self.ends_at).exists():
+            raise ValidationError('The location is already assigned during that time.')
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(Assignment, instance=self)
+        with transaction.atomic(using=using):
+            # The lock bookings are made under, so no booking or other
+            # assignment of the location is written while this one checks.
+            Location.objects.using(using).select_for_update().filter(pk=self.location_id).exists()
+            self.clean()
+            super(Assignment, self).save(*args, **kwargs)
+
+
+class Booking(models.Model):
+    """
+    A location reserved by one person from starts_at until ends_at, at most
+    BOOKING_MAX_HOURS long (see BookingQuerySet). The floor plan is copied
+    from the location so a floor's bookings can be found without a join.
+    """
+    location = models.ForeignKey(Location, related_name='bookings', on_delete=models.CASCADE)
+    floorplan = models.ForeignKey(FloorPlan, related_name='bookings', on_delete=models.CASCADE, editable=False)
+    user = models.ForeignKey(User, related_name='bookings', on_delete=models.CASCADE)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Availability of a floor plan, and conflicts on one location.
+            models.Index(fields=['floorplan', 'starts_at'], name='booking_floorplan_starts'),
+            models.Index(fields=['location', 'starts_at'], name='booking_location_starts'),
+            # Whereabouts of a user.
+            models.Index(fields=['user', 'starts_at'], name='booking_user_starts'),
+        ]
+
+    def __str__(self):
+        return '{} at {}'.format(self.user, self.location)
+
+    def clean(self):
+        if self.ends_at <= self.starts_at:
+            raise ValidationError('ends_at must be after starts_at.')
+        if self.ends_at - self.starts_at > max_booking_duration():
+            raise ValidationError('Bookings cannot be longer than {}.'.format(max_booking_duration()))
+
+    def save(self, *args, **kwargs):
+        # Longer bookings would be missed by BookingQuerySet.overlapping().
+        self.clean()
+        self.floorplan_id = self.location.floorplan_id
+        super(Booking, self).save(*args, **kwargs)
+
+
+class ArchivedRow(models.Model):
+    """
+    A trashed floor plan or location deleted by `manage.py purge_trash`, or
+    a booking or assignment of such a location, kept in Django's
+    serialization format (one object of a `dumpdata` fixture), so active
+    tables only hold the rows still in use.
+    """
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveIntegerField()
+    # Not a foreign key: the floor plan may be purged as well.
+    floorplan_id = models.PositiveIntegerField()
+    data = models.TextField()
+    trashed_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['floorplan_id', 'model'], name='archived_row_floorplan'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.model, self.object_id)
+
+
+class ImageJob(models.Model):
+    """
+    A queued derivative of a floor plan image, run by `manage.py process_jobs`.
+    """
+    floorplan = models.ForeignKey(FloorPlan, related_name='image_jobs', on_delete=models.CASCADE)
+    task = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # When the running job's lease was last taken or renewed (see jobs.py).
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The worker's poll for jobs that are due.
+            models.Index(fields=['status', 'run_after'], name='image_job_due'),
+        ]
+
+    def __str__(self):
+        return '{} for {}'.format(self.task, self.floorplan_id)
@@ -0,0 +1,54 @@
+import re
+
+from django.db import transaction
+
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Location fields whose text is indexed.
+INDEXED_FIELDS = ('name', 'details', 'extension', 'loc_type')
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD.findall(text)]
+
+
+def location_tokens(location, location_types):
+    """
+    The distinct words a location can be found by: its name, details,
+    extension, and type code and label (e.g. 'confr', 'conference', 'room').
+    """
+    text = ' '.join([
+        location.name,
+        location.details,
+        str(location.extension) if location.extension is not None else '',
+        location.loc_type,
+        location_types.get(location.loc_type, ''),
+    ])
+    return set(tokenize(text))
+
+
+def index_locations(locations, token_model, location_types):
+    """
+    Replace the search tokens of `locations`. Model classes are passed in
+    because models.py imports this module.
+    """
+    locations = list(locations)
+    with transaction.atomic():
+        for i in range(0, len(locations), 500):
+            ids = [location.pk for location in locations[i:i + 500]]
+            token_model.objects.filter(location_id__in=ids).delete()
+        token_model.objects.bulk_create([
+            token_model(location_id=location.pk, token=token[:100])
+            for location in locations
+            for token in location_tokens(location, location_types)
+        ], batch_size=500)
+
+
+def prefix_range(term):
+    """
+    The (low, high) bounds of every token starting with `term`, for a range
+    scan on the token index. The high bound ends with the last code point,
+    as words may hold characters beyond the Basic Multilingual Plane.
+    """
+    return term, term + '\U0010ffff'
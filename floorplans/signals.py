@@ -0,0 +1,66 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from .counters import update_location_counts
+from .images import file_sha256
+from .jobs import enqueue_image_jobs
+from .models import LOCATION_TYPES, FloorPlan, Location, LocationSearchToken, LocationTypeCount
+from .search import INDEXED_FIELDS, index_locations
+
+
+# Sent after bulk writes that bypass Model.save(), and therefore post_save,
+# with the instances that were written, whether they were inserted, and for
+# updates the names of the fields that changed.
+post_bulk_save = Signal(providing_args=['instances', 'created', 'update_fields'])
+
+
+def _touches_index(update_fields):
+    return update_fields is None or not set(INDEXED_FIELDS).isdisjoint(update_fields)
+
+
+@receiver(post_save, sender=Location)
+def index_location(sender, instance, update_fields=None, **kwargs):
+    if _touches_index(update_fields):
+        index_locations([instance], LocationSearchToken, dict(LOCATION_TYPES))
+
+
+@receiver(post_bulk_save, sender=Location)
+def index_bulk_locations(sender, instances, update_fields=None, **kwargs):
+    if _touches_index(update_fields):
+        index_locations(instances, LocationSearchToken, dict(LOCATION_TYPES))
+
+
+@receiver(post_save, sender=Location)
+def count_location(sender, instance, created, **kwargs):
+    update_location_counts([instance], Location, LocationTypeCount, created=created)
+
+
+@receiver(post_bulk_save, sender=Location)
+def count_bulk_locations(sender, instances, created, **kwargs):
+    update_location_counts(instances, Location, LocationTypeCount, created=created)
+
+
+@receiver(post_delete, sender=Location)
+def uncount_location(sender, instance, **kwargs):
+    update_location_counts([instance], Location, LocationTypeCount, deleted=True)
+
+
+@receiver(pre_save, sender=FloorPlan)
+def hash_new_image(sender, instance, **kwargs):
+    # An uncommitted file is a new upload, still in memory or a temp file.
+    if instance.image and not instance.image._committed:
+        image_hash = file_sha256(instance.image)
+        if image_hash != instance.image_hash:
+            instance.image_hash = image_hash
+            instance.tile_format = ''
+            instance.processing_state = 'pending'
+
+
+@receiver(post_save, sender=FloorPlan)
+def queue_image_jobs(sender, instance, **kwargs):
+    # Tiles and previews are left to `manage.py process_jobs`, so uploads
+    # return as soon as the original is stored.
+    if instance.processing_state == 'pending':
+        enqueue_image_jobs(instance)
+        instance.processing_state = 'processing'
+        instance.save(update_fields=['processing_state', 'last_updated'])
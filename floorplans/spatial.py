@@ -0,0 +1,66 @@
+from django.db import models
+
+
+# Locations are positioned with fractions of the floor plan's width and
+# height, so the unit square is split into GRID_SIZE x GRID_SIZE cells,
+# numbered row by row.
+GRID_SIZE = 64
+
+
+def grid_cell(x, y):
+    col = min(max(int(x * GRID_SIZE), 0), GRID_SIZE - 1)
+    row = min(max(int(y * GRID_SIZE), 0), GRID_SIZE - 1)
+    return row * GRID_SIZE + col
+
+
+# Most cells a box is looked up by one by one. Larger boxes, which cover a
+# good part of the floor anyway, are read as one range from their first to
+# their last cell, so the query stays under SQLite's 999 parameters.
+MAX_BOX_CELLS = 512
+
+
+def box_cells(x0, y0, x1, y1):
+    """
+    The cells covering the box, or None when there are more than
+    MAX_BOX_CELLS.
+    """
+    cells = [cell for first, last in cell_ranges(x0, y0, x1, y1) for cell in range(first, last + 1)]
+    return cells if len(cells) <= MAX_BOX_CELLS else None
+
+
+def cell_ranges(x0, y0, x1, y1):
+    """
+    Yield (first, last) cell number ranges covering the box, one per grid
+    row, so the box can be looked up with a few range scans on the index.
+    """
+    first = grid_cell(x0, y0)
+    last = grid_cell(x1, y1)
+    col0, col1 = first % GRID_SIZE, last % GRID_SIZE
+    for row in range(first // GRID_SIZE, last // GRID_SIZE + 1):
+        yield row * GRID_SIZE + col0, row * GRID_SIZE + col1
+
+
+class GridCellField(models.PositiveIntegerField):
+    """
+    The grid cell of the point held in two float fields of the same model,
+    computed whenever the instance is saved or bulk inserted.
+    """
+    def __init__(self, x_field, y_field, *args, **kwargs):
+        self.x_field = x_field
+        self.y_field = y_field
+        self.depends_on = (x_field, y_field)
+        kwargs.setdefault('default', 0)
+        kwargs['editable'] = False
+        super(GridCellField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(GridCellField, self).deconstruct()
+        kwargs['x_field'] = self.x_field
+        kwargs['y_field'] = self.y_field
+        del kwargs['editable']
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = grid_cell(getattr(model_instance, self.x_field), getattr(model_instance, self.y_field))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,15 @@
+from django import template
+
+from floorplans.thumbnails import thumbnail_url as floorplan_thumbnail_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(floorplan, size=None):
+    """
+    {% thumbnail_url floorplan [size] %} -- URL of the floor plan's thumbnail,
+    or an empty string when it has no image.
+    """
+    return floorplan_thumbnail_url(floorplan, size) or ''
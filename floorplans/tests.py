@@ -1,3 +1,584 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import serializers
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import get_floorplan_json
+from api.pagination import KeysetPagination
+from api.views import FloorPlanList
+
+from .images import FORMATS, preview_path, tile_format, tiles_dir
+from .jobs import TASKS, claim_jobs, finish_job, renew_leases, requeue_expired_jobs
+from .counters import recount_location_types
+from .models import ArchivedRow, Assignment, Booking, FloorPlan, ImageJob, Location, LocationTypeCount
+from .spatial import GRID_SIZE, box_cells, cell_ranges, grid_cell
+from .thumbnails import evict_thumbnails, get_thumbnail, thumbnail_path
+from .trash import expired
+from .views import TILE_CONTENT_TYPES
+
+
+class ViewFloorPlanTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image='floorplans/floor-plan.jpg')
+        for i in range(20):
+            Location.objects.create(name='Desk {}'.format(i), loc_type='DESK', floorplan=self.floorplan,
+                                    position_x=0.5, position_y=0.5)
+
+    def test_view_floorplan_uses_fixed_number_of_queries(self):
+        url = reverse('floorplans_view', kwargs={'floorplan_id': self.floorplan.id})
+        # version, floor plan with owner name, then its locations
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Desk 19')
+
+    def test_view_floorplan_is_served_from_cache(self):
+        url = reverse('floorplans_view', kwargs={'floorplan_id': self.floorplan.id})
+        self.client.get(url)
+        with self.assertNumQueries(1):  # version check only
+            response = self.client.get(url)
+        self.assertContains(response, 'Desk 19')
+
+
+class GridCellTest(TestCase):
+    def test_grid_cell_clamps_to_the_grid(self):
+        self.assertEqual(grid_cell(0, 0), 0)
+        self.assertEqual(grid_cell(1, 1), GRID_SIZE * GRID_SIZE - 1)
+        self.assertEqual(grid_cell(-0.5, 2), (GRID_SIZE - 1) * GRID_SIZE)
+
+    def test_cell_ranges_cover_one_range_per_row(self):
+        ranges = list(cell_ranges(0, 0, 1.5 / GRID_SIZE, 2.5 / GRID_SIZE))
+        self.assertEqual(ranges, [(0, 1), (GRID_SIZE, GRID_SIZE + 1), (2 * GRID_SIZE, 2 * GRID_SIZE + 1)])
+
+    def test_box_cells_are_listed_unless_too_many(self):
+        self.assertEqual(box_cells(0, 0, 1.5 / GRID_SIZE, 1.5 / GRID_SIZE), [0, 1, GRID_SIZE, GRID_SIZE + 1])
+        self.assertIsNone(box_cells(0, 0, 1, 1))
+
+
+class DashboardTest(TestCase):
+    def test_dashboard_hides_trashed_floorplans(self):
+        user = User.objects.create_user('owner', password='password')
+        FloorPlan.objects.create(name='Kept', owner=user, image='floorplans/floor-plan.jpg')
+        FloorPlan.objects.create(name='Binned', owner=user, image='floorplans/floor-plan.jpg', is_trashed=True)
+        self.client.force_login(user)
+        response = self.client.get(reverse('floorplans_dashboard'))
+        self.assertContains(response, 'Kept')
+        self.assertNotContains(response, 'Binned')
+
+    def test_dashboard_shows_location_counts(self):
+        user = User.objects.create_user('owner', password='password')
+        floorplan = FloorPlan.objects.create(name='Kept', owner=user, image='floorplans/floor-plan.jpg')
+        for loc_type in ('DESK', 'DESK', 'CONFR'):
+            Location.objects.create(name='x', loc_type=loc_type, floorplan=floorplan, position_x=0, position_y=0)
+        self.client.force_login(user)
+        with self.assertNumQueries(4):  # session, user, floor plans, counts
+            response = self.client.get(reverse('floorplans_dashboard'))
+        self.assertContains(response, '(1 Conference Room,')
+        self.assertContains(response, '2 Desk)')
+
+
+class LocationTypeCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image='floorplans/floor-plan.jpg')
+        self.other = FloorPlan.objects.create(name='Other', owner=self.user, image='floorplans/floor-plan.jpg')
+
+    def create(self, loc_type, floorplan=None, **kwargs):
+        return Location.objects.create(name='x', loc_type=loc_type, floorplan=floorplan or self.floorplan,
+                                       position_x=0, position_y=0, **kwargs)
+
+    def counts(self, floorplan=None):
+        counters = LocationTypeCount.objects.filter(floorplan=floorplan or self.floorplan, count__gt=0)
+        return dict(counters.values_list('loc_type', 'count'))
+
+    def test_counts_follow_creates_changes_trashing_and_deletes(self):
+        desk = self.create('DESK')
+        self.create('DESK')
+        self.create('CONFR')
+        self.create('OFFICE', is_trashed=True)
+        self.assertEqual(self.counts(), {'DESK': 2, 'CONFR': 1})
+
+        desk = Location.objects.get(pk=desk.pk)
+        desk.loc_type = 'OFFICE'
+        desk.save()
+        self.assertEqual(self.counts(), {'DESK': 1, 'CONFR': 1, 'OFFICE': 1})
+        desk.is_trashed = True
+        desk.save()
+        self.assertEqual(self.counts(), {'DESK': 1, 'CONFR': 1})
+        desk.is_trashed = False
+        desk.floorplan = self.other
+        desk.save()
+        self.assertEqual(self.counts(), {'DESK': 1, 'CONFR': 1})
+        self.assertEqual(self.counts(self.other), {'OFFICE': 1})
+
+        Location.objects.filter(loc_type='CONFR').delete()
+        self.assertEqual(self.counts(), {'DESK': 1})
+
+    def test_saving_an_instance_with_deferred_fields_recounts(self):
+        self.create('DESK')
+        location = Location.objects.only('id', 'floorplan').get()
+        location.loc_type = 'CONFR'
+        location.save()
+        self.assertEqual(self.counts(), {'CONFR': 1})
+
+    def test_deleting_a_floorplan_deletes_its_counters(self):
+        self.create('DESK')
+        self.floorplan.delete()
+        self.assertFalse(LocationTypeCount.objects.exists())
+
+    def test_recount_repairs_counters(self):
+        self.create('DESK')
+        Location.objects.update(loc_type='MISC')
+        recount_location_types([self.floorplan.id], Location, LocationTypeCount)
+        self.assertEqual(self.counts(), {'MISC': 1})
+
+
+class TrashTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image='floorplans/floor-plan.jpg')
+        self.long_ago = timezone.now() - timedelta(days=60)
+
+    def create(self, name, floorplan=None, **kwargs):
+        return Location.objects.create(name=name, loc_type='DESK', floorplan=floorplan or self.floorplan,
+                                       position_x=0.5, position_y=0.5, **kwargs)
+
+    def trash(self, instance, trashed_at):
+        instance.is_trashed = True
+        instance.save()
+        type(instance).objects.filter(pk=instance.pk).update(trashed_at=trashed_at)
+
+    def purge(self, *args):
+        out = io.StringIO()
+        call_command('purge_trash', *args, stdout=out)
+        return out.getvalue()
+
+    def test_active_managers_leave_trashed_rows_out(self):
+        kept = self.create('Kept')
+        trashed = self.create('Trashed', is_trashed=True)
+        self.assertEqual(list(Location.active.all()), [kept])
+        self.assertEqual(set(Location.objects.all()), {kept, trashed})
+        loaded = FloorPlan.objects.for_serializer().get(pk=self.floorplan.pk)
+        self.assertEqual(list(loaded.locations.all()), [kept])
+
+        self.floorplan.is_trashed = True
+        self.floorplan.save()
+        self.assertFalse(FloorPlan.active.exists())
+        self.assertEqual(FloorPlan.objects.get().pk, self.floorplan.pk)
+
+    def test_dumpdata_includes_trashed_rows(self):
+        self.create('Trashed', is_trashed=True)
+        self.floorplan.is_trashed = True
+        self.floorplan.save()
+        out = io.StringIO()
+        call_command('dumpdata', 'floorplans.floorplan', 'floorplans.location', stdout=out)
+        self.assertEqual(sorted(row['model'] for row in json.loads(out.getvalue())),
+                         ['floorplans.floorplan', 'floorplans.location'])
+
+    def test_trashed_at_follows_is_trashed(self):
+        location = self.create('Desk')
+        self.assertIsNone(location.trashed_at)
+        location.is_trashed = True
+        location.save()
+        trashed_at = location.trashed_at
+        self.assertIsNotNone(trashed_at)
+        location.save()
+        self.assertEqual(Location.objects.get(pk=location.pk).trashed_at, trashed_at)
+        location.is_trashed = False
+        location.save()
+        self.assertIsNone(Location.objects.get(pk=location.pk).trashed_at)
+
+    def test_purge_archives_and_deletes_expired_rows(self):
+        kept = self.create('Kept')
+        recent = self.create('Recent', is_trashed=True)
+        old = [self.create('Old {}'.format(i)) for i in range(3)]
+        for location in old:
+            self.trash(location, self.long_ago)
+        other = FloorPlan.objects.create(name='Other', owner=self.user, image='floorplans/floor-plan.jpg')
+        other_locations = [self.create('On other', floorplan=other), self.create('Trashed on other', floorplan=other)]
+        self.trash(other_locations[1], timezone.now())
+        self.trash(other, self.long_ago)
+
+        self.assertIn('Would purge 5 location(s) and 1 floor plan(s)', self.purge('--dry-run'))
+        self.assertEqual(Location.objects.count(), 7)
+
+        self.assertIn('Purged 5 location(s) and 1 floor plan(s)', self.purge('--batch-size', '2'))
+        self.assertEqual(set(Location.objects.all()), {kept, recent})
+        self.assertEqual(list(FloorPlan.objects.all()), [self.floorplan])
+        self.assertEqual(LocationTypeCount.objects.get().count, 1)
+
+        self.assertEqual(ArchivedRow.objects.count(), 6)
+        archived = ArchivedRow.objects.get(model='floorplans.location', object_id=old[0].pk)
+        self.assertEqual(archived.floorplan_id, self.floorplan.pk)
+        self.assertEqual(archived.trashed_at, self.long_ago)
+        restored = next(serializers.deserialize('json', '[{}]'.format(archived.data))).object
+        self.assertEqual((restored.pk, restored.name, restored.is_trashed), (old[0].pk, 'Old 0', True))
+        self.assertEqual(ArchivedRow.objects.filter(floorplan_id=other.pk).count(), 3)
+
+    def test_purge_archives_bookings_and_assignments(self):
+        location = self.create('Desk')
+        now = timezone.now()
+        booking = Booking.objects.create(location=location, user=self.user,
+                                         starts_at=now, ends_at=now + timedelta(hours=1))
+        assignment = Assignment.objects.create(location=location, user=self.user, starts_at=now)
+        self.trash(location, self.long_ago)
+
+        self.assertIn('Purged 1 location(s)', self.purge())
+        self.assertFalse(Booking.objects.exists())
+        archived = {row.model: row for row in ArchivedRow.objects.all()}
+        self.assertEqual(sorted(archived), ['floorplans.assignment', 'floorplans.booking', 'floorplans.location'])
+        self.assertEqual(archived['floorplans.booking'].object_id, booking.pk)
+        self.assertEqual(archived['floorplans.assignment'].object_id, assignment.pk)
+        self.assertEqual({row.floorplan_id for row in archived.values()}, {self.floorplan.pk})
+        self.assertEqual({row.trashed_at for row in archived.values()}, {self.long_ago})
+
+    def test_purge_keeps_rows_trashed_within_the_retention_period(self):
+        location = self.create('Desk')
+        self.trash(location, timezone.now() - timedelta(days=10))
+        self.assertIn('Purged 0 location(s)', self.purge())
+        self.assertIn('Purged 1 location(s)', self.purge('--days', '7'))
+
+    def test_restored_rows_are_not_purged(self):
+        location = self.create('Desk')
+        self.trash(location, self.long_ago)
+        location.is_trashed = False
+        location.save()
+        self.assertIn('Purged 0 location(s) and 0 floor plan(s)', self.purge())
+        self.assertTrue(Location.active.filter(pk=location.pk).exists())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+class QueryPlanTest(TestCase):
+    """
+    The hot queries are answered from the indexes meant for them.
+    """
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image='floorplans/floor-plan.jpg')
+
+    def test_untrashed_locations_of_a_floorplan(self):
+        locations = Location.active.filter(floorplan=self.floorplan)
+        self.assertIn('USING INDEX location_floorplan_cell (floorplan_id=? AND is_trashed=?)', self.plan(locations))
+
+    def test_locations_in_a_bounding_box(self):
+        locations = Location.active.filter(floorplan=self.floorplan)
+        # One cell, and several cells of several grid rows.
+        for box in [(0, 0, 0.01, 0.01), (0.1, 0.1, 0.2, 0.2)]:
+            self.assertIn('USING INDEX location_floorplan_cell (floorplan_id=? AND is_trashed=? AND grid_cell=?)',
+                          self.plan(locations.in_bbox(*box)))
+        # Too many cells to list.
+        self.assertIn('USING INDEX location_floorplan_cell '
+                      '(floorplan_id=? AND is_trashed=? AND grid_cell>? AND grid_cell<?)',
+                      self.plan(locations.in_bbox(0, 0, 1, 1)))
+
+    def test_location_changes_since(self):
+        locations = Location.objects.filter(floorplan=self.floorplan).changed_since(timezone.now())
+        self.assertIn('USING INDEX location_floorplan_updated (floorplan_id=? AND last_updated>?)',
+                      self.plan(locations))
+
+    def test_location_search(self):
+        locations = Location.objects.exclude(is_trashed=True).search('ada love')
+        plan = self.plan(locations)
+        self.assertEqual(plan.count('USING COVERING INDEX search_token_location (token>? AND token<?)'), 2)
+        self.assertIn('USING INTEGER PRIMARY KEY (rowid=?)', plan)
+
+    def test_floorplan_listings(self):
+        owned = FloorPlan.active.filter(owner=self.user).order_by('-last_updated', '-id')
+        self.assertIn('USING INDEX floorplan_owner_updated (owner_id=? AND is_trashed=?)', self.plan(owned))
+        self.assertNotIn('TEMP B-TREE', self.plan(owned))
+        public = FloorPlan.active.filter(is_public=True).order_by('-last_updated', '-id')
+        self.assertIn('USING INDEX floorplan_public_updated (is_public=? AND is_trashed=?)', self.plan(public))
+
+    def test_owned_or_public_floorplan_listing(self):
+        # No index orders `owner OR is_public`, so the listing reads each
+        # side from its own index (see FloorPlanList.get_keyset_parts).
+        view = FloorPlanList(request=mock.Mock(user=self.user), params={'is_trashed': False})
+        pagination = KeysetPagination()
+        pagination.limit = pagination.page_size
+        owned, public = [self.plan(pagination.page_of(part, (timezone.now(), 1))) for part in view.get_keyset_parts()]
+        self.assertIn('USING INDEX floorplan_owner_updated (owner_id=? AND is_trashed=?', owned)
+        self.assertIn('USING INDEX floorplan_public_updated (is_public=? AND is_trashed=?', public)
+        self.assertNotIn('TEMP B-TREE', owned + public)
+
+    def test_locations_due_for_purging(self):
+        locations = expired(Location.objects.all(), timezone.now())
+        self.assertIn('USING INDEX location_trashed_at (is_trashed=?', self.plan(locations))
+
+    def test_location_counts_do_not_touch_locations(self):
+        plan = self.plan(self.floorplan.location_counts.all())
+        self.assertRegex(plan, r'^SEARCH (TABLE )?floorplans_locationtypecount USING INDEX \S+ \(floorplan_id=\?\)$')
+
+
+def image_upload(width, height, color='white', name='plan.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class MediaRootMixin:
+    """
+    Keeps uploads and generated derivatives in a throwaway MEDIA_ROOT.
+    """
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('owner', password='password')
+
+
+class MediaRootTestCase(MediaRootMixin, TestCase):
+    pass
+
+
+def process_jobs():
+    call_command('process_jobs', once=True, workers=0, stdout=io.StringIO())
+
+
+def image_extension():
+    # WebP, unless Pillow was built without it (see images.tile_format).
+    return FORMATS[tile_format()][1]
+
+
+class TilePyramidTest(MediaRootTestCase):
+    def test_upload_generates_every_level(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(600, 300))
+        process_jobs()
+        floorplan.refresh_from_db()
+        self.assertEqual(len(floorplan.image_hash), 64)
+        self.assertEqual(floorplan.tile_format, tile_format())
+        directory = 'tiles/{}'.format(floorplan.image_hash)
+        extension = image_extension()
+        # 600x300 needs levels 0 (1x1) to 10 (full size, 3x2 tiles).
+        self.assertEqual(sorted(default_storage.listdir(directory + '/10')[1]),
+                         ['{}.{}'.format(tile, extension) for tile in ('0_0', '0_1', '1_0', '1_1', '2_0', '2_1')])
+        self.assertEqual(default_storage.listdir(directory + '/0')[1], ['0_0.' + extension])
+        self.assertEqual(Image.open(default_storage.open(directory + '/10/2_1.' + extension)).size, (88, 44))
+
+    def test_identical_uploads_share_tiles(self):
+        first = FloorPlan.objects.create(name='First', owner=self.user, image=image_upload(300, 300))
+        second = FloorPlan.objects.create(name='Second', owner=self.user, image=image_upload(300, 300))
+        process_jobs()
+        self.assertEqual(first.image_hash, second.image_hash)
+        self.assertEqual(len(default_storage.listdir('tiles')[0]), 1)
+
+    def test_tiles_are_served_with_immutable_cache_headers(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 300))
+        process_jobs()
+        floorplan.refresh_from_db()
+        from api.serializers import FloorPlanSerializer
+        tiles = FloorPlanSerializer(floorplan).data['tiles']
+        self.assertEqual(tiles['max_level'], 9)
+        response = self.client.get(tiles['url'].format(z=9, x=1, y=0))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], TILE_CONTENT_TYPES[image_extension()])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(tiles['url'].format(z=9, x=5, y=5)).status_code, 404)
+
+
+class PurgeImageTest(MediaRootMixin, TransactionTestCase):
+    # Derivatives are deleted when the purge commits, so this test needs
+    # real transactions.
+    def test_purge_deletes_derivatives_no_floorplan_uses(self):
+        shared, kept = [FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 300))
+                        for _ in range(2)]
+        single = FloorPlan.objects.create(name='Single', owner=self.user, image=image_upload(300, 300, 'red'))
+        process_jobs()
+        for floorplan in (shared, single):
+            floorplan.is_trashed = True
+            floorplan.save()
+        FloorPlan.objects.filter(is_trashed=True).update(trashed_at=timezone.now() - timedelta(days=60))
+
+        call_command('purge_trash', stdout=io.StringIO())
+        self.assertEqual(list(FloorPlan.objects.all()), [kept])
+        kept.refresh_from_db()
+        tile = '{}/0/0_0.' + FORMATS[kept.tile_format][1]
+        self.assertFalse(default_storage.exists(tile.format(tiles_dir(single.image_hash))))
+        self.assertTrue(default_storage.exists(tile.format(tiles_dir(kept.image_hash))))
+        self.assertFalse(default_storage.exists(preview_path(single.image_hash)))
+        self.assertTrue(default_storage.exists(preview_path(kept.image_hash)))
+        self.assertEqual([name.split('_')[0] for name in default_storage.listdir('thumbs')[1]], [kept.image_hash])
+        self.assertTrue(default_storage.exists(single.image.name))
+
+
+class ImageJobTest(MediaRootTestCase):
+    def test_upload_is_processed_in_the_background(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        self.assertEqual(floorplan.processing_state, 'processing')
+        self.assertEqual(floorplan.tile_format, '')
+        self.assertEqual((floorplan.width, floorplan.height), (300, 200))
+        self.assertEqual(sorted(floorplan.image_jobs.values_list('task', flat=True)), ['preview', 'thumbnail', 'tiles'])
+        self.assertEqual(json.loads(get_floorplan_json(floorplan.pk))['processing_state'], 'processing')
+
+        process_jobs()
+        floorplan.refresh_from_db()
+        self.assertEqual(floorplan.processing_state, 'ready')
+        self.assertEqual(json.loads(get_floorplan_json(floorplan.pk))['processing_state'], 'ready')
+        self.assertEqual(floorplan.tile_format, tile_format())
+        self.assertEqual(Image.open(default_storage.open(preview_path(floorplan.image_hash))).size, (300, 200))
+        self.assertFalse(floorplan.image_jobs.exclude(status='done').exists())
+        self.assertTrue(default_storage.exists(thumbnail_path(floorplan.image_hash, 160, image_extension())))
+
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        default_storage.delete(floorplan.image.name)
+
+        process_jobs()
+        job = floorplan.image_jobs.get(task='tiles')
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('FileNotFoundError', job.last_error)
+
+        for _ in range(2):
+            ImageJob.objects.update(run_after=timezone.now())
+            process_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        # Not refresh_from_db(), which would read the missing image's size.
+        state = FloorPlan.objects.values_list('processing_state', flat=True).get(pk=floorplan.pk)
+        self.assertEqual(state, 'failed')
+
+    def test_interrupted_jobs_are_requeued(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        floorplan.image_jobs.update(status='running')
+        process_jobs()
+        floorplan.refresh_from_db()
+        self.assertEqual(floorplan.processing_state, 'ready')
+
+    def test_only_expired_leases_are_requeued(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        jobs = claim_jobs(3)
+        self.assertEqual(requeue_expired_jobs(), 0)
+        expired = timezone.now() - timedelta(seconds=settings.IMAGE_JOB_LEASE_SECONDS + 1)
+        ImageJob.objects.filter(pk=jobs[0].pk).update(claimed_at=expired)
+        self.assertEqual(renew_leases(jobs[1:]), [])
+        self.assertEqual(requeue_expired_jobs(), 1)
+
+        # The first worker finishing late records nothing; the job runs again.
+        self.assertEqual(renew_leases(jobs), [jobs[0]])
+        self.assertFalse(finish_job(jobs[0], {'tile_format': 'jpeg'}))
+        self.assertEqual(floorplan.image_jobs.get(pk=jobs[0].pk).status, 'pending')
+        self.assertTrue(finish_job(jobs[1]))
+        self.assertEqual(floorplan.image_jobs.get(pk=jobs[1].pk).status, 'done')
+
+
+def crash_worker(image_name, image_hash):
+    os._exit(1)
+
+
+class ProcessPoolTest(MediaRootMixin, TransactionTestCase):
+    # Worker processes need the connection closed, which a test transaction
+    # would not survive.
+    def test_pool_is_restarted_when_a_worker_dies(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        stderr = io.StringIO()
+        with mock.patch.dict(TASKS, {'tiles': crash_worker}):
+            call_command('process_jobs', once=True, workers=1, stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('restarting the pool', stderr.getvalue())
+        job = floorplan.image_jobs.get(task='tiles')
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('BrokenProcessPool', job.last_error)
+
+        ImageJob.objects.update(run_after=timezone.now())
+        call_command('process_jobs', once=True, workers=1, stdout=io.StringIO(), stderr=stderr)
+        floorplan.refresh_from_db()
+        self.assertEqual(floorplan.processing_state, 'ready')
+
+
+class ThumbnailTest(MediaRootTestCase):
+    def test_dashboard_thumbnails_are_small_and_shared(self):
+        colors = ['red', 'green', 'blue', 'red']
+        for i, color in enumerate(colors):
+            FloorPlan.objects.create(name='Floor {}'.format(i), owner=self.user,
+                                     image=image_upload(2000, 1000, color))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('floorplans_dashboard'))
+        urls = re.findall(r"<img src='([^']+)'", response.content.decode('utf-8'))
+        self.assertEqual(len(urls), 4)
+        self.assertEqual(len(set(urls)), 3)
+
+        total = 0
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            content = b''.join(response.streaming_content)
+            self.assertEqual(Image.open(io.BytesIO(content)).size, (160, 80))
+            total += len(content)
+        # 200 plans stay well under a megabyte.
+        self.assertLess(total / len(urls) * 200, 1024 * 1024)
+        self.assertEqual(len(default_storage.listdir('thumbs')[1]), 3)
+
+    def test_serializer_field(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        from api.serializers import FloorPlanSerializer
+        url = FloorPlanSerializer(floorplan).data['thumbnail']
+        self.assertEqual(url, '/thumbs/{}_160.{}'.format(floorplan.image_hash, image_extension()))
+
+    def test_least_recently_used_thumbnails_are_evicted(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        paths = [get_thumbnail(floorplan.image.name, floorplan.image_hash, size, image_extension())
+                 for size in (32, 64)]
+        os.utime(default_storage.path(paths[0]), (0, 0))
+        os.utime(default_storage.path(paths[1]), (1, 1))
+        # A cache hit makes the older thumbnail the most recently used.
+        get_thumbnail(floorplan.image.name, floorplan.image_hash, 32, image_extension())
+
+        self.assertEqual(evict_thumbnails(default_storage.size(paths[0])), 1)
+        self.assertTrue(default_storage.exists(paths[0]))
+        self.assertFalse(default_storage.exists(paths[1]))
+
+    def test_unknown_image_is_not_found(self):
+        response = self.client.get(reverse('floorplans_thumbnail', kwargs={
+            'image_hash': '0' * 64, 'size': 160, 'extension': image_extension()}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_only_configured_sizes_are_served(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        url = reverse('floorplans_thumbnail', kwargs={
+            'image_hash': floorplan.image_hash, 'size': 161, 'extension': image_extension()})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertFalse(default_storage.exists(thumbnail_path(floorplan.image_hash, 161, image_extension())))
+
+    def test_generated_thumbnails_are_served_from_storage(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        url = reverse('floorplans_thumbnail', kwargs={
+            'image_hash': floorplan.image_hash, 'size': 160, 'extension': image_extension()})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_migration_hashes_existing_images(self):
+        floorplan = FloorPlan.objects.create(name='Floor', owner=self.user, image=image_upload(300, 200))
+        image_hash = floorplan.image_hash
+        FloorPlan.objects.filter(pk=floorplan.pk).update(image_hash='')
+        migration = importlib.import_module('floorplans.migrations.0020_floorplan_image_hash_index')
+        migration.hash_existing_images(django_apps, None)
+        floorplan.refresh_from_db()
+        self.assertEqual(floorplan.image_hash, image_hash)
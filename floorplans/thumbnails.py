@@ -0,0 +1,106 @@
+import io
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image
+
+from .images import FORMATS, _replace, tile_format
+
+
+THUMBNAILS_DIR = 'thumbs'
+
+THUMBNAIL_NAME = re.compile(r'^[0-9a-f]{64}_[0-9]+\.(jpg|webp)$')
+
+
+def thumbnail_path(image_hash, size, extension):
+    return '{}/{}_{}.{}'.format(THUMBNAILS_DIR, image_hash, size, extension)
+
+
+def thumbnail_url(floorplan, size=None):
+    """
+    URL of the floor plan's thumbnail fitting a `size` pixel square, or None
+    without an image. Nothing is read or generated here; the thumbnail view
+    makes missing thumbnails on first request.
+    """
+    if not floorplan.image_hash:
+        return None
+    return reverse('floorplans_thumbnail', kwargs={
+        'image_hash': floorplan.image_hash,
+        'size': size or settings.FLOORPLAN_THUMBNAIL_SIZE,
+        'extension': FORMATS[tile_format()][1],
+    })
+
+
+def get_thumbnail(image_name, image_hash, size, extension):
+    """
+    Return the storage path of the thumbnail of the image `image_name`,
+    generating it when it is not cached.
+
+    Thumbnails are keyed by image content, size and format, so floor plans
+    with identical images share them. Cache hits refresh the file's
+    modification time, which orders eviction.
+    """
+    path = cached_thumbnail(image_hash, size, extension)
+    if path is not None:
+        return path
+
+    path = thumbnail_path(image_hash, size, extension)
+    name = next(name for name, (_, ext, _) in FORMATS.items() if ext == extension)
+    pil_format, _, options = FORMATS[name]
+    with default_storage.open(image_name, 'rb') as image_file:
+        image = Image.open(image_file)
+        # Lets JPEG decode at a fraction of full size.
+        image.draft('RGB', (size, size))
+        image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    _replace(path, buffer.getvalue())
+    evict_thumbnails(settings.FLOORPLAN_THUMBNAIL_CACHE_BYTES)
+    return path
+
+
+def cached_thumbnail(image_hash, size, extension):
+    """
+    Return the storage path of the thumbnail if it was generated, marking it
+    recently used, or None.
+    """
+    path = thumbnail_path(image_hash, size, extension)
+    if not default_storage.exists(path):
+        return None
+    _touch(path)
+    return path
+
+
+def evict_thumbnails(budget):
+    """
+    Delete the least recently used thumbnails until the cache takes at most
+    `budget` bytes. Returns the number of files deleted.
+    """
+    if not default_storage.exists(THUMBNAILS_DIR):
+        return 0
+    entries = []
+    for name in default_storage.listdir(THUMBNAILS_DIR)[1]:
+        if THUMBNAIL_NAME.match(name):
+            path = '{}/{}'.format(THUMBNAILS_DIR, name)
+            entries.append((default_storage.get_modified_time(path), default_storage.size(path), path))
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        default_storage.delete(path)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+def _touch(path):
+    try:
+        os.utime(default_storage.path(path))
+    except NotImplementedError:
+        # Remote storages have no local path; eviction then goes by age.
+        pass
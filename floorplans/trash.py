@@ -0,0 +1,136 @@
+import json
+import time
+
+from django.core import serializers
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+
+from .images import preview_path, tiles_dir
+from .models import ArchivedRow, Assignment, Booking, FloorPlan, Location
+from .thumbnails import THUMBNAILS_DIR
+
+
+def expired(queryset, before):
+    """
+    The rows of `queryset` trashed before `before`. Rows trashed by a
+    QuerySet.update(), which leaves trashed_at empty, count as trashed when
+    last written.
+    """
+    return queryset.filter(Q(trashed_at__lt=before) | Q(trashed_at__isnull=True, last_updated__lt=before),
+                           is_trashed=True)
+
+
+def purgeable(before):
+    """
+    The locations and the floor plans purge_trash() would delete.
+    """
+    floorplans = expired(FloorPlan.objects.all(), before)
+    locations = Location.objects.filter(Q(pk__in=expired(Location.objects.all(), before).values('pk')) |
+                                            Q(floorplan__in=floorplans.values('pk')))
+    return locations, floorplans
+
+
+def archive(rows, trashed_row):
+    """
+    Copy `rows` to ArchivedRow, each filed under the floor plan and trash
+    date of the trashed row returned by `trashed_row(row)`.
+    """
+    archived = []
+    for row in rows:
+        trashed = trashed_row(row)
+        floorplan_id = trashed.pk if isinstance(trashed, FloorPlan) else trashed.floorplan_id
+        archived.append(ArchivedRow(
+            model=row._meta.label_lower, object_id=row.pk, floorplan_id=floorplan_id,
+            data=json.dumps(serializers.serialize('python', [row])[0], cls=DjangoJSONEncoder),
+            trashed_at=trashed.trashed_at))
+    ArchivedRow.objects.bulk_create(archived)
+
+
+def delete_image_derivatives(image_hash):
+    """
+    Delete the tiles, preview and thumbnails made from the image `image_hash`
+    (see images.py and thumbnails.py). The image itself is kept, as archived
+    floor plans still refer to it.
+    """
+    paths = [preview_path(image_hash)]
+    directories = [tiles_dir(image_hash)]
+    while directories:
+        directory = directories.pop()
+        if default_storage.exists(directory):
+            subdirectories, files = default_storage.listdir(directory)
+            directories.extend('{}/{}'.format(directory, name) for name in subdirectories)
+            paths.extend('{}/{}'.format(directory, name) for name in files)
+    if default_storage.exists(THUMBNAILS_DIR):
+        paths.extend('{}/{}'.format(THUMBNAILS_DIR, name) for name in default_storage.listdir(THUMBNAILS_DIR)[1]
+                     if name.startswith(image_hash + '_'))
+    for path in paths:
+        default_storage.delete(path)
+
+
+def purge_locations(locations, batch_size, pause=0):
+    """
+    Archive and delete `locations`, batch_size rows per transaction, with
+    their bookings and assignments, which the delete cascades to. Each batch
+    is locked and read again inside its transaction, so rows that no longer
+    match (restored in the meantime) are kept. Returns the number of
+    locations deleted.
+    """
+    purged = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(locations.select_for_update().filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                return purged
+            by_pk = {location.pk: location for location in batch}
+            dependents = (list(Booking.objects.filter(location__in=by_pk).order_by('pk')) +
+                          list(Assignment.objects.filter(location__in=by_pk).order_by('pk')))
+            archive(batch, lambda location: location)
+            archive(dependents, lambda row: by_pk[row.location_id])
+            Location.objects.filter(pk__in=by_pk).delete()
+        purged += len(batch)
+        last_pk = batch[-1].pk
+        time.sleep(pause)
+
+
+def purge_floorplan(pk, before, batch_size, pause=0):
+    """
+    Archive and delete the floor plan `pk` if it is still trashed since
+    before `before`: its locations first, in batches, then the floor plan.
+    Image derivatives no other floor plan uses are deleted once that
+    commits. Returns the number of locations deleted and whether the floor
+    plan was.
+    """
+    floorplan = expired(FloorPlan.objects.filter(pk=pk), before)
+    # Stops early if the floor plan is restored between two batches.
+    purged = purge_locations(Location.objects.filter(floorplan__in=floorplan), batch_size, pause)
+    with transaction.atomic():
+        floorplan = floorplan.select_for_update().first()
+        if floorplan is None or Location.objects.filter(floorplan=floorplan).exists():
+            return purged, False
+        archive([floorplan], lambda floorplan: floorplan)
+        floorplan.delete()
+        image_hash = floorplan.image_hash
+        if image_hash and not FloorPlan.objects.filter(image_hash=image_hash).exists():
+            transaction.on_commit(lambda: delete_image_derivatives(image_hash))
+    return purged, True
+
+
+def purge_trash(before, batch_size, pause=0):
+    """
+    Archive (see ArchivedRow) and delete the floor plans and locations
+    trashed before `before`, with the locations of those floor plans. Work
+    is split into short transactions of batch_size rows, `pause` seconds
+    apart, so the purge never holds locks for long. Returns the number of
+    locations and of floor plans deleted.
+    """
+    locations = purge_locations(expired(Location.objects.all(), before), batch_size, pause)
+    floorplans = 0
+    for pk in list(expired(FloorPlan.objects.all(), before).values_list('pk', flat=True)):
+        purged, deleted = purge_floorplan(pk, before, batch_size, pause)
+        locations += purged
+        if deleted:
+            floorplans += 1
+    return locations, floorplans
@@ -1,7 +1,7 @@
-from django.urls import path
+from django.urls import path, re_path
 from django.contrib.auth.views import LoginView, LogoutView
 
-from .views import index, dashboard, view_floorplan, edit_floorplan
+from .views import index, dashboard, view_floorplan, edit_floorplan, thumbnail, tile
 
 urlpatterns = [
     path('', index, name='floorplans_index'),
@@ -18,4 +18,10 @@ urlpatterns = [
     path('floorplan/edit/<int:floorplan_id>',
          edit_floorplan,
          name='floorplans_edit'),
+    re_path(r'^tiles/(?P<image_hash>[0-9a-f]{64})/(?P<level>[0-9]+)/(?P<col>[0-9]+)_(?P<row>[0-9]+)\.(?P<extension>jpg|webp)$',
+            tile,
+            name='floorplans_tile'),
+    re_path(r'^thumbs/(?P<image_hash>[0-9a-f]{64})_(?P<size>[0-9]+)\.(?P<extension>jpg|webp)$',
+            thumbnail,
+            name='floorplans_thumbnail'),
 ]
@@ -1,10 +1,13 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
 from django.contrib.auth.decorators import login_required
-import json
 
+from floorplans.images import tiles_dir
 from floorplans.models import FloorPlan, Location
-from api.serializers import FloorPlanSerializer
+from floorplans.thumbnails import cached_thumbnail, get_thumbnail
+from api.cache import get_floorplan_json
 
 
 def index(request):
@@ -13,7 +16,7 @@ def index(request):
 
 @login_required
 def dashboard(request):
-    floorplans = FloorPlan.objects.filter(owner=request.user)
+    floorplans = FloorPlan.active.filter(owner=request.user).with_location_counts()
     context = {
         'floorplans': floorplans
     }
@@ -24,9 +27,7 @@ def dashboard(request):
 
 # TODO: permissions -> Should not be able to see this unless owner or floorplan is public
 def view_floorplan(request, floorplan_id):
-    floorplan = FloorPlan.objects.get(pk=floorplan_id)
-    serializer = FloorPlanSerializer(floorplan)
-    data = json.dumps(serializer.data)
+    data = get_floorplan_json(floorplan_id).decode('utf-8')
     return render(request,
                   'floorplans/view_floorplan.html'
                   , { 'floorplan' : data })
@@ -35,3 +36,39 @@ def view_floorplan(request, floorplan_id):
 @login_required
 def edit_floorplan(request, floorplan_id):
     return render(request, 'floorplans/edit_floorplan.html')
+
+
+TILE_CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+
+def tile(request, image_hash, level, col, row, extension):
+    # Tiles and thumbnails are addressed by image content and never change,
+    # so clients and proxies may keep them forever.
+    path = '{}/{}/{}_{}.{}'.format(tiles_dir(image_hash), level, col, row, extension)
+    if not default_storage.exists(path):
+        raise Http404
+    return _immutable_file_response(path, extension)
+
+
+def thumbnail(request, image_hash, size, extension):
+    # Generated on first request from any floor plan with this image; the
+    # database is only read when it was not.
+    size = int(size)
+    if size not in settings.FLOORPLAN_THUMBNAIL_SIZES:
+        raise Http404
+    path = cached_thumbnail(image_hash, size, extension)
+    if path is None:
+        floorplan = FloorPlan.objects.filter(image_hash=image_hash).only('image').first()
+        if floorplan is None:
+            raise Http404
+        path = get_thumbnail(floorplan.image.name, image_hash, size, extension)
+    return _immutable_file_response(path, extension)
+
+
+def _immutable_file_response(path, extension):
+    response = FileResponse(default_storage.open(path), content_type=TILE_CONTENT_TYPES[extension])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SatConfig(AppConfig):
+    name = 'sat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,153 @@
+"""
+ASGI config for sat project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be run with an ASGI server, e.g. ``uvicorn sat.asgi:application``.
+
+Django 2.0 only ships a WSGI handler, so ASGIHandler below follows the one
+Django 3.0 adds: the event loop reads requests and writes responses, and
+each view runs in a thread from the loop's executor, so the database work
+of the read endpoints never blocks the loop. Slow clients then cost a
+coroutine rather than a worker. Responses with an `async_streaming_content`
+iterator (the location event streams) are sent from the loop without
+holding a thread at all.
+"""
+
+import asyncio
+import os
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+import django
+from asgiref.sync import AsyncToSync, sync_to_async
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sat.settings")
+django.setup(set_prefix=False)
+
+from django.conf import settings  # noqa: E402
+from django.core import signals  # noqa: E402
+from django.core.handlers import base  # noqa: E402
+from django.core.handlers.wsgi import WSGIRequest, get_script_name  # noqa: E402
+from django.urls import set_script_prefix  # noqa: E402
+
+
+class ASGIHandler(base.BaseHandler):
+    request_class = WSGIRequest
+
+    def __init__(self):
+        super(ASGIHandler, self).__init__()
+        self.load_middleware()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type {}'.format(scope['type']))
+
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        response = await sync_to_async(self.get_response_in_thread)(self.build_environ(scope, body))
+
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': self.response_headers(response),
+            })
+            if hasattr(response, 'async_streaming_content'):
+                async for chunk in response.async_streaming_content:
+                    if disconnected.done():
+                        break
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body'})
+            elif response.streaming:
+                # Sync iterators may hold a database cursor, which has to
+                # stay on one thread.
+                await sync_to_async(self.stream_in_thread)(response, AsyncToSync(send))
+            else:
+                await send({'type': 'http.response.body', 'body': response.content})
+        finally:
+            disconnected.cancel()
+            if response.streaming:
+                await sync_to_async(response.close)()
+            body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        # Large uploads go to disk, as Django does with WSGI.
+        body = SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    def get_response_in_thread(self, environ):
+        set_script_prefix(get_script_name(environ))
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        request = self.request_class(environ)
+        response = self.get_response(request)
+        if not response.streaming:
+            # Sends request_finished from the thread that did the work, which
+            # closes its database connection.
+            response.close()
+        return response
+
+    def stream_in_thread(self, response, send):
+        for chunk in response:
+            send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        send({'type': 'http.response.body'})
+
+    def build_environ(self, scope, body):
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('ascii'),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'SERVER_NAME': scope.get('server', ('localhost', 80))[0],
+            'SERVER_PORT': str(scope.get('server', ('localhost', 80))[1]),
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1')
+            if name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            elif name == 'content-type':
+                key = 'CONTENT_TYPE'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            value = value.decode('latin1')
+            environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    def response_headers(self, response):
+        headers = [(name.lower().encode('ascii'), value.encode('latin1')) for name, value in response.items()]
+        for cookie in response.cookies.values():
+            headers.append((b'set-cookie', cookie.output(header='').strip().encode('ascii')))
+        return headers
+
+
+application = ASGIHandler()
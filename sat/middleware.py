@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from .perf import collect_metrics, current_metrics
+from .routers import replica_reads
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+perf_logger = logging.getLogger('sat.perf')
+
+re_accepts_br = re.compile(r'\bbr\b')
+
+# Only the API's data formats are compressed. HTML pages are not: they mix
+# secrets such as the CSRF token with text from the request, which BREACH
+# recovers from compressed sizes. Images are compressed already.
+re_compressible = re.compile(r'^(text/csv|application/(json|msgpack|x-ndjson|jsonl|[\w.-]+\+json))$')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware for JSON, MessagePack, NDJSON and CSV responses, using Brotli
+    instead when the client accepts it and the brotli package is installed.
+
+    Event streams are left alone: they are flushed event by event, and under
+    ASGI sent from `async_streaming_content`, which is not compressed.
+    """
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type == 'text/event-stream' or not re_compressible.match(content_type):
+            return response
+        accepts_br = re_accepts_br.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is None or not accepts_br or response.streaming:
+            return super(CompressionMiddleware, self).process_response(request, response)
+
+        if len(response.content) < 200 or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        # Quality 5 compresses JSON about as fast as gzip, and smaller.
+        compressed_content = brotli.compress(response.content, quality=5)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response['Content-Length'] = str(len(response.content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'br'
+        return response
+
+
+class PerformanceMiddleware:
+    """
+    Measure every request: total latency, number and time of SQL queries,
+    and the timings recorded with sat.perf.timed() (such as `serialize`).
+    They are logged as one JSON object per line to the `sat.perf` logger,
+    which `manage.py perf_report` summarizes, and with PERF_SERVER_TIMING
+    also sent in a Server-Timing header.
+
+    Opt-in query checks, logged to the same logger:
+    PERF_SLOW_QUERY_MS flags single queries slower than that, and
+    PERF_REPEATED_QUERY_THRESHOLD flags a statement run that many times or
+    more in one request, the mark of an N+1 query.
+
+    Streaming responses are measured until they start.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_metrics() as metrics, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self.record_query))
+            response = self.get_response(request)
+        elapsed = metrics.elapsed()
+
+        if settings.PERF_SERVER_TIMING:
+            entries = [('db', metrics.query_time, '{} queries'.format(metrics.queries))]
+            entries.extend((name, duration, None) for name, duration in sorted(metrics.timings.items()))
+            entries.append(('total', elapsed, None))
+            response['Server-Timing'] = ', '.join(
+                '{};dur={:.1f}'.format(name, duration * 1000) + (';desc="{}"'.format(desc) if desc else '')
+                for name, duration, desc in entries
+            )
+
+        route = request.resolver_match.view_name if request.resolver_match else None
+        self.log('request', method=request.method, route=route, path=request.path,
+                 status=response.status_code, total_ms=elapsed * 1000,
+                 queries=metrics.queries, db_ms=metrics.query_time * 1000,
+                 **{name + '_ms': duration * 1000 for name, duration in metrics.timings.items()})
+        for sql, duration in metrics.slow_queries:
+            self.log('slow_query', route=route, path=request.path, sql=sql, ms=duration * 1000)
+        threshold = settings.PERF_REPEATED_QUERY_THRESHOLD
+        if threshold:
+            for sql, count in metrics.statements.items():
+                if count >= threshold:
+                    self.log('repeated_query', route=route, path=request.path, sql=sql, count=count)
+        return response
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.record_query(sql, duration)
+                slow_ms = settings.PERF_SLOW_QUERY_MS
+                if slow_ms is not None and duration * 1000 >= slow_ms:
+                    metrics.slow_queries.append((sql, duration))
+
+    def log(self, event, **fields):
+        level = logging.INFO if event == 'request' else logging.WARNING
+        if perf_logger.isEnabledFor(level):
+            perf_logger.log(level, json.dumps(dict(event=event, **fields), sort_keys=True))
+
+
+class ReplicaMiddleware:
+    """
+    Serve safe requests (GET, HEAD, OPTIONS) from the read replica, see
+    sat.routers.PrimaryReplicaRouter.
+
+    A client that has just written is sent a cookie that keeps its requests
+    on the primary for REPLICA_PIN_SECONDS, so it never reads data older
+    than its own changes while the replica catches up.
+    """
+    cookie_name = 'sat_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') and self.cookie_name not in request.COOKIES:
+            with replica_reads():
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(self.cookie_name, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
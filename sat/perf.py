@@ -0,0 +1,73 @@
+"""
+Per-request performance metrics, collected by
+sat.middleware.PerformanceMiddleware: SQL queries and their time, and named
+timings such as `serialize` recorded with `timed()`.
+
+Each request is handled start to finish by one thread (under ASGI too, see
+sat.asgi), so the metrics of the current request are kept per thread.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.timings = Counter()
+        # SQL text (with placeholders, so the same statement with different
+        # parameters counts once) -> number of executions
+        self.statements = Counter()
+        self.slow_queries = []
+        self._depth = Counter()
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.query_time += duration
+        self.statements[sql] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_metrics():
+    """
+    The metrics of the request being handled by this thread, or None.
+    """
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def collect_metrics():
+    metrics = _local.metrics = RequestMetrics()
+    try:
+        yield metrics
+    finally:
+        _local.metrics = None
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's `name` timing.
+    Nested blocks of the same name are counted once.
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    metrics._depth[name] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics._depth[name] -= 1
+        if not metrics._depth[name]:
+            metrics.timings[name] += time.perf_counter() - started
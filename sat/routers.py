@@ -0,0 +1,61 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICA_DB_ALIAS = 'replica'
+
+_local = threading.local()
+
+
+@contextmanager
+def _replica_reads(allowed):
+    previous = getattr(_local, 'replica_reads', False)
+    _local.replica_reads = allowed
+    try:
+        yield
+    finally:
+        _local.replica_reads = previous
+
+
+def replica_reads():
+    """
+    Let reads in the block go to the replica, when one is configured.
+    """
+    return _replica_reads(True)
+
+
+def primary_reads():
+    """
+    Send reads in the block to the primary, even inside replica_reads(), for
+    data that must not be older than what other requests have seen, such as
+    what is written to a shared cache.
+    """
+    return _replica_reads(False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary (`default`) database. Reads go to the replica
+    inside replica_reads() (safe requests, see
+    sat.middleware.ReplicaMiddleware), unless a transaction is open on the
+    primary, whose reads must see its writes. Everything else, such as
+    management commands and the job worker, reads from the primary.
+    """
+    def db_for_read(self, model, **hints):
+        if (getattr(_local, 'replica_reads', False) and REPLICA_DB_ALIAS in settings.DATABASES
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != REPLICA_DB_ALIAS
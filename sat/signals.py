@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL lets readers work while a write is in progress, and with
+    # synchronous=NORMAL a commit no longer waits for the disk; the busy
+    # timeout makes writers queue for the lock instead of failing.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for name, value in settings.SQLITE_PRAGMAS.items():
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # Connections kept open between requests (CONN_MAX_AGE) may have been
+    # dropped by the server meanwhile; reconnect instead of failing the
+    # request. Django's own close_old_connections only checks connections
+    # that had an error.
+    for connection in connections.all():
+        if (connection.connection is not None and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.in_atomic_block and not connection.is_usable()):
+            connection.close()